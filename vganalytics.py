@@ -0,0 +1,221 @@
+import argparse
+import time
+
+import numpy as np
+
+from vgboard import VGBoard
+
+#
+# vganalytics
+#
+# implements batch evaluation of many boards at once w/ NumPy (analytics only,
+# the game server itself does not need NumPy)
+#
+# boards are (N, rows, columns) int8 arrays in list layout (row 0 on top,
+# 0 = empty, 1/2 = player), lines are found by AND-ing shifted views of the
+# board, one view per coin of a line, instead of looping over games
+#
+#   python vganalytics.py --db db/gameserver.sqlite
+#   python vganalytics.py --check    (compares w/ VGBoard on all board shapes)
+
+
+# (row step, column step) of horizontal, vertical and both diagonal lines
+arrDirections = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def boardsFromBitboards(arrBlobs, iRows=VGBoard.boardRows, iColumns=VGBoard.boardColumns):
+    # bitboard blobs (see VGBoard.toBlob) -> (N, rows, columns) int8
+    # blobs of larger boards don't fit into 64 bit, so bytes are unpacked to bits
+    iBytes = len(arrBlobs[0]) // 2
+    arrBytes = np.frombuffer(b"".join(arrBlobs), dtype=np.uint8).reshape(len(arrBlobs), 2, iBytes)
+    arrBitboards = np.unpackbits(arrBytes, axis=2, bitorder="little")
+    # bit of cell [row][column] in list layout
+    arrBits = np.arange(iColumns)[None, :] * (iRows + 1) + (iRows - 1 - np.arange(iRows))[:, None]
+    arrCells = arrBitboards[:, :, arrBits]
+    return (arrCells[:, 0] + 2 * arrCells[:, 1]).astype(np.int8)
+
+
+def boardsFromMoves(arrMoveLists, iRows=VGBoard.boardRows, iColumns=VGBoard.boardColumns):
+    # move logs (columns, 0 based, player 1 starts) -> (N, rows, columns) int8
+    # all boards are replayed together, one step per move number
+    iBoards = len(arrMoveLists)
+    iMaxMoves = max([len(arrColumns) for arrColumns in arrMoveLists], default=0)
+    arrMoves = np.full((iBoards, iMaxMoves), -1, dtype=np.int16)
+    for iBoard, arrColumns in enumerate(arrMoveLists):
+        arrMoves[iBoard, :len(arrColumns)] = arrColumns
+    arrBoards = np.zeros((iBoards, iRows, iColumns), dtype=np.int8)
+    arrHeights = np.zeros((iBoards, iColumns), dtype=np.int16)
+    for iMove in range(iMaxMoves):
+        arrColumns = arrMoves[:, iMove]
+        arrIndex = np.nonzero(arrColumns >= 0)[0]
+        arrColumns = arrColumns[arrIndex]
+        arrHeight = arrHeights[arrIndex, arrColumns]
+        # illegal moves (full column) are ignored
+        bLegal = arrHeight < iRows
+        arrIndex, arrColumns, arrHeight = arrIndex[bLegal], arrColumns[bLegal], arrHeight[bLegal]
+        arrBoards[arrIndex, iRows - 1 - arrHeight, arrColumns] = 1 + iMove % 2
+        arrHeights[arrIndex, arrColumns] += 1
+    return arrBoards
+
+
+def _lineViews(arrCells, iRowStep, iColumnStep, iConnect):
+    # iConnect views of arrCells (N, rows, columns), view k holds the k-th cell of
+    # every line of direction (iRowStep, iColumnStep), so all views have the same shape
+    # no views, if no line of that direction fits on the board (win length longer than
+    # a side), so no slice ever gets a negative stop (counted from the end by NumPy)
+    iRows, iColumns = arrCells.shape[1], arrCells.shape[2]
+    iSpan = iConnect - 1
+    if iSpan * iRowStep >= iRows or iSpan * abs(iColumnStep) >= iColumns:
+        return []
+    arrViews = []
+    for k in range(iConnect):
+        sliceRows = slice(k * iRowStep, iRows - (iSpan - k) * iRowStep)
+        if iColumnStep >= 0:
+            sliceColumns = slice(k * iColumnStep, iColumns - (iSpan - k) * iColumnStep)
+        else:
+            sliceColumns = slice(iSpan - k, iColumns - k)
+        arrViews.append(arrCells[:, sliceRows, sliceColumns])
+    return arrViews
+
+
+def evaluateBoards(arrBoards, iConnect=4):
+    # winners, stalemates, threats and column heights of all boards (N, rows, columns)
+    #   won:       (N, 2) bool, player 1/2 has iConnect coins in a line
+    #   winner:    (N,) 0 = none, 1/2 = player (1, if a broken board has both)
+    #   stalemate: (N,) bool, board full w/o winner
+    #   threats:   (N, 2) empty cells, which would complete a line of player 1/2
+    #   heights:   (N, columns) coins per column, moves: (N,) coins on board
+    arrBoards = np.asarray(arrBoards, dtype=np.int8)
+    iBoards = arrBoards.shape[0]
+    arrEmpty = arrBoards == 0
+    arrWon = np.zeros((iBoards, 2), dtype=bool)
+    arrThreats = np.zeros((iBoards, 2), dtype=np.int32)
+
+    for iPlayer in (0, 1):
+        arrOwn = arrBoards == iPlayer + 1
+        arrThreatCells = np.zeros(arrBoards.shape, dtype=bool)
+        for iRowStep, iColumnStep in arrDirections:
+            arrOwnViews = _lineViews(arrOwn, iRowStep, iColumnStep, iConnect)
+            if not arrOwnViews:
+                continue
+            arrLine = arrOwnViews[0].copy()
+            for arrView in arrOwnViews[1:]:
+                arrLine &= arrView
+            arrWon[:, iPlayer] |= arrLine.any(axis=(1, 2))
+
+            # line w/ all but one own coins and that one cell empty -> threat on that cell
+            arrCount = np.sum(arrOwnViews, axis=0, dtype=np.int8)
+            arrMissingOne = arrCount == iConnect - 1
+            for arrEmptyView, arrThreatView in zip(_lineViews(arrEmpty, iRowStep, iColumnStep, iConnect),
+                    _lineViews(arrThreatCells, iRowStep, iColumnStep, iConnect)):
+                arrThreatView |= arrEmptyView & arrMissingOne
+        arrThreats[:, iPlayer] = arrThreatCells.sum(axis=(1, 2))
+
+    arrHeights = (~arrEmpty).sum(axis=1)
+    arrMoves = arrHeights.sum(axis=1)
+    arrWinner = np.where(arrWon[:, 0], 1, np.where(arrWon[:, 1], 2, 0)).astype(np.int8)
+    return {
+        "won": arrWon,
+        "winner": arrWinner,
+        "stalemate": (arrMoves == arrBoards.shape[1] * arrBoards.shape[2]) & (arrWinner == 0),
+        "threats": arrThreats,
+        "heights": arrHeights,
+        "moves": arrMoves }
+
+
+def checkShapes(iBoards=200, iSeed=0):
+    # compares evaluateBoards w/ VGBoard.hasWon on random boards of every valid shape,
+    # returns list of (shape, board index) of differences
+    import random
+    from vgboard import VGBoardShape
+    generator = random.Random(iSeed)
+    arrMismatches = []
+    for iRows in range(VGBoardShape.iMinSize, VGBoardShape.iMaxSize + 1):
+        for iColumns in range(VGBoardShape.iMinSize, VGBoardShape.iMaxSize + 1):
+            for iConnect in range(VGBoardShape.iMinConnect, max(iRows, iColumns) + 1):
+                arrGames = []
+                for _ in range(iBoards):
+                    # random play, continued after wins, so both players may have lines
+                    board = VGBoard(iRows, iColumns, iConnect)
+                    for iMove in range(generator.randint(0, iRows * iColumns)):
+                        board.dropCoin(generator.choice(board.legalMoves()), 1 + iMove % 2)
+                    arrGames.append(board)
+                jEval = evaluateBoards(np.array([board.toList() for board in arrGames], dtype=np.int8), iConnect)
+                for iBoard, board in enumerate(arrGames):
+                    if (bool(jEval["won"][iBoard, 0]), bool(jEval["won"][iBoard, 1])) != (board.hasWon(1), board.hasWon(2)):
+                        arrMismatches.append(((iRows, iColumns, iConnect), iBoard))
+    return arrMismatches
+
+
+def streamBoards(gameDB, iChunkSize=10000, iAfterGameID=0):
+    # yields (shape, gameIDs, statuses, boards) for all stored games in chunks of up to
+    # iChunkSize, one array per board shape (rows, columns, connect) of a chunk
+    for arrChunk in gameDB.getStoredBoardChunks(iAfterGameID, iChunkSize):
+        dictShapes = {}
+        for rGame in arrChunk:
+            dictShapes.setdefault(rGame[4], []).append(rGame)
+        for tShape, arrGames in dictShapes.items():
+            iRows, iColumns = tShape[0], tShape[1]
+            arrGameIDs = np.array([rGame[0] for rGame in arrGames], dtype=np.int64)
+            arrStatuses = np.array([rGame[1] for rGame in arrGames])
+            arrBoards = np.zeros((len(arrGames), iRows, iColumns), dtype=np.int8)
+            arrBitboardIndex = [iIndex for iIndex, rGame in enumerate(arrGames) if rGame[2] is not None]
+            arrMovesIndex = [iIndex for iIndex, rGame in enumerate(arrGames) if rGame[2] is None]
+            if arrBitboardIndex:
+                arrBoards[arrBitboardIndex] = boardsFromBitboards([arrGames[iIndex][2] for iIndex in arrBitboardIndex], iRows, iColumns)
+            if arrMovesIndex:
+                arrBoards[arrMovesIndex] = boardsFromMoves([arrGames[iIndex][3] for iIndex in arrMovesIndex], iRows, iColumns)
+            yield tShape, arrGameIDs, arrStatuses, arrBoards
+
+
+def summarizeGames(gameDB, iChunkSize=10000):
+    # evaluates all stored games, counts results and compares them with stored status
+    jSummary = { "games": 0, "won1": 0, "won2": 0, "stalemates": 0, "open": 0,
+        "threats1": 0, "threats2": 0, "mismatches": [] }
+    for tShape, arrGameIDs, arrStatuses, arrBoards in streamBoards(gameDB, iChunkSize):
+        jEval = evaluateBoards(arrBoards, tShape[2])
+        jSummary["games"] += len(arrGameIDs)
+        jSummary["won1"] += int((jEval["winner"] == 1).sum())
+        jSummary["won2"] += int((jEval["winner"] == 2).sum())
+        jSummary["stalemates"] += int(jEval["stalemate"].sum())
+        jSummary["open"] += int(((jEval["winner"] == 0) & ~jEval["stalemate"]).sum())
+        jSummary["threats1"] += int(jEval["threats"][:, 0].sum())
+        jSummary["threats2"] += int(jEval["threats"][:, 1].sum())
+        # decided boards, whose stored status says otherwise (canceled games excluded)
+        arrExpected = np.where(jEval["winner"] == 1, "1WON", np.where(jEval["winner"] == 2, "2WON",
+            np.where(jEval["stalemate"], "STALEMATE", "")))
+        arrMismatch = (arrExpected != "") & (arrStatuses != arrExpected) & (arrStatuses != "CANCELED")
+        jSummary["mismatches"].extend(int(gameID) for gameID in arrGameIDs[arrMismatch])
+    return jSummary
+
+
+def main(arrArgs=None):
+    parser = argparse.ArgumentParser(description="Batch evaluation of all stored Connect 4 games")
+    parser.add_argument("--db", default="/db/gameserver.sqlite", help="database file (as passed to GameDB)")
+    parser.add_argument("--chunk", type=int, default=10000, help="boards evaluated at once")
+    parser.add_argument("--check", action="store_true", help="compare w/ VGBoard.hasWon on random boards of all shapes and exit")
+    args = parser.parse_args(arrArgs)
+
+    if args.check:
+        arrMismatches = checkShapes()
+        print("boards not matching VGBoard.hasWon:", len(arrMismatches), arrMismatches[:20])
+        return arrMismatches
+
+    from vgdatabase import GameDB
+    gameDB = GameDB(args.db, fFlushInterval=0)
+    try:
+        fStart = time.perf_counter()
+        jSummary = summarizeGames(gameDB, args.chunk)
+        fDuration = time.perf_counter() - fStart
+    finally:
+        gameDB.close()
+    print(jSummary["games"], "games in", round(fDuration, 3), "s")
+    print("won by player 1:", jSummary["won1"], " won by player 2:", jSummary["won2"],
+        " stalemates:", jSummary["stalemates"], " undecided:", jSummary["open"])
+    print("threats player 1:", jSummary["threats1"], " threats player 2:", jSummary["threats2"])
+    print("status not matching board:", jSummary["mismatches"][:20], "..." if len(jSummary["mismatches"]) > 20 else "")
+    return jSummary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#
+# vgarchive
+#
+# implements compact storage format of finished games
+#
+# a game is stored as the sequence of its played columns (0-6), 3 bits per
+# move, first move in the lowest bits: 42 moves of a full board fit into 16 bytes
+# the number of moves is stored beside the blob, as column 0 is all zero bits
+# the player of a move follows from its number, player 1 always starts
+# boards w/ more than 8 columns need 4 bits per move (see VGBoardShape.iBitsPerMove)
+
+
+iBitsPerMove:int = 3
+
+
+def packMoves(arrColumns, iBits=iBitsPerMove):
+    # list of columns (0 based) -> bytes
+    iPacked = 0
+    for iMove, iColumn in enumerate(arrColumns):
+        if iColumn < 0 or iColumn >= 1 << iBits:
+            raise ValueError("Column " + str(iColumn) + " can't be packed")
+        iPacked |= iColumn << (iMove * iBits)
+    return iPacked.to_bytes((len(arrColumns) * iBits + 7) // 8, "little")
+
+
+def unpackMoves(bPacked, iMoves, iBits=iBitsPerMove):
+    # bytes, number of moves -> list of columns (0 based)
+    iPacked = int.from_bytes(bPacked or b"", "little")
+    iMask = (1 << iBits) - 1
+    return [(iPacked >> (iMove * iBits)) & iMask for iMove in range(iMoves)]
+
+
+def playerOfMove(iMoveNo):
+    # player (1, 2) of move iMoveNo (1 based)
+    return 2 - (iMoveNo % 2)
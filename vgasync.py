@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# class VGAsyncGameController
+#
+# implements async interface on top of the sync game controller / GameDB
+#
+# calls touching SQLite are queued for one dedicated writer task, which runs
+# them one after another on its own thread - SQLite only allows one writer
+# anyway, so requests no longer block workers of the API threadpool while
+# waiting for commits and the event loop stays free for other connections
+# reads of games held in the game cache are answered directly in the event loop
+
+
+class VGAsyncGameController():
+    def __init__(self, gameController, iQueueSize=10000):
+        self.gameController = gameController
+        self.iQueueSize = iQueueSize
+        self.queueJobs = None
+        self.writerTask = None
+        self.executor = None
+        self.iJobs = 0
+
+    async def start(self):
+        # must be called from within the running event loop (i.e. on startup)
+        self.queueJobs = asyncio.Queue(self.iQueueSize)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="VGGameDBWriter")
+        # statements of request paths are compiled on the connection of the writer thread
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.gameController.prepareStatements)
+        self.writerTask = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        # finish queued jobs, then stop writer
+        if self.writerTask is None:
+            return
+        await self.queueJobs.join()
+        self.writerTask.cancel()
+        try:
+            await self.writerTask
+        except asyncio.CancelledError:
+            pass
+        self.writerTask = None
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.gameController.close)
+        self.executor.shutdown()
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            callback, args, future = await self.queueJobs.get()
+            try:
+                if not future.cancelled():
+                    future.set_result(await loop.run_in_executor(self.executor, callback, *args))
+            except Exception as error:
+                if not future.cancelled():
+                    future.set_exception(error)
+            finally:
+                self.iJobs += 1
+                self.queueJobs.task_done()
+
+    async def _call(self, callback, *args):
+        # queue callback for the writer task and wait for its result
+        future = asyncio.get_running_loop().create_future()
+        await self.queueJobs.put((callback, args, future))
+        return await future
+
+    async def _read(self, gameID, callback, *args):
+        # game in cache -> no database access needed, answer directly
+        if self.gameController.isGameCached(gameID):
+            return callback(*args)
+        return await self._call(callback, *args)
+
+    def getQueueDepth(self):
+        return self.queueJobs.qsize() if self.queueJobs is not None else 0
+
+    ### async versions of the game controller API
+    async def registerSession(self, sSessionToken):
+        return await self._call(self.gameController.registerSession, sSessionToken)
+
+    async def isSessionRegistered(self, sSessionToken):
+        return await self._call(self.gameController.isSessionRegistered, sSessionToken)
+
+    async def attachPlayerToFreeGameSlot(self, sSessionToken, iRows=None, iColumns=None, iConnect=None):
+        return await self._call(self.gameController.attachPlayerToFreeGameSlot, sSessionToken, iRows, iColumns, iConnect)
+
+    async def dropCoin(self, gameID, playerNo, column, iExpectedVersion=None):
+        return await self._call(self.gameController.dropCoin, gameID, playerNo, column, iExpectedVersion)
+
+    async def dropCoins(self, gameID, arrColumns, iExpectedVersion=None):
+        return await self._call(self.gameController.dropCoins, gameID, arrColumns, iExpectedVersion)
+
+    async def setGameStatus(self, gameID, sStatus):
+        return await self._call(self.gameController.setGameStatus, gameID, sStatus)
+
+    async def getGameStatus(self, gameID):
+        return await self._read(gameID, self.gameController.getGameStatus, gameID)
+
+    async def getGameVersion(self, gameID):
+        return await self._read(gameID, self.gameController.getGameVersion, gameID)
+
+    async def getGameStatusData(self, gameID, playerNo, sFormat="pitch"):
+        return await self._read(gameID, self.gameController.getGameStatusData, gameID, playerNo, sFormat)
+
+    async def getSpectatorData(self, gameID):
+        return await self._read(gameID, self.gameController.getSpectatorData, gameID)
+
+    async def getGameFrame(self, gameID):
+        return await self._read(gameID, self.gameController.getGameFrame, gameID)
+
+    async def preloadActiveGames(self, iMaxGames=None):
+        return await self._call(self.gameController.preloadActiveGames, iMaxGames)
+
+    async def getGameMoves(self, gameID):
+        return await self._call(self.gameController.getGameMoves, gameID)
+
+    async def archiveFinishedGames(self, iBatchSize=500):
+        return await self._call(self.gameController.archiveFinishedGames, iBatchSize)
+
+    async def cancelInactiveGames(self, fTimeout, iBatchSize=500):
+        return await self._call(self.gameController.cancelInactiveGames, fTimeout, iBatchSize)
+
+    async def incrementalVacuum(self, iPages=1000):
+        return await self._call(self.gameController.incrementalVacuum, iPages)
+
+    async def createWaitingGame(self, sSessionToken, iRows=None, iColumns=None, iConnect=None):
+        return await self._call(self.gameController.createWaitingGame, sSessionToken, iRows, iColumns, iConnect)
+
+    async def joinWaitingGame(self, gameID, sSessionToken):
+        return await self._call(self.gameController.joinWaitingGame, gameID, sSessionToken)
+
+    async def getWaitingGames(self):
+        return await self._call(self.gameController.getWaitingGames)
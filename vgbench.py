@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+#
+# vgbench
+#
+# load test and micro benchmarks for the gameserver
+#
+#   python vgbench.py load --pairs 500 --duration 60 --output run1.json
+#   python vgbench.py load --url http://localhost:3033 --pairs 100
+#   python vgbench.py micro --games 2000 --output micro1.json
+#   python vgbench.py compare run1.json run2.json
+#
+# load test drives the HTTP API with simulated client pairs playing random games,
+# without --url an in-process server on a temporary database is started, which
+# also allows to report the number of SQLite writes
+
+
+def percentile(arrValues, fPercent):
+    # nearest rank percentile of unsorted list
+    if not arrValues:
+        return 0.0
+    arrSorted = sorted(arrValues)
+    iIndex = min(len(arrSorted) - 1, max(0, int(round(fPercent / 100 * len(arrSorted) + 0.5)) - 1))
+    return arrSorted[iIndex]
+
+
+def summarize(arrValues):
+    # latency summary in ms
+    return {
+        "count": len(arrValues),
+        "p50": round(percentile(arrValues, 50) * 1000, 3),
+        "p95": round(percentile(arrValues, 95) * 1000, 3),
+        "p99": round(percentile(arrValues, 99) * 1000, 3),
+        "max": round(max(arrValues) * 1000, 3) if arrValues else 0.0 }
+
+
+class VGLoadStats():
+    def __init__(self):
+        self.dictLatencies = {}
+        self.dictErrors = {}
+        self.iGamesFinished = 0
+        self.iMoves = 0
+
+    def add(self, sEndpoint, fSeconds, bOk=True):
+        self.dictLatencies.setdefault(sEndpoint, []).append(fSeconds)
+        if not bOk:
+            self.dictErrors[sEndpoint] = self.dictErrors.get(sEndpoint, 0) + 1
+
+    def report(self, fDuration):
+        iRequests = sum(len(arrValues) for arrValues in self.dictLatencies.values())
+        return {
+            "duration": round(fDuration, 3),
+            "requests": iRequests,
+            "throughput": round(iRequests / fDuration, 1) if fDuration else 0.0,
+            "games_finished": self.iGamesFinished,
+            "moves": self.iMoves,
+            "errors": self.dictErrors,
+            "endpoints": { sEndpoint: summarize(arrValues) for sEndpoint, arrValues in sorted(self.dictLatencies.items()) } }
+
+
+async def timedRequest(client, stats, sEndpoint, sMethod, sUrl):
+    fStart = time.perf_counter()
+    try:
+        response = await client.request(sMethod, sUrl)
+        stats.add(sEndpoint, time.perf_counter() - fStart, response.status_code < 400)
+        if response.status_code >= 400:
+            return None
+        return response.json()
+    except Exception:
+        stats.add(sEndpoint, time.perf_counter() - fStart, False)
+        return None
+
+
+async def playClient(client, stats, args, fDeadline):
+    # one simulated player: register, request games and play random moves until deadline
+    jData = await timedRequest(client, stats, "/registersession", "GET", "/registersession")
+    if jData is None:
+        return
+    sToken = jData["token"]
+    while time.monotonic() < fDeadline:
+        jGame = await timedRequest(client, stats, "/requestgame", "GET", "/requestgame/" + sToken)
+        if not jGame:
+            return
+        gameID = jGame["gameid"]
+        playerNo = jGame["playerno"]
+        sMyTurn = "PLAYER" + str(playerNo)
+        while time.monotonic() < fDeadline:
+            jStatus = await timedRequest(client, stats, "/gamestatus", "GET",
+                "/gamestatus/" + str(gameID) + "?playerno=" + str(playerNo))
+            if jStatus is None:
+                return
+            if jStatus["status"] in ("1WON", "2WON", "STALEMATE", "CANCELED"):
+                if playerNo == 1:
+                    stats.iGamesFinished += 1
+                break
+            if jStatus["status"] == sMyTurn:
+                await asyncio.sleep(random.uniform(0, args.move_delay))
+                # random column, try others while column is full
+                arrColumns = list(range(1, 8))
+                random.shuffle(arrColumns)
+                for iColumn in arrColumns:
+                    jMove = await timedRequest(client, stats, "/dropCoin", "POST",
+                        "/dropCoin/" + str(gameID) + "?playerno=" + str(playerNo) + "&key=" + str(iColumn))
+                    if jMove is not None and jMove["status"] == "ok":
+                        stats.iMoves += 1
+                        break
+                    if jMove is None or not jMove["status"].startswith("Column is full"):
+                        break
+                continue
+            await asyncio.sleep(args.poll)
+        else:
+            # test is over, leave game like a client closing its window
+            await timedRequest(client, stats, "/quitgame", "POST", "/quitgame/" + str(gameID))
+
+
+async def runLoad(args, sUrl):
+    import httpx
+    stats = VGLoadStats()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=sUrl, limits=limits, timeout=args.timeout) as client:
+        fStart = time.perf_counter()
+        fDeadline = time.monotonic() + args.duration
+        await asyncio.gather(*[playClient(client, stats, args, fDeadline) for i in range(args.pairs * 2)])
+        fDuration = time.perf_counter() - fStart
+    return stats.report(fDuration)
+
+
+def importServer():
+    # gameserver module on a temporary database (path of the server is relative to the
+    # current directory), w/o bot and reaper, so runs are repeatable
+    os.chdir(tempfile.mkdtemp(prefix="vgbench"))
+    os.environ["BOTTIMEOUT"] = "0"
+    os.environ["REAPINTERVAL"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import vgserver
+    return vgserver
+
+
+def startServer(iPort):
+    # in-process server on a temporary database, returns the game controller
+    import uvicorn
+    vgserver = importServer()
+    server = uvicorn.Server(uvicorn.Config(vgserver.vgserver, host="127.0.0.1", port=iPort, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, vgserver.gameController
+
+
+def getWriteCounts(gameController):
+    # rows changed in SQLite and flushes of game cache since server start
+    return {
+        "sqlite_changes": gameController.dbPool.getTotalChanges(),
+        "cache_flushes": gameController.getCacheStats()["flushes"],
+        "cache_flushed_games": gameController.getCacheStats()["flushedgames"] }
+
+
+def commandLoad(args):
+    server = gameController = None
+    sUrl = args.url
+    if sUrl is None:
+        server, gameController = startServer(args.port)
+        sUrl = "http://127.0.0.1:" + str(args.port)
+
+    jResult = asyncio.run(runLoad(args, sUrl))
+    jResult["config"] = { "url": args.url, "pairs": args.pairs, "duration": args.duration,
+        "poll": args.poll, "move_delay": args.move_delay, "connections": args.connections }
+    if gameController is not None:
+        jResult["writes"] = getWriteCounts(gameController)
+        server.should_exit = True
+    return jResult
+
+
+def timeCalls(callback, arrArgs):
+    # mean and percentiles of callback called once per entry of arrArgs
+    arrTimes = []
+    for args in arrArgs:
+        fStart = time.perf_counter()
+        callback(*args)
+        arrTimes.append(time.perf_counter() - fStart)
+    jResult = summarize(arrTimes)
+    jResult["mean_us"] = round(sum(arrTimes) / len(arrTimes) * 1000000, 3) if arrTimes else 0.0
+    return jResult
+
+
+def commandMicro(args):
+    # micro benchmarks of GameDB on a temporary database
+    vgserver = importServer()
+    from vgboard import VGBoard
+    gameController = vgserver.gameController
+    random.seed(args.seed)
+
+    # play random games, record every move for replay against fresh games
+    arrMoves = []
+    arrGames = []
+    for iGame in range(args.games):
+        sToken1 = "bench-" + str(iGame) + "-1"
+        sToken2 = "bench-" + str(iGame) + "-2"
+        gameController.registerSession(sToken1)
+        gameController.registerSession(sToken2)
+        gameID = gameController.attachPlayerToFreeGameSlot(sToken1)["gameid"]
+        gameController.attachPlayerToFreeGameSlot(sToken2)
+        arrGames.append(gameID)
+        # random legal game until win or stalemate
+        board = VGBoard()
+        playerNo = 1
+        while not board.isFull():
+            iColumn = random.choice(board.legalMoves())
+            board.dropCoin(iColumn, playerNo)
+            arrMoves.append((gameID, playerNo, str(iColumn + 1)))
+            if board.isWinningDrop(iColumn, playerNo):
+                break
+            playerNo = 3 - playerNo
+
+    fStart = time.perf_counter()
+    jDrop = timeCalls(gameController.dropCoin, arrMoves)
+    fDrop = time.perf_counter() - fStart
+    # full scan of finished boards w/o side effects (isGameFinished would store the status)
+    arrBoards = [(gameController.getGameBitboard(gameID),) for gameID in arrGames]
+    jResult = {
+        "config": { "games": args.games, "seed": args.seed },
+        "dropCoin": jDrop,
+        "dropCoin_per_second": round(len(arrMoves) / fDrop, 1) if fDrop else 0.0,
+        "hasWon_full": timeCalls(lambda board: board.hasWon(1) or board.hasWon(2), arrBoards),
+        "renderPitch": timeCalls(gameController.renderPitch, [(gameID, 1 + iIndex % 2) for iIndex, gameID in enumerate(arrGames)]),
+        "getGameStatus": timeCalls(gameController.getGameStatus, [(gameID,) for gameID in arrGames]),
+        "writes": getWriteCounts(gameController) }
+    gameController.close()
+    return jResult
+
+
+def commandCompare(args):
+    # relative change of all numbers found in both result files
+    with open(args.baseline) as fBaseline, open(args.current) as fCurrent:
+        jBaseline = json.load(fBaseline)
+        jCurrent = json.load(fCurrent)
+
+    def walk(jOld, jNew, sPath):
+        if isinstance(jOld, dict) and isinstance(jNew, dict):
+            for sKey in jOld:
+                if sKey in jNew and sKey != "config":
+                    walk(jOld[sKey], jNew[sKey], sPath + "." + sKey if sPath else sKey)
+        elif isinstance(jOld, (int, float)) and isinstance(jNew, (int, float)) and not isinstance(jOld, bool):
+            sChange = "n/a" if jOld == 0 else "{:+.1f}%".format((jNew - jOld) / jOld * 100)
+            print("{:<50} {:>14} {:>14} {:>9}".format(sPath, jOld, jNew, sChange))
+
+    walk(jBaseline, jCurrent, "")
+    return None
+
+
+def main(arrArgs=None):
+    parser = argparse.ArgumentParser(description="Load test and micro benchmarks for the Connect 4 gameserver")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parserLoad = subparsers.add_parser("load", help="simulate client pairs playing random games via HTTP")
+    parserLoad.add_argument("--url", default=None, help="server to test, default: start in-process server")
+    parserLoad.add_argument("--port", type=int, default=3034, help="port of in-process server")
+    parserLoad.add_argument("--pairs", type=int, default=100, help="number of simulated client pairs")
+    parserLoad.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parserLoad.add_argument("--poll", type=float, default=0.5, help="seconds between status polls of a client")
+    parserLoad.add_argument("--move-delay", type=float, default=0.2, help="max. seconds a client thinks before a move")
+    parserLoad.add_argument("--connections", type=int, default=200, help="max. open HTTP connections")
+    parserLoad.add_argument("--timeout", type=float, default=30, help="seconds until a request fails")
+    parserLoad.add_argument("--output", default=None, help="write results as JSON to file")
+
+    parserMicro = subparsers.add_parser("micro", help="time GameDB.dropCoin, full win check and renderPitch")
+    parserMicro.add_argument("--games", type=int, default=1000, help="number of random games to play")
+    parserMicro.add_argument("--seed", type=int, default=4, help="random seed")
+    parserMicro.add_argument("--output", default=None, help="write results as JSON to file")
+
+    parserCompare = subparsers.add_parser("compare", help="compare two result files")
+    parserCompare.add_argument("baseline")
+    parserCompare.add_argument("current")
+
+    args = parser.parse_args(arrArgs)
+    sOutput = os.path.abspath(args.output) if getattr(args, "output", None) else None
+    jResult = { "load": commandLoad, "micro": commandMicro, "compare": commandCompare }[args.command](args)
+    if jResult is None:
+        return
+    jResult["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    jResult["python"] = sys.version.split()[0]
+    if sOutput:
+        with open(sOutput, "w") as fOutput:
+            json.dump(jResult, fOutput, indent=2)
+    print(json.dumps(jResult, indent=2))
+
+
+if __name__ == "__main__":
+    main()
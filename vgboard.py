@@ -0,0 +1,222 @@
+import threading
+
+#
+# class VGBoard
+#
+# implements compact bitboard representation of a Connect 4 board
+#
+# every player owns one 64 bit integer, each column uses boardRows+1 bits
+# (one spare bit on top, so shifted lines never wrap into the next column):
+#
+#    6 13 20 27 34 41 48      <- spare bits, always 0
+#    5 12 19 26 33 40 47
+#    4 11 18 25 32 39 46
+#    3 10 17 24 31 38 45
+#    2  9 16 23 30 37 44
+#    1  8 15 22 29 36 43
+#    0  7 14 21 28 35 42      <- bottom row
+#
+# list representation used by the API (arrBoard[row][column]) has row 0 on top
+#
+# boards of other sizes (rows x columns, iConnect coins to win) use the same
+# layout with their own column height, lines to win are precomputed once per
+# shape (see VGBoardShape), Python ints grow beyond 64 bits as needed
+
+
+class VGBoardShape():
+    # limits of board variants: columns are selected w/ keys 1-9, moves of
+    # archived games are packed w/ at most 4 bits
+    iMinSize:int = 4
+    iMaxSize:int = 9
+    iMinConnect:int = 3
+
+    dictShapes = {}
+    lock = threading.Lock()
+
+    def __init__(self, iRows, iColumns, iConnect):
+        self.iRows = iRows
+        self.iColumns = iColumns
+        self.iConnect = iConnect
+        self.iColumnHeight = iRows + 1
+        # bytes per bitboard in blob, classic 7x6 board -> 8 (same blob as 2 x unsigned 64 bit)
+        self.iBlobBytes = max(8, (iColumns * self.iColumnHeight + 7) // 8)
+        # bits per move in archived move sequence
+        self.iBitsPerMove = max(1, (iColumns - 1).bit_length())
+
+        # all lines of iConnect cells as bitmasks, and per bit position the lines through it
+        self.arrLines = []
+        for iColumn in range(iColumns):
+            for iHeight in range(iRows):
+                for iColumnStep, iHeightStep in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    iLastColumn = iColumn + (iConnect - 1) * iColumnStep
+                    iLastHeight = iHeight + (iConnect - 1) * iHeightStep
+                    if iLastColumn < iColumns and 0 <= iLastHeight < iRows:
+                        self.arrLines.append(sum(1 << ((iColumn + k * iColumnStep) * self.iColumnHeight + iHeight + k * iHeightStep)
+                            for k in range(iConnect)))
+        self.arrCellLines = [tuple(iLine for iLine in self.arrLines if (iLine >> iPosition) & 1)
+            for iPosition in range(iColumns * self.iColumnHeight)]
+
+    @classmethod
+    def isValid(cls, iRows, iColumns, iConnect):
+        return (cls.iMinSize <= iRows <= cls.iMaxSize and cls.iMinSize <= iColumns <= cls.iMaxSize
+            and cls.iMinConnect <= iConnect <= max(iRows, iColumns))
+
+    @classmethod
+    def get(cls, iRows, iColumns, iConnect):
+        # shape w/ its line tables, built on first use and shared by all boards
+        tKey = (iRows, iColumns, iConnect)
+        shape = cls.dictShapes.get(tKey)
+        if shape is None:
+            if not cls.isValid(iRows, iColumns, iConnect):
+                raise ValueError("Invalid board " + str(iColumns) + "x" + str(iRows) + ", connect " + str(iConnect))
+            with cls.lock:
+                shape = cls.dictShapes.setdefault(tKey, cls(iRows, iColumns, iConnect))
+        return shape
+
+
+class VGBoard():
+    # classic board, default of all games
+    boardColumns:int = 7
+    boardRows:int = 6
+    iConnect:int = 4
+
+    # bits per column incl. spare bit
+    iColumnHeight:int = boardRows + 1
+
+    def __init__(self, iRows=None, iColumns=None, iConnect=None):
+        # shape of board w/ its line tables, class attributes are the classic board
+        self.shape = VGBoardShape.get(iRows or self.boardRows, iColumns or self.boardColumns, iConnect or self.iConnect)
+        self.boardRows = self.shape.iRows
+        self.boardColumns = self.shape.iColumns
+        self.iColumnHeight = self.shape.iColumnHeight
+        self.iConnect = self.shape.iConnect
+        # index 0 is player 1, index 1 is player 2
+        self.arrBitboards = [0, 0]
+        # number of coins per column
+        self.arrHeights = [0] * self.boardColumns
+        self.iMoves = 0
+
+    def canDrop(self, iColumn):
+        # iColumn is array index (0 based)
+        return 0 <= iColumn < self.boardColumns and self.arrHeights[iColumn] < self.boardRows
+
+    def isFull(self):
+        return self.iMoves == self.boardColumns * self.boardRows
+
+    def legalMoves(self):
+        # list of array indices of all columns still accepting a coin
+        return [iColumn for iColumn in range(self.boardColumns) if self.arrHeights[iColumn] < self.boardRows]
+
+    def dropCoin(self, iColumn, playerNo):
+        # drops coin of playerNo into column iColumn (0 based)
+        # returns row index in list representation or -1 if column is full
+        if not self.canDrop(iColumn):
+            return -1
+        iHeight = self.arrHeights[iColumn]
+        self.arrBitboards[playerNo - 1] |= 1 << (iColumn * self.iColumnHeight + iHeight)
+        self.arrHeights[iColumn] = iHeight + 1
+        self.iMoves += 1
+        return self.boardRows - 1 - iHeight
+
+    def hasWon(self, playerNo):
+        # check whole board of playerNo for iConnect connected coins
+        #   1 -> vertical, iColumnHeight -> horizontal,
+        #   iColumnHeight-1 / iColumnHeight+1 -> both diagonals
+        # spare bits stop lines from wrapping into the next column
+        iBitboard = self.arrBitboards[playerNo - 1]
+        for iShift in (1, self.iColumnHeight, self.iColumnHeight - 1, self.iColumnHeight + 1):
+            if self.iConnect == 4:
+                iPairs = iBitboard & (iBitboard >> iShift)
+                if iPairs & (iPairs >> (2 * iShift)):
+                    return True
+                continue
+            iLine = iBitboard
+            for k in range(1, self.iConnect):
+                iLine &= iBitboard >> (k * iShift)
+            if iLine:
+                return True
+        return False
+
+    def isWinningDrop(self, iColumn, playerNo):
+        # check only the lines through the topmost coin of column iColumn,
+        # i.e. the coin just dropped, against the precomputed line table
+        iBitboard = self.arrBitboards[playerNo - 1]
+        iPosition = iColumn * self.iColumnHeight + self.arrHeights[iColumn] - 1
+        if iPosition < 0 or not (iBitboard >> iPosition) & 1:
+            return False
+        for iLine in self.shape.arrCellLines[iPosition]:
+            if iBitboard & iLine == iLine:
+                return True
+        return False
+
+    def getCell(self, iRow, iColumn):
+        # returns 0, 1 or 2 for a cell given in list coordinates (row 0 on top)
+        iBit = 1 << (iColumn * self.iColumnHeight + self.boardRows - 1 - iRow)
+        if self.arrBitboards[0] & iBit:
+            return 1
+        if self.arrBitboards[1] & iBit:
+            return 2
+        return 0
+
+    def toList(self):
+        # converts board to list of lists, arrBoard[row][column] with row 0 on top
+        return [[self.getCell(iRow, iColumn) for iColumn in range(self.boardColumns)] for iRow in range(self.boardRows)]
+
+    def toBlob(self):
+        # both bitboards, unsigned little endian w/ iBlobBytes each
+        return (self.arrBitboards[0].to_bytes(self.shape.iBlobBytes, "little")
+            + self.arrBitboards[1].to_bytes(self.shape.iBlobBytes, "little"))
+
+    def copy(self):
+        # independent board of same shape, i.e. to try moves before applying them
+        board = VGBoard.__new__(VGBoard)
+        board.shape = self.shape
+        board.boardRows = self.boardRows
+        board.boardColumns = self.boardColumns
+        board.iColumnHeight = self.iColumnHeight
+        board.iConnect = self.iConnect
+        board.arrBitboards = list(self.arrBitboards)
+        board.arrHeights = list(self.arrHeights)
+        board.iMoves = self.iMoves
+        return board
+
+    def getShape(self):
+        # (rows, columns, coins to win)
+        return (self.boardRows, self.boardColumns, self.iConnect)
+
+    def _updateHeights(self):
+        # recalculate heights and move counter from bitboards
+        iOccupied = self.arrBitboards[0] | self.arrBitboards[1]
+        iColumnMask = (1 << self.iColumnHeight) - 1
+        for iColumn in range(self.boardColumns):
+            self.arrHeights[iColumn] = ((iOccupied >> (iColumn * self.iColumnHeight)) & iColumnMask).bit_length()
+        self.iMoves = sum(self.arrHeights)
+
+    @classmethod
+    def fromBlob(cls, bBlob, iRows=None, iColumns=None, iConnect=None):
+        board = cls(iRows, iColumns, iConnect)
+        iBytes = len(bBlob) // 2
+        board.arrBitboards = [int.from_bytes(bBlob[:iBytes], "little"), int.from_bytes(bBlob[iBytes:], "little")]
+        board._updateHeights()
+        return board
+
+    @classmethod
+    def fromList(cls, arrBoard, iConnect=None):
+        # converts list of lists (as stored in games.board JSON) to bitboard, size of board from list
+        board = cls(len(arrBoard), len(arrBoard[0]), iConnect)
+        for iRow in range(board.boardRows):
+            for iColumn in range(board.boardColumns):
+                playerNo = arrBoard[iRow][iColumn]
+                if playerNo in (1, 2):
+                    board.arrBitboards[playerNo - 1] |= 1 << (iColumn * board.iColumnHeight + board.boardRows - 1 - iRow)
+        board._updateHeights()
+        return board
+
+    @classmethod
+    def fromMoves(cls, arrColumns, iRows=None, iColumns=None, iConnect=None):
+        # replays move log (columns, 0 based), player 1 always starts
+        board = cls(iRows, iColumns, iConnect)
+        for iMove, iColumn in enumerate(arrColumns):
+            if board.dropCoin(iColumn, 1 + iMove % 2) < 0:
+                raise ValueError("Illegal move " + str(iMove + 1) + " in column " + str(iColumn))
+        return board
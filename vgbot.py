@@ -0,0 +1,373 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from vgboard import VGBoard
+
+#
+# class VGBotSolver
+#
+# implements computer opponent: negamax search w/ alpha-beta pruning
+#
+# positions are two bitboards (layout see VGBoard):
+#   current - coins of player to move
+#   mask    - coins of both players
+# current + mask is unique for every position and used as key for the
+# transposition table and the opening book
+#
+# search runs with iterative deepening until the time budget per move is used,
+# leaves are scored by the number of open threats (cells completing 4 coins)
+#
+# opening book is generated with
+#   python vgbot.py --build-book [--plies 2] [--budget 1.0]
+
+
+class VGTranspositionTable():
+    # flags of stored values
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    def __init__(self, iSize=1 << 18):
+        # fixed number of slots, new entries replace old ones in same slot,
+        # so memory is bounded and no separate eviction is needed
+        self.iSize = iSize
+        self.arrEntries = [None] * iSize
+        self.iHits = 0
+        self.iStores = 0
+
+    def get(self, iKey):
+        entry = self.arrEntries[iKey % self.iSize]
+        if entry is not None and entry[0] == iKey:
+            self.iHits += 1
+            return entry
+        return None
+
+    def put(self, iKey, iDepth, iFlag, iValue, iBestColumn):
+        self.arrEntries[iKey % self.iSize] = (iKey, iDepth, iFlag, iValue, iBestColumn)
+        self.iStores += 1
+
+    def clear(self):
+        self.arrEntries = [None] * self.iSize
+
+
+class VGSearchTimeout(Exception):
+    pass
+
+
+class VGBotSolver():
+    boardColumns:int = VGBoard.boardColumns
+    boardRows:int = VGBoard.boardRows
+    iColumnHeight:int = VGBoard.iColumnHeight
+
+    # masks of bottom cells and of all playable cells
+    iBottomMask:int = sum(1 << (iColumn * VGBoard.iColumnHeight) for iColumn in range(boardColumns))
+    iBoardMask:int = iBottomMask * ((1 << boardRows) - 1)
+    arrColumnMasks = [((1 << VGBoard.boardRows) - 1) << (iColumn * VGBoard.iColumnHeight) for iColumn in range(boardColumns)]
+    # center columns first, they take part in most lines
+    arrColumnOrder = sorted(range(boardColumns), key=lambda iColumn: abs(VGBoard.boardColumns // 2 - iColumn))
+
+    # score of a won position, reduced by number of moves, so faster wins are preferred
+    iWinScore:int = 1000
+
+    sDefaultBook = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vgbook.json")
+
+    def __init__(self, fMoveBudget=0.03, sBookFile=None, iTableSize=1 << 18):
+        self.fMoveBudget = fMoveBudget
+        self.table = VGTranspositionTable(iTableSize)
+        self.dictBook = {}
+        self.iNodes = 0
+        self.fDeadline = 0.0
+        self.loadBook(sBookFile if sBookFile is not None else self.sDefaultBook)
+
+    def loadBook(self, sBookFile):
+        # opening book: position key -> column (0 based), missing file means empty book
+        try:
+            with open(sBookFile) as fBook:
+                jBook = json.load(fBook)
+        except (OSError, ValueError):
+            return False
+        if jBook.get("rows") != self.boardRows or jBook.get("columns") != self.boardColumns:
+            return False
+        self.dictBook = { int(sKey): iColumn for sKey, iColumn in jBook["moves"].items() }
+        return True
+
+    @classmethod
+    def winningCells(cls, iPosition, iMask):
+        # empty cells, which would complete 4 coins of iPosition
+        # vertical
+        iResult = (iPosition << 1) & (iPosition << 2) & (iPosition << 3)
+        for iShift in (cls.iColumnHeight, cls.iColumnHeight - 1, cls.iColumnHeight + 1):
+            iPairs = (iPosition << iShift) & (iPosition << 2 * iShift)
+            iResult |= iPairs & (iPosition << 3 * iShift)
+            iResult |= iPairs & (iPosition >> iShift)
+            iPairs = (iPosition >> iShift) & (iPosition >> 2 * iShift)
+            iResult |= iPairs & (iPosition << iShift)
+            iResult |= iPairs & (iPosition >> 3 * iShift)
+        return iResult & (cls.iBoardMask ^ iMask)
+
+    def evaluate(self, iCurrent, iMask):
+        # heuristic for positions at search horizon, always below iWinScore - moves
+        return (bin(self.winningCells(iCurrent, iMask)).count("1")
+            - bin(self.winningCells(iCurrent ^ iMask, iMask)).count("1"))
+
+    def negamax(self, iCurrent, iMask, iMoves, iDepth, iAlpha, iBeta):
+        # score of position for player to move
+        self.iNodes += 1
+        if not self.iNodes & 255 and time.perf_counter() > self.fDeadline:
+            raise VGSearchTimeout()
+        if iMoves == self.boardColumns * self.boardRows:
+            return 0
+
+        iPossible = (iMask + self.iBottomMask) & self.iBoardMask
+        if self.winningCells(iCurrent, iMask) & iPossible:
+            return self.iWinScore - iMoves
+
+        iOpponentWins = self.winningCells(iCurrent ^ iMask, iMask)
+        iForced = iPossible & iOpponentWins
+        if iForced:
+            if iForced & (iForced - 1):
+                # opponent has two threats, can not block both
+                return -(self.iWinScore - iMoves - 1)
+            iPossible = iForced
+        # never play directly below a winning cell of opponent
+        iPossible &= ~(iOpponentWins >> 1)
+        if not iPossible:
+            return -(self.iWinScore - iMoves - 1)
+        if iDepth == 0:
+            return self.evaluate(iCurrent, iMask)
+
+        iKey = iCurrent + iMask
+        iAlphaStart = iAlpha
+        iTableColumn = -1
+        entry = self.table.get(iKey)
+        if entry is not None:
+            iTableColumn = entry[4]
+            if entry[1] >= iDepth:
+                if entry[2] == VGTranspositionTable.EXACT:
+                    return entry[3]
+                if entry[2] == VGTranspositionTable.LOWER:
+                    iAlpha = max(iAlpha, entry[3])
+                else:
+                    iBeta = min(iBeta, entry[3])
+                if iAlpha >= iBeta:
+                    return entry[3]
+
+        # move ordering: best move of table first, then moves creating most threats,
+        # ties broken by distance to center
+        arrMoves = []
+        for iOrder, iColumn in enumerate(self.arrColumnOrder):
+            iMove = iPossible & self.arrColumnMasks[iColumn]
+            if iMove:
+                if iColumn == iTableColumn:
+                    iRank = 1000
+                else:
+                    iRank = bin(self.winningCells(iCurrent | iMove, iMask | iMove)).count("1") * 10 - iOrder
+                arrMoves.append((iRank, iColumn, iMove))
+        arrMoves.sort(reverse=True)
+
+        iBest = -self.iWinScore
+        iBestColumn = arrMoves[0][1]
+        for iRank, iColumn, iMove in arrMoves:
+            iScore = -self.negamax(iCurrent ^ iMask, iMask | iMove, iMoves + 1, iDepth - 1, -iBeta, -iAlpha)
+            if iScore > iBest:
+                iBest = iScore
+                iBestColumn = iColumn
+            if iScore > iAlpha:
+                iAlpha = iScore
+                if iAlpha >= iBeta:
+                    break
+
+        if iBest <= iAlphaStart:
+            iFlag = VGTranspositionTable.UPPER
+        elif iBest >= iBeta:
+            iFlag = VGTranspositionTable.LOWER
+        else:
+            iFlag = VGTranspositionTable.EXACT
+        self.table.put(iKey, iDepth, iFlag, iBest, iBestColumn)
+        return iBest
+
+    def searchRoot(self, iCurrent, iMask, iMoves, iDepth):
+        # best column and its score for player to move, searched iDepth plies deep
+        iBestColumn = -1
+        iBest = -self.iWinScore - 1
+        iAlpha = -self.iWinScore
+        for iColumn in self.arrColumnOrder:
+            if iMask & (1 << (self.boardRows - 1 + iColumn * self.iColumnHeight)):
+                continue
+            iMove = (iMask + (1 << (iColumn * self.iColumnHeight))) & self.arrColumnMasks[iColumn]
+            if self.winningCells(iCurrent, iMask) & iMove:
+                return iColumn, self.iWinScore - iMoves
+            iScore = -self.negamax(iCurrent ^ iMask, iMask | iMove, iMoves + 1, iDepth - 1, -self.iWinScore, -iAlpha)
+            if iScore > iBest:
+                iBest = iScore
+                iBestColumn = iColumn
+                iAlpha = max(iAlpha, iScore)
+        return iBestColumn, iBest
+
+    def bestMove(self, board, playerNo, fBudget=None, iMaxDepth=None):
+        # best column (0 based) for playerNo on VGBoard board within time budget
+        # iMaxDepth limits search to a fixed number of plies (i.e. for self-play)
+        iCurrent = board.arrBitboards[playerNo - 1]
+        iMask = board.arrBitboards[0] | board.arrBitboards[1]
+        iMoves = board.iMoves
+
+        iBookColumn = self.dictBook.get(iCurrent + iMask)
+        if iBookColumn is not None and board.canDrop(iBookColumn):
+            return iBookColumn
+
+        self.fDeadline = time.perf_counter() + (fBudget if fBudget is not None else self.fMoveBudget)
+        self.iNodes = 0
+        iBestColumn = board.legalMoves()[0]
+        if iMaxDepth is None or iMaxDepth > self.boardColumns * self.boardRows - iMoves:
+            iMaxDepth = self.boardColumns * self.boardRows - iMoves
+        # iterative deepening, result of last completed depth is used
+        for iDepth in range(1, iMaxDepth + 1):
+            try:
+                iColumn, iScore = self.searchRoot(iCurrent, iMask, iMoves, iDepth)
+            except VGSearchTimeout:
+                break
+            if iColumn >= 0:
+                iBestColumn = iColumn
+            # game decided, deeper search will not change anything
+            if abs(iScore) > self.iWinScore // 2:
+                break
+        return iBestColumn
+
+
+#
+# class VGBotManager
+#
+# implements bot player on the gameserver
+#
+# games waiting longer than fJoinTimeout for a second player get the bot as
+# player 2, its moves are computed on a worker thread and go through dropCoin
+
+
+class VGBotManager():
+    # reserved, clients can't request games w/ it (see GameDB.arrReservedTokens)
+    sBotToken:str = "bot"
+
+    def __init__(self, gameDB, fJoinTimeout=30.0, fMoveBudget=0.03, sBookFile=None):
+        self.gameDB = gameDB
+        self.fJoinTimeout = fJoinTimeout
+        self.solver = VGBotSolver(fMoveBudget, sBookFile)
+        self.botPlayerID = gameDB.getPlayerID(self.sBotToken) or gameDB.registerSession(self.sBotToken)
+
+        self.queueGames = queue.Queue()
+        self.setBotGames = set()
+        self.lock = threading.Lock()
+        self.iGamesJoined = 0
+        self.iMoves = 0
+        self.fMoveTime = 0.0
+        self.fMaxMoveTime = 0.0
+
+        # games of bot from last run still running
+        for gameID, sStatus in gameDB.getActiveGamesOfPlayer(self.botPlayerID, 2):
+            self.setBotGames.add(gameID)
+            if sStatus == "PLAYER2":
+                self.queueGames.put(gameID)
+        gameDB.addGameListener(self.onGameChanged)
+
+        self.evStop = threading.Event()
+        self.moveThread = threading.Thread(target=self._moveLoop, name="VGBotMoves", daemon=True)
+        self.moveThread.start()
+        self.joinThread = None
+        if self.fJoinTimeout > 0:
+            self.joinThread = threading.Thread(target=self._joinLoop, name="VGBotJoin", daemon=True)
+            self.joinThread.start()
+
+    def onGameChanged(self, gameID, sStatus):
+        # called by GameDB on every change of a game, must return quickly
+        if gameID not in self.setBotGames:
+            return
+        if sStatus == "PLAYER2":
+            self.queueGames.put(gameID)
+        elif sStatus != "PLAYER1":
+            with self.lock:
+                self.setBotGames.discard(gameID)
+
+    def _joinLoop(self):
+        while not self.evStop.wait(min(1.0, self.fJoinTimeout / 2)):
+            for gameID in self.gameDB.attachBotToWaitingGames(self.botPlayerID, self.fJoinTimeout):
+                self.adoptGame(gameID)
+
+    def adoptGame(self, gameID):
+        # bot joined game gameID as player 2 (by join loop or, sharded, by the router)
+        with self.lock:
+            self.setBotGames.add(gameID)
+        self.iGamesJoined += 1
+        # player 1 might already have moved before game was registered as bot game
+        self.queueGames.put(gameID)
+
+    def _moveLoop(self):
+        while not self.evStop.is_set():
+            try:
+                gameID = self.queueGames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if self.gameDB.getGameStatus(gameID) != "PLAYER2":
+                continue
+            if self.gameDB.getGamePlayers(gameID)[1] != self.botPlayerID:
+                continue
+            # move is only applied, if game did not change while computing it (i.e. player quit)
+            iVersion = self.gameDB.getGameVersion(gameID)
+            board = self.gameDB.getGameBitboard(gameID)
+            fStart = time.perf_counter()
+            iColumn = self.solver.bestMove(board, 2)
+            fTime = time.perf_counter() - fStart
+            self.iMoves += 1
+            self.fMoveTime += fTime
+            self.fMaxMoveTime = max(self.fMaxMoveTime, fTime)
+            self.gameDB.dropCoin(gameID, 2, str(iColumn + 1), iVersion)
+
+    def getStats(self):
+        return {
+            "games": len(self.setBotGames),
+            "joined": self.iGamesJoined,
+            "moves": self.iMoves,
+            "avgmovetime": self.fMoveTime / self.iMoves if self.iMoves else 0.0,
+            "maxmovetime": self.fMaxMoveTime,
+            "tablehits": self.solver.table.iHits }
+
+    def stop(self):
+        self.evStop.set()
+        self.moveThread.join()
+        if self.joinThread is not None:
+            self.joinThread.join()
+
+
+def buildBook(sBookFile, iPlies=2, fBudget=1.0):
+    # search all positions up to iPlies moves w/ a large time budget and store best moves
+    solver = VGBotSolver(sBookFile="")
+    dictMoves = {}
+
+    def walk(board, playerNo, iPly):
+        if iPly > iPlies or board.isFull():
+            return
+        iColumn = solver.bestMove(board, playerNo, fBudget)
+        dictMoves[str(board.arrBitboards[playerNo - 1] + (board.arrBitboards[0] | board.arrBitboards[1]))] = iColumn
+        for iNext in board.legalMoves():
+            nextBoard = VGBoard.fromBlob(board.toBlob())
+            nextBoard.dropCoin(iNext, playerNo)
+            if not nextBoard.isWinningDrop(iNext, playerNo):
+                walk(nextBoard, 3 - playerNo, iPly + 1)
+
+    walk(VGBoard(), 1, 0)
+    with open(sBookFile, "w") as fBook:
+        json.dump({ "rows": VGBoard.boardRows, "columns": VGBoard.boardColumns, "plies": iPlies, "moves": dictMoves }, fBook)
+    return len(dictMoves)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Connect 4 bot")
+    parser.add_argument("--build-book", action="store_true", help="generate opening book")
+    parser.add_argument("--book", default=VGBotSolver.sDefaultBook, help="opening book file")
+    parser.add_argument("--plies", type=int, default=2, help="positions up to this number of moves are stored")
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds of search per book position")
+    args = parser.parse_args()
+    if args.build_book:
+        print("stored", buildBook(args.book, args.plies, args.budget), "positions in", args.book)
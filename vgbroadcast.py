@@ -0,0 +1,182 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+#
+# class VGGameBroadcaster
+#
+# implements spectator streams w/ fan-out, the cost of a game change does not
+# depend on the number of spectators:
+#   - the spectator view of a game is rendered and serialized once per version
+#     (shared by all snapshots and streams, see getMessage)
+#   - one pump task per watched game waits for changes (VGGameNotifier) and puts
+#     the same bytes into the bounded queue of every spectator of the game
+#   - a spectator, whose queue is full (i.e. the connection does not take data
+#     fast enough), is dropped instead of buffering more for it or slowing down others
+#
+# runs completely in the event loop of the server, so channels need no locks
+
+
+class VGSpectator():
+    def __init__(self, channel, iQueueSize):
+        self.channel = channel
+        self.queue = asyncio.Queue(iQueueSize)
+        self.bDropped = False
+
+
+class VGBroadcastChannel():
+    def __init__(self, gameID):
+        self.gameID = gameID
+        self.setSpectators = set()
+        # last event of game, sent to spectators joining later
+        self.bLastEvent = None
+        self.task = None
+
+
+class VGGameBroadcaster():
+    # events buffered per spectator, who falls further behind is dropped
+    iQueueSize:int = 16
+    # max. number of games, whose last rendered view is kept
+    iMaxRendered:int = 10000
+    # seconds between keep-alive comments on streams of unchanged games
+    fKeepAlive:float = 15.0
+    bKeepAlive:bytes = b": keep-alive\n\n"
+    arrFinishedStates = ("1WON", "2WON", "STALEMATE", "CANCELED")
+
+    def __init__(self, asyncController, notifier, iQueueSize=None):
+        self.asyncController = asyncController
+        self.notifier = notifier
+        if iQueueSize is not None:
+            self.iQueueSize = iQueueSize
+        # gameID -> (version, status, JSON, event)
+        self.dictRendered = OrderedDict()
+        # gameID -> task of a rendering in progress
+        self.dictRendering = {}
+        self.dictChannels = {}
+
+        self.iRenders = 0
+        self.iReused = 0
+        self.iEvents = 0
+        self.iDelivered = 0
+        self.iDropped = 0
+
+    async def getMessage(self, gameID):
+        # (version, status, JSON, event) of current version of game gameID or None for
+        # unknown games; rendered once per version, concurrent callers wait for the same rendering
+        iVersion = await self.asyncController.getGameVersion(gameID)
+        if iVersion is False:
+            return None
+        rendered = self.dictRendered.get(gameID)
+        if rendered is not None and rendered[0] >= iVersion:
+            self.iReused += 1
+            return rendered
+        task = self.dictRendering.get(gameID)
+        if task is None:
+            task = self.dictRendering[gameID] = asyncio.create_task(self._render(gameID))
+        else:
+            self.iReused += 1
+        return await asyncio.shield(task)
+
+    async def _render(self, gameID):
+        # own task, so a spectator leaving does not cancel a rendering others wait for
+        try:
+            jData = await self.asyncController.getSpectatorData(gameID)
+            if jData is None:
+                return None
+            bJSON = json.dumps(jData).encode()
+            rendered = (jData["version"], jData["status"], bJSON, b"data: " + bJSON + b"\n\n")
+            self.iRenders += 1
+            self.dictRendered[gameID] = rendered
+            self.dictRendered.move_to_end(gameID)
+            if len(self.dictRendered) > self.iMaxRendered:
+                self.dictRendered.popitem(last=False)
+            return rendered
+        finally:
+            del self.dictRendering[gameID]
+
+    def subscribe(self, gameID):
+        # new spectator of game gameID, starts pump of game for its first spectator
+        channel = self.dictChannels.get(gameID)
+        if channel is None:
+            channel = self.dictChannels[gameID] = VGBroadcastChannel(gameID)
+            channel.task = asyncio.create_task(self._pump(channel))
+        spectator = VGSpectator(channel, self.iQueueSize)
+        if channel.bLastEvent is not None:
+            spectator.queue.put_nowait(channel.bLastEvent)
+        channel.setSpectators.add(spectator)
+        return spectator
+
+    def unsubscribe(self, spectator):
+        # last spectator gone -> pump of game is stopped
+        channel = spectator.channel
+        channel.setSpectators.discard(spectator)
+        if not channel.setSpectators and self.dictChannels.get(channel.gameID) is channel:
+            channel.task.cancel()
+            del self.dictChannels[channel.gameID]
+
+    async def stream(self, gameID):
+        # events for one spectator, ends when game is finished or spectator was dropped
+        spectator = self.subscribe(gameID)
+        try:
+            while not spectator.bDropped:
+                bEvent = await spectator.queue.get()
+                if bEvent is None or spectator.bDropped:
+                    break
+                yield bEvent
+        finally:
+            self.unsubscribe(spectator)
+
+    def _fanOut(self, channel, bEvent):
+        # same bytes to all spectators, w/o waiting for any of them
+        for spectator in list(channel.setSpectators):
+            try:
+                spectator.queue.put_nowait(bEvent)
+                self.iDelivered += 1
+            except asyncio.QueueFull:
+                spectator.bDropped = True
+                channel.setSpectators.discard(spectator)
+                self.iDropped += 1
+
+    def _close(self, channel):
+        # streams of all spectators end after their queued events
+        for spectator in channel.setSpectators:
+            try:
+                spectator.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                spectator.bDropped = True
+        channel.setSpectators.clear()
+        if self.dictChannels.get(channel.gameID) is channel:
+            del self.dictChannels[channel.gameID]
+
+    async def _pump(self, channel):
+        # one task per watched game: renders (at most once per version) and fans out every change
+        subscription = self.notifier.subscribe(channel.gameID)
+        try:
+            iVersion = -1
+            while True:
+                rendered = await self.getMessage(channel.gameID)
+                if rendered is None:
+                    self._close(channel)
+                    return
+                if rendered[0] > iVersion:
+                    iVersion = rendered[0]
+                    channel.bLastEvent = rendered[3]
+                    self.iEvents += 1
+                    self._fanOut(channel, rendered[3])
+                if rendered[1] in self.arrFinishedStates:
+                    self._close(channel)
+                    return
+                if not await self.notifier.wait(subscription, self.fKeepAlive):
+                    self._fanOut(channel, self.bKeepAlive)
+        finally:
+            self.notifier.unsubscribe(channel.gameID, subscription)
+
+    def getStats(self):
+        return {
+            "games": len(self.dictChannels),
+            "spectators": sum(len(channel.setSpectators) for channel in self.dictChannels.values()),
+            "renders": self.iRenders,
+            "reused": self.iReused,
+            "events": self.iEvents,
+            "delivered": self.iDelivered,
+            "dropped": self.iDropped }
@@ -0,0 +1,195 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+#
+# class VGGameCache
+#
+# implements in-memory cache of game states with write-behind to SQLite
+#
+# cache is authoritative for status and board of all games it holds,
+# changed games are flushed in one transaction every fFlushInterval seconds
+# (or immediately, when a game ended), so a crash loses at most one interval
+#
+# moves are appended to the move log (one small row per move) with the same
+# flush, the board itself is not written anymore - it is derived from the log
+# games of older versions w/o complete log and games, whose board was set directly
+# (bMoveLog False, see GameDB.setGameBitboard) still write their bitboard
+
+
+class VGCachedGame():
+    def __init__(self, gameID, player1, player2, sStatus, board, iVersion=0, bMoveLog=True, fUpdated=None):
+        self.gameID = gameID
+        self.player1 = player1
+        self.player2 = player2
+        self.sStatus = sStatus
+        self.board = board
+        # increased on every change of the game, sent to clients in ETag (w/ epoch of server process)
+        self.iVersion = iVersion
+        self.bMoveLog = bMoveLog
+        # wall clock time of last change, games w/o changes for too long are canceled
+        self.fUpdated = fUpdated if fUpdated is not None else time.time()
+        # (move number, column) not yet written to move log
+        self.arrPendingMoves = []
+        self.bDirty = False
+        # incremented on every change, to detect changes during a flush
+        self.iChanges = 0
+        self.fLastAccess = time.monotonic()
+
+
+class VGGameCache():
+    # states, in which a game will not change anymore
+    arrFinishedStates = ("1WON", "2WON", "STALEMATE", "CANCELED")
+
+    def __init__(self, dbPool, fFlushInterval=1.0, iMaxEntries=10000, fFinishedTTL=60.0):
+        self.dbPool = dbPool
+        self.fFlushInterval = fFlushInterval
+        self.iMaxEntries = iMaxEntries
+        self.fFinishedTTL = fFinishedTTL
+
+        self.dictGames = OrderedDict()
+        self.lock = threading.RLock()
+        self.flushLock = threading.Lock()
+        self.iHits = 0
+        self.iMisses = 0
+        self.iFlushes = 0
+        self.iFlushedGames = 0
+        self.iEvictions = 0
+        self.iLoggedMoves = 0
+
+        self.evStop = threading.Event()
+        self.flushThread = None
+        if self.fFlushInterval > 0:
+            self.flushThread = threading.Thread(target=self._flushLoop, name="VGGameCacheFlush", daemon=True)
+            self.flushThread.start()
+
+    def get(self, gameID):
+        # returns cached game or None, if it has to be loaded from database
+        with self.lock:
+            game = self.dictGames.get(gameID)
+            if game is None:
+                self.iMisses += 1
+                return None
+            self.iHits += 1
+            self.dictGames.move_to_end(gameID)
+            game.fLastAccess = time.monotonic()
+            return game
+
+    def peek(self, gameID):
+        # returns cached game or None without touching counters and LRU order
+        with self.lock:
+            return self.dictGames.get(gameID)
+
+    def put(self, game):
+        # add game loaded from (or just written to) database
+        # returns the cached game, which might have been added meanwhile by another thread
+        with self.lock:
+            game = self.dictGames.setdefault(game.gameID, game)
+            self.dictGames.move_to_end(game.gameID)
+            self._evict(bExpire=False)
+            return game
+
+    def logMove(self, game, iColumn, iMoveNo=None):
+        # append move just played on game.board (or move iMoveNo) to move log with next flush
+        if game.bMoveLog:
+            with self.lock:
+                game.arrPendingMoves.append((game.board.iMoves if iMoveNo is None else iMoveNo, iColumn))
+
+    def markDirty(self, game, bFlush=True):
+        # game was changed in memory, schedule write to database
+        # bFlush False: caller still holds the lock and calls flushIfNeeded afterwards
+        with self.lock:
+            game.bDirty = True
+            game.iChanges += 1
+            game.iVersion += 1
+            game.fLastAccess = time.monotonic()
+            game.fUpdated = time.time()
+        if bFlush:
+            self.flushIfNeeded(game)
+
+    def flushIfNeeded(self, game):
+        # finished games (and all games w/o flush interval) are written immediately
+        if self.fFlushInterval <= 0 or game.sStatus in self.arrFinishedStates:
+            self.flush()
+
+    def flush(self):
+        # write all changed games in one transaction
+        # the cache is only locked while taking the snapshot, not during the write
+        with self.flushLock:
+            with self.lock:
+                arrDirty = [(game, game.iChanges, len(game.arrPendingMoves)) for game in self.dictGames.values() if game.bDirty]
+                arrRows = [(game.sStatus, game.board.iMoves, game.iVersion, int(game.fUpdated), game.gameID)
+                    for game, iChanges, iPending in arrDirty if game.bMoveLog]
+                arrBitboardRows = [(game.sStatus, game.board.toBlob(), game.board.iMoves, game.iVersion, int(game.fUpdated), game.gameID)
+                    for game, iChanges, iPending in arrDirty if not game.bMoveLog]
+                arrMoveRows = [(game.gameID, iMoveNo, iColumn) for game, iChanges, iPending in arrDirty
+                    for iMoveNo, iColumn in game.arrPendingMoves[:iPending]]
+            if not arrDirty:
+                return 0
+            # connection of flushing thread (the flush loop or the thread finishing a game)
+            dbFlush = self.dbPool.connection()
+            try:
+                dbFlush.executemany("INSERT OR IGNORE INTO moves (game_id, move_no, col) values (?, ?, ?);", arrMoveRows)
+                dbFlush.executemany("UPDATE games SET status=?, moves=?, version=?, updated=? WHERE game_id=?;", arrRows)
+                dbFlush.executemany("UPDATE games SET status=?, bitboard=?, moves=?, version=?, updated=? WHERE game_id=?;", arrBitboardRows)
+                dbFlush.commit()
+            except sqlite3.Error as error:
+                # keep games dirty, next flush will retry
+                dbFlush.rollback()
+                print('Failed to flush game cache', error)
+                return 0
+            with self.lock:
+                for game, iChanges, iPending in arrDirty:
+                    del game.arrPendingMoves[:iPending]
+                    # game changed again while writing? -> stays dirty
+                    if game.iChanges == iChanges:
+                        game.bDirty = False
+                self.iFlushes += 1
+                self.iFlushedGames += len(arrDirty)
+                self.iLoggedMoves += len(arrMoveRows)
+                self._evict()
+            return len(arrDirty)
+
+    def _evict(self, bExpire=True):
+        # drop finished games after their TTL (only when bExpire, as it has to
+        # look at all entries) and least recently used games, if cache is full
+        # changed games stay until they are flushed
+        fNow = time.monotonic()
+        for gameID in (list(self.dictGames.keys()) if bExpire else []):
+            game = self.dictGames[gameID]
+            if (not game.bDirty and game.sStatus in self.arrFinishedStates
+                    and fNow - game.fLastAccess > self.fFinishedTTL):
+                del self.dictGames[gameID]
+                self.iEvictions += 1
+        if len(self.dictGames) > self.iMaxEntries:
+            # most recently used game is kept, i.e. the one just put, it may be changed next
+            for gameID in list(self.dictGames.keys())[:-1]:
+                if len(self.dictGames) <= self.iMaxEntries:
+                    break
+                if not self.dictGames[gameID].bDirty:
+                    del self.dictGames[gameID]
+                    self.iEvictions += 1
+
+    def _flushLoop(self):
+        while not self.evStop.wait(self.fFlushInterval):
+            self.flush()
+
+    def getStats(self):
+        with self.lock:
+            return {
+                "hits": self.iHits,
+                "misses": self.iMisses,
+                "entries": len(self.dictGames),
+                "dirty": sum(1 for game in self.dictGames.values() if game.bDirty),
+                "flushes": self.iFlushes,
+                "flushedgames": self.iFlushedGames,
+                "evictions": self.iEvictions,
+                "loggedmoves": self.iLoggedMoves }
+
+    def close(self):
+        # stop flushing thread and write everything left
+        self.evStop.set()
+        if self.flushThread is not None:
+            self.flushThread.join()
+        self.flush()
@@ -1,16 +1,11 @@
-from asyncore import loop
-from re import I
-from unittest import case
 from textual.app import App
 from textual.widgets import Placeholder, Header, Footer
-from textual.views import DockView
 from rich.panel import Panel
 from rich.align import Align
-import requests
+import httpx
 import json
 from dotenv import load_dotenv
 import os
-import sys
 import asyncio 
 
 #
@@ -20,12 +15,24 @@ import asyncio
 # Connect 4 Client
 # 
 # class based on textual app providing UI and game_loop for connecting via API to gameserver
+# all requests are async and share one keep-alive connection pool, so the UI never
+# waits for the network: moves are sent in the background and shown on the pitch
+# right away, the update of the server confirms (or replaces) them
 
 # get settings variables from .env
 load_dotenv()
 
 # read game settings from .env file - needs to be located in current directory
 GAMESERVER = str(os.getenv("GAMESERVER"))
+# optional board variant, i.e. BOARDCOLUMNS=9, BOARDROWS=7, CONNECT=5 (classic game if not set)
+BOARDROWS = os.getenv("BOARDROWS")
+BOARDCOLUMNS = os.getenv("BOARDCOLUMNS")
+CONNECT = os.getenv("CONNECT")
+# WIREFORMAT=frame: poll compact binary game status and render pitch locally (default JSON w/ pitch of server)
+WIREFORMAT = os.getenv("WIREFORMAT", "json")
+if WIREFORMAT == "frame":
+    # only needed for binary frames
+    import vgwire
 
 class VGPitch(Placeholder):
     renderContent="""
@@ -33,23 +40,44 @@ Welcome to Connect Four - REST version.
 
 Press 'S' to start a new game.
 """   
+    # status line below the pitch, i.e. connection problems
+    statusContent = ""
     def on_mount(self):
         self.set_interval(1, self.refresh)
     def render(self,) -> Panel:
+        if self.statusContent:
+            return Panel(Align.center(self.renderContent + "\n\n" + self.statusContent, vertical="middle"))
         return Panel(Align.center(self.renderContent, vertical="middle"))
 
 class VGClient(App):
     iPollAPIFrequence:int = 3
+    iLongPollWait:int = 25
+    # seconds to connect and to wait for answers (event streams get a keep-alive every 15 seconds)
+    fConnectTimeout:float = 3.0
+    fRequestTimeout:float = 10.0
+    fStreamTimeout:float = 30.0
+    # polling retries failed requests (network errors, timeouts) w/ doubled delay up to fMaxRetryDelay,
+    # after iMaxRetries failures in a row the game is given up
+    fRetryDelay:float = 1.0
+    fMaxRetryDelay:float = 16.0
+    iMaxRetries:int = 6
+    arrCellSymbols = (" ", "X", "O")
+
+    client = None
 
     SESSIONTOKEN = None
     GAMEID = None
     bGameActive = False
     sGameStatus = None
     iPlayerNo = 0
+    iColumns = 7
 
     ### create UI
     async def on_mount(self) -> None:
-        # create UI
+        # create UI and connection pool to gameserver
+        self.client = httpx.AsyncClient(base_url=GAMESERVER,
+            timeout=httpx.Timeout(self.fRequestTimeout, connect=self.fConnectTimeout),
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4))
         # bind keys for footer
         await self.bind("q", "quit", "Quit")
         await self.bind("s", "startgame", "Start Game")
@@ -61,35 +89,146 @@ class VGClient(App):
         await self.view.dock(header)
         await self.view.dock(VGPitch(name="pitch"), edge="top")
 
+    def update_game(self, jData):
+        # render game status received from gameserver to pitch
+        self.sGameStatus = jData["status"]
+        VGPitch.renderContent = jData["pitch"] 
+        if jData["status"] == "1WON" or jData["status"] == "2WON" or jData["status"] == "STALEMATE" or jData["status"] == "CANCELED":
+            self.bGameActive = False
+
+    def render_frame(self, jFrame):
+        # pitch for game status received as binary frame, board in same layout as rendered by gameserver
+        sStatus = jFrame["status"]
+        if sStatus == "PLAYER" + str(self.iPlayerNo):
+            sInfo = "It's your turn, please select your column"
+        elif sStatus == "PLAYER1" or sStatus == "PLAYER2":
+            sInfo = "Please wait, it's others players turn..."
+        elif sStatus == "WAITING":
+            sInfo = "Waiting for second player to join"
+        elif sStatus == "CANCELED":
+            sInfo = "Your opponent quit\n\nPress 's' to start a new game"
+        elif sStatus == "STALEMATE":
+            sInfo = "STALEMATE\n\nPress 's' for next try..."
+        elif sStatus == str(self.iPlayerNo) + "WON":
+            sInfo = "YIPEEE - You WON :)\n\nPress 's' because it feels good..."
+        else:
+            sInfo = "Seems, you lost\n\nPress 's' to try better..."
+        arrBoard = jFrame["board"].toList()
+        arrLines = ["\nHi Player #" + str(self.iPlayerNo) + ", you're playing game: " + str(jFrame["gameid"]) + "\n\n" + sInfo + "\n\n\n"]
+        for arrRow in arrBoard:
+            arrLines.append("    | " + " | ".join([self.arrCellSymbols[iCell] for iCell in arrRow]) + " |")
+        arrLines.append("   " + "-" * (len(arrBoard[0]) * 4 + 2))
+        arrLines.append("   " + "".join("   " + str(iColumn + 1) for iColumn in range(len(arrBoard[0]))))
+        return "\n".join(arrLines)
+
+    def update_pitch_optimistic(self, iColumn):
+        # shows own move before server confirmed it: coin in lowest free cell of column,
+        # status of other player's turn; returns previous pitch, None if move is not possible
+        sPitch = VGPitch.renderContent
+        arrLines = sPitch.split("\n")
+        arrBoardLines = [iLine for iLine, sLine in enumerate(arrLines) if sLine.startswith("    | ")]
+        iCell = 6 + 4 * iColumn
+        for iLine in reversed(arrBoardLines):
+            sLine = arrLines[iLine]
+            if iCell < len(sLine) and sLine[iCell] == " ":
+                arrLines[iLine] = sLine[:iCell] + self.arrCellSymbols[self.iPlayerNo] + sLine[iCell + 1:]
+                break
+        else:
+            return None
+        VGPitch.renderContent = "\n".join(arrLines).replace("It's your turn, please select your column",
+            "Please wait, it's others players turn...")
+        self.sGameStatus = "PLAYER" + str(3 - self.iPlayerNo)
+        return sPitch
+
+    async def subscribe_game(self, gameID, playerNo):
+        # reads game updates pushed by gameserver until game is finished
+        url = "/gameevents/" + str(gameID)
+        # server sends a keep-alive at least every 15 seconds
+        timeout = httpx.Timeout(self.fStreamTimeout, connect=self.fConnectTimeout)
+        async with self.client.stream("GET", url, params={ "playerno": playerNo }, timeout=timeout) as myResponse:
+            myResponse.raise_for_status()
+            async for sLine in myResponse.aiter_lines():
+                if sLine and sLine.startswith("data:"):
+                    jData = json.loads(sLine[5:])
+                    self.update_game(jData)
+                    if jData["status"] not in ("WAITING", "PLAYER1", "PLAYER2"):
+                        break
+                if not self.bGameActive:
+                    break
+
     async def game_loop(self, gameID, playerNo):
+        # subscribe to pushed game updates, if gameserver (or connection) does not support them
         # request and render current running game status to pitch every self.iPollAPIFrequence seconds
-        url = GAMESERVER + "/gamestatus/" + str(gameID) + "?playerno" + str(playerNo)
-
         self.bGameActive = True
         self.iPlayerNo = playerNo
 
+        # event stream is JSON only, binary frames are polled
+        if WIREFORMAT != "frame":
+            try:
+                await self.subscribe_game(gameID, playerNo)
+            except (httpx.HTTPError, ValueError):
+                # fall back to polling
+                pass
+
+        # poll w/ conditional requests: server answers 304, if game did not change
+        # and parks request up to iLongPollWait seconds until game changes
+        sETag = None
+        iVersion = -1
+        iRetries = 0
         while self.bGameActive:
-            url = GAMESERVER + "/gamestatus/" + str(gameID) + "?playerno=" + str(playerNo)
-            myResponse = requests.get(url)
-            if(myResponse.ok):
-                jData = json.loads(myResponse.content)
-                self.sGameStatus = jData["status"]
-                VGPitch.renderContent = jData["pitch"] 
-                if jData["status"] == "1WON" or jData["status"] == "2WON" or jData["status"] == "STALEMATE" or jData["status"] == "CANCELED":
+            url = "/gamestatus/" + str(gameID)
+            dictParams = { "playerno": playerNo, "since": iVersion, "wait": self.iLongPollWait }
+            dictHeaders = { "If-None-Match": sETag } if sETag else {}
+            if WIREFORMAT == "frame":
+                dictHeaders["Accept"] = vgwire.sMediaType + ", application/json;q=0.5"
+            try:
+                myResponse = await self.client.get(url, params=dictParams, headers=dictHeaders,
+                    timeout=httpx.Timeout(self.iLongPollWait + 10, connect=self.fConnectTimeout))
+            except httpx.HTTPError as error:
+                iRetries += 1
+                if iRetries > self.iMaxRetries:
                     self.bGameActive = False
-                await asyncio.sleep(self.iPollAPIFrequence)
+                    VGPitch.statusContent = "Connection to gameserver lost (" + type(error).__name__ + ")\n\nPress 's' to start a new game"
+                    break
+                fDelay = min(self.fRetryDelay * 2 ** (iRetries - 1), self.fMaxRetryDelay)
+                VGPitch.statusContent = "Connection problem (" + type(error).__name__ + "), retrying in " + str(int(fDelay)) + " s..."
+                await asyncio.sleep(fDelay)
+                continue
+            if iRetries:
+                iRetries = 0
+                VGPitch.statusContent = ""
+            if myResponse.status_code == 304:
+                continue
+            if(myResponse.is_success):
+                if WIREFORMAT == "frame" and myResponse.headers.get("content-type") == vgwire.sMediaType:
+                    jFrame = vgwire.unpackFrame(myResponse.content)
+                    jData = { "status": jFrame["status"], "version": jFrame["version"], "pitch": self.render_frame(jFrame) }
+                else:
+                    # server w/o binary frames answers w/ JSON
+                    jData = json.loads(myResponse.content)
+                self.update_game(jData)
+                sETag = myResponse.headers.get("ETag")
+                if sETag is None or "version" not in jData:
+                    # server without long-poll support, poll in fixed interval
+                    await asyncio.sleep(self.iPollAPIFrequence)
+                else:
+                    iVersion = jData["version"]
             else:
-                myResponse.raise_for_status()
+                # i.e. game unknown to gameserver, a new game can be started
                 self.bGameActive = False
+                VGPitch.statusContent = "Gameserver answered " + str(myResponse.status_code) + "\n\nPress 's' to start a new game"
         return 
 
-    def request_game(self, sSessionToken):
-        url = GAMESERVER + "/requestgame/" + sSessionToken
-        myResponse = requests.get(url)
-        if(myResponse.ok):
+    async def request_game(self, sSessionToken):
+        url = "/requestgame/" + sSessionToken
+        dictParams = { "rows": BOARDROWS, "columns": BOARDCOLUMNS, "connect": CONNECT }
+        myResponse = await self.client.get(url, params={ sKey: sValue for sKey, sValue in dictParams.items() if sValue })
+        if(myResponse.is_success):
             # new game can be started
             jData = json.loads(myResponse.content)
             self.GAMEID = jData["gameid"]
+            # column keys follow size of board (older servers only have the classic board)
+            self.iColumns = jData.get("columns", 7)
             # start game loop to periodically poll game status from gameserver and render it to pitch
             event_loop = asyncio.get_event_loop()
             asyncio.ensure_future(self.game_loop(jData["gameid"], jData["playerno"] ), loop=event_loop)
@@ -106,12 +245,13 @@ class VGClient(App):
             return False
 
         VGPitch.renderContent="Game will be started, give me some seconds to initialize"
+        VGPitch.statusContent = ""
 
         if self.SESSIONTOKEN == None:
             # Create Session Token for game, as not yet registered at server
-            url = GAMESERVER + "/registersession"
-            myResponse = requests.get(url)
-            if(myResponse.ok):
+            url = "/registersession"
+            myResponse = await self.client.get(url)
+            if(myResponse.is_success):
                 jData = json.loads(myResponse.content)
                 self.SESSIONTOKEN = jData["token"]
             else:
@@ -119,41 +259,51 @@ class VGClient(App):
                 myResponse.raise_for_status()
 
         # session token is available, new game can be started
-        self.request_game(self.SESSIONTOKEN)
+        await self.request_game(self.SESSIONTOKEN)
 
     def on_key(self, event):
-        # only during ongoing Game, wait for keys pressed
-        if not self.bGameActive:
+        # only during ongoing Game and own turn, wait for keys pressed
+        # move is sent in the background, so keys are handled while requests are running
+        if not self.bGameActive or self.sGameStatus != "PLAYER" + str(self.iPlayerNo):
             return False
 
-        # start move
-        url = GAMESERVER + "/dropCoin/" + str(self.GAMEID) + "?playerno=" + str(self.iPlayerNo) + "&key="
-
         # restrict columns that can be selected
-        allowedColumns= ["1","2","3","4","5","6","7"]
+        allowedColumns= [str(iColumn) for iColumn in range(1, self.iColumns + 1)]
         if event.key in allowedColumns:
-            VGPitch.renderContent = "... please wait ..."
-            url += str(event.key)
-            # and now let's drop the coin...
-            myResponse = requests.post(url)
-            if(myResponse.ok):
+            sPitch = self.update_pitch_optimistic(int(event.key) - 1)
+            if sPitch is None:
+                VGPitch.renderContent = VGPitch.renderContent.replace("It's your turn, please select your column",
+                    "Column is full, please select another column")
+                return False
+            asyncio.ensure_future(self.drop_coin(self.GAMEID, event.key, sPitch))
+
+    async def drop_coin(self, gameID, sKey, sPitch):
+        # and now let's drop the coin...
+        url = "/dropCoin/" + str(gameID)
+        try:
+            myResponse = await self.client.post(url, params={ "playerno": self.iPlayerNo, "key": sKey })
+            myResponse.raise_for_status()
+            jData = json.loads(myResponse.content)
+        except (httpx.HTTPError, ValueError) as error:
+            jData = { "status": "Move failed: " + str(error) }
+        # if something went wrong, i.e. column full, take back the move and render the reason to pitch
+        if jData["status"] != "ok" and gameID == self.GAMEID:
+            self.sGameStatus = "PLAYER" + str(self.iPlayerNo)
+            VGPitch.renderContent = sPitch + "\n\n" + jData["status"]
+
+    async def close_all(self) -> None:
+        # exit app and try to be graceful, quit game only if there is one
+        if self.GAMEID is not None:
+            url = "/quitgame/" + str(self.GAMEID)
+            myResponse = await self.client.post(url)
+            if(myResponse.is_success):
                 jData = json.loads(myResponse.content)
-                # if something went wrong, i.e. column full, render to pitch to inform player
                 if jData["status"] != "ok":
                     VGPitch.renderContent = jData["status"]
             else:
                 myResponse.raise_for_status()
-
-    async def close_all(self) -> None:
-        # exit app and try to be graceful
-        url = GAMESERVER + "/quitgame/" + str(self.GAMEID)
-        myResponse = requests.post(url)
-        if(myResponse.ok):
-            jData = json.loads(myResponse.content)
-            if jData["status"] != "ok":
-                VGPitch.renderContent = jData["status"]
-        else:
-            myResponse.raise_for_status()
+        if self.client is not None:
+            await self.client.aclose()
         return await super().close_all() 
 
 VGClient.run(title="Connect Four")
\ No newline at end of file
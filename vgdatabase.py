@@ -1,9 +1,14 @@
-from multiprocessing.util import is_abstract_socket_namespace
 import sqlite3
 import os 
-import sys
 import json
-from typing import IO
+import uuid
+import time
+import threading
+from vgboard import VGBoard
+from vgcache import VGGameCache, VGCachedGame
+from vgmatchmaking import VGMatchQueue
+from vgdbpool import VGConnectionPool
+from vgarchive import packMoves, unpackMoves, playerOfMove
 
 #
 # class GameDB
@@ -13,51 +18,327 @@ from typing import IO
 
 
 class GameDB():
-    boardColumns:int = 7
-    boardRows:int = 6
+    # size of classic board, games can have their own (see attachPlayerToFreeGameSlot)
+    boardColumns:int = VGBoard.boardColumns
+    boardRows:int = VGBoard.boardRows
+    iConnect:int = VGBoard.iConnect
+    arrGameStates = ("WAITING", "PLAYER1", "PLAYER2", "1WON", "2WON", "STALEMATE", "CANCELED")
+    # session tokens of internal players (placeholder player 2, block game, bot), never accepted from clients
+    sBotToken:str = "bot"
+    arrReservedTokens = ("dummy", "block", sBotToken)
+    # statements of the request paths, compiled at startup (see prepareStatements)
+    sSQLLoadGame:str = "SELECT player1, player2, status, bitboard, board, version, updated, board_rows, board_columns, connect FROM games WHERE game_id=?;"
+    sSQLLoadArchivedGame:str = "SELECT player1, player2, status, version, moves, movelog, bitboard, board_rows, board_columns, connect FROM games_archive WHERE game_id=?;"
+    sSQLLoadMoves:str = "SELECT col FROM moves WHERE game_id=? ORDER BY move_no;"
+    sSQLGetPlayer:str = "SELECT player_id from players where player_token=?;"
+    arrPreparedStatements = ("sSQLLoadGame", "sSQLLoadArchivedGame", "sSQLLoadMoves", "sSQLGetPlayer")
 
     def createDB(self):
-        # creates tables in GameDB
-
+        # (re)creates tables in GameDB, all existing data is lost
         sSQLScript = """
         DROP TABLE IF EXISTS games;
         DROP TABLE IF EXISTS players;
+        DROP TABLE IF EXISTS moves;
+        DROP TABLE IF EXISTS games_archive;
+        PRAGMA user_version=0;
+        """
+        self.dbC.executescript(sSQLScript)
+        self.dbSession.commit()
+        self.migrateDB()
+        return True
+
+    def migrateDB(self):
+        # brings schema of GameDB (new or created by an older version) forward in place
+        # schema version is stored in the database file (PRAGMA user_version),
+        # migration N is applied, when user_version < N, each in its own transaction
+        self.dbC.execute("PRAGMA user_version;")
+        iSchemaVersion = self.dbC.fetchone()[0]
+        for iMigration in range(iSchemaVersion, len(self.arrMigrations)):
+            self.dbSession.commit()
+            self.dbC.execute("BEGIN;")
+            try:
+                getattr(self, self.arrMigrations[iMigration])()
+                self.dbC.execute("PRAGMA user_version=" + str(iMigration + 1) + ";")
+                self.dbSession.commit()
+            except sqlite3.Error:
+                self.dbSession.rollback()
+                raise
+        return iSchemaVersion
+
+    def _migrateCreateTables(self):
+        # 1: initial schema, databases created before versioning already have it
+        self.dbC.execute("SELECT name FROM sqlite_schema WHERE type='table' AND name='games';")
+        if self.dbC.fetchone() is not None:
+            return
+        for sSQL in ("""
         CREATE TABLE games (
             game_id INTEGER PRIMARY KEY AUTOINCREMENT,
             player1 INTEGER NOT NULL,
             player2 INTEGER DEFAULT 1,
             status VARCHAR(20) DEFAULT 'WAITING',
             board JSON,
-            CHECK (status in ('WAITING','PLAYER1','PLAYER2', '1WON', '2WON', 'STALEMATE', 'CANCELED')));
+            CHECK (status in ('WAITING','PLAYER1','PLAYER2', '1WON', '2WON', 'STALEMATE', 'CANCELED')));""", """
         CREATE TABLE players (
             player_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            player_token VARCHAR(40));
-        /* create dummy entry in dbs */
-        INSERT INTO players (player_token) values ('dummy');
-        INSERT INTO players (player_token) values ('block');
-        INSERT INTO games (player1, player2) values (2, 2);
-        """
-        self.dbC.executescript(sSQLScript)
+            player_token VARCHAR(40));""",
+            # create dummy entry in dbs
+            "INSERT INTO players (player_token) values ('dummy');",
+            "INSERT INTO players (player_token) values ('block');",
+            "INSERT INTO games (player1, player2) values (2, 2);"):
+            self.dbC.execute(sSQL)
+
+    def _migrateBitboards(self):
+        # 2: bitboard, move counter and version of games, JSON boards are converted
+        # (databases of older versions might already have some of the columns)
+        dictColumns = { "bitboard": "BLOB", "moves": "INTEGER DEFAULT 0", "version": "INTEGER DEFAULT 0" }
+        self.dbC.execute("PRAGMA table_info(games);")
+        arrExisting = [rColumn[1] for rColumn in self.dbC.fetchall()]
+        for sColumn in dictColumns:
+            if sColumn not in arrExisting:
+                self.dbC.execute("ALTER TABLE games ADD COLUMN " + sColumn + " " + dictColumns[sColumn] + ";")
+
+        dbRead = self.dbSession.cursor()
+        dbRead.execute("SELECT game_id, board FROM games WHERE bitboard IS NULL AND board IS NOT NULL;")
+        arrRows = dbRead.fetchmany(1000)
+        while arrRows:
+            arrBoards = [VGBoard.fromList(json.loads(rResult[1])) for rResult in arrRows]
+            self.dbC.executemany("UPDATE games SET bitboard=?, moves=?, board=NULL WHERE game_id=?;",
+                [(board.toBlob(), board.iMoves, rResult[0]) for board, rResult in zip(arrBoards, arrRows)])
+            arrRows = dbRead.fetchmany(1000)
+        dbRead.close()
+
+    def _migrateTokenBlobs(self):
+        # 3: session tokens stored as 16 byte BLOB instead of uuid string, w/ unique index
+        self.dbC.execute("""
+        CREATE TABLE players_new (
+            player_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_token BLOB NOT NULL);""")
+        setTokens = set()
+        dbRead = self.dbSession.cursor()
+        dbRead.execute("SELECT player_id, player_token FROM players ORDER BY player_id;")
+        arrRows = dbRead.fetchmany(1000)
+        while arrRows:
+            arrNew = []
+            for rResult in arrRows:
+                bToken = self._tokenToBlob(rResult[1]) if isinstance(rResult[1], str) else rResult[1]
+                # duplicates would break unique index, first registration wins
+                if bToken is None or bToken in setTokens:
+                    continue
+                setTokens.add(bToken)
+                arrNew.append((rResult[0], bToken))
+            self.dbC.executemany("INSERT INTO players_new (player_id, player_token) values (?, ?);", arrNew)
+            arrRows = dbRead.fetchmany(1000)
+        dbRead.close()
+        self.dbC.execute("DROP TABLE players;")
+        self.dbC.execute("ALTER TABLE players_new RENAME TO players;")
+        self.dbC.execute("CREATE UNIQUE INDEX idx_players_token ON players(player_token);")
+
+    def _migrateIndexes(self):
+        # 4: index for matchmaking and maintenance queries on status
+        self.dbC.execute("CREATE INDEX IF NOT EXISTS idx_games_status ON games(status);")
+
+    def _migrateMoveLog(self):
+        # 5: append-only move log of running games and archive of finished games
+        # games already running keep their bitboard, new games get a NULL
+        # bitboard and their board is replayed from the move log
+        self.dbC.execute("""
+        CREATE TABLE moves (
+            game_id INTEGER NOT NULL,
+            move_no INTEGER NOT NULL,
+            col INTEGER NOT NULL,
+            PRIMARY KEY (game_id, move_no)) WITHOUT ROWID;""")
+        # movelog: played columns, 3 bits per move (see vgarchive)
+        # bitboard: only for games of older versions w/o move log
+        self.dbC.execute("""
+        CREATE TABLE games_archive (
+            game_id INTEGER PRIMARY KEY,
+            player1 INTEGER NOT NULL,
+            player2 INTEGER NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            version INTEGER DEFAULT 0,
+            moves INTEGER DEFAULT 0,
+            movelog BLOB,
+            bitboard BLOB);""")
+
+    def _migrateActivity(self):
+        # 6: time of last change (unix time) to find abandoned games
+        # existing games count as changed now, index on (status, updated) replaces the one on status
+        self.dbC.execute("ALTER TABLE games ADD COLUMN updated INTEGER DEFAULT 0;")
+        self.dbC.execute("UPDATE games SET updated=?;", (int(time.time()),))
+        self.dbC.execute("DROP INDEX IF EXISTS idx_games_status;")
+        self.dbC.execute("CREATE INDEX idx_games_status_updated ON games(status, updated);")
+
+    def _migrateBoardShapes(self):
+        # 7: board size and coins to win per game, existing games are classic ones
+        for sTable in ("games", "games_archive"):
+            self.dbC.execute("ALTER TABLE " + sTable + " ADD COLUMN board_rows INTEGER DEFAULT " + str(VGBoard.boardRows) + ";")
+            self.dbC.execute("ALTER TABLE " + sTable + " ADD COLUMN board_columns INTEGER DEFAULT " + str(VGBoard.boardColumns) + ";")
+            self.dbC.execute("ALTER TABLE " + sTable + " ADD COLUMN connect INTEGER DEFAULT " + str(VGBoard.iConnect) + ";")
+
+    # names of migration methods, position in list + 1 is schema version after migration
+    arrMigrations = ["_migrateCreateTables", "_migrateBitboards", "_migrateTokenBlobs", "_migrateIndexes",
+        "_migrateMoveLog", "_migrateActivity", "_migrateBoardShapes"]
+
+    def _checkIncrementalVacuum(self):
+        # pages freed by archiving are given back to the filesystem by incrementalVacuum()
+        # a new database file gets auto_vacuum=INCREMENTAL right away, an existing one only w/ a
+        # full VACUUM, which blocks and needs the size of the file as free disk space, so it is
+        # only done on request (python vgserver.py --enable-incremental-vacuum)
+        self.dbC.execute("PRAGMA auto_vacuum;")
+        if self.dbC.fetchone()[0] == 2:
+            return
+        self.dbC.execute("SELECT COUNT(*) FROM sqlite_master;")
+        if self.dbC.fetchone()[0] == 0:
+            # no tables yet, VACUUM of the empty file takes no time
+            self.dbSession.commit()
+            self.dbC.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            self.dbC.execute("VACUUM;")
+            return
+        print('Incremental vacuum not enabled for', self.sDBFile, '- free pages are not given back, see --enable-incremental-vacuum')
+
+    def enableIncrementalVacuum(self):
+        # maintenance: switches an existing database file to auto_vacuum=INCREMENTAL w/ a full VACUUM
+        # returns False, if it already was
+        self.dbC.execute("PRAGMA auto_vacuum;")
+        if self.dbC.fetchone()[0] == 2:
+            return False
+        self.gameCache.flush()
         self.dbSession.commit()
+        self.dbC.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        self.dbC.execute("VACUUM;")
         return True
 
-    def getGameBoard(self, gameID):
-        # fetches current set board from database and returns it as an array
-        sSQL = "SELECT board FROM games WHERE game_id = " + str(gameID) + ";"
-        self.dbC.execute(sSQL)
+    def _tokenToBlob(self, sSessionToken):
+        # uuid session tokens are stored as their 16 bytes,
+        # other tokens (i.e. 'dummy') as their utf-8 encoding
+        try:
+            return uuid.UUID(sSessionToken).bytes
+        except (ValueError, TypeError, AttributeError):
+            return str(sSessionToken).encode()
+
+    def _blobToToken(self, bToken):
+        # reverse of _tokenToBlob
+        if len(bToken) == 16:
+            try:
+                return str(uuid.UUID(bytes=bToken))
+            except ValueError:
+                pass
+        return bToken.decode(errors="replace")
+
+    def _getCachedGame(self, gameID):
+        # returns game from cache, loads it from database on a cache miss
+        game = self.gameCache.get(gameID)
+        if game is not None:
+            return game
+
+        self.dbC.execute(self.sSQLLoadGame, (gameID,))
         rResult = self.dbC.fetchone()
         if rResult is None:
-            return False
+            return self._getArchivedGame(gameID)
+        return self.gameCache.put(self._gameFromRow(gameID, rResult))
+
+    def _gameFromRow(self, gameID, rResult, arrMoves=None):
+        # cached game from row of sSQLLoadGame, move log is loaded, if not passed in
+        # games created before the move log only have a bitboard (or even only the JSON board)
+        bMoveLog = False
+        if rResult[3] is not None:
+            board = VGBoard.fromBlob(rResult[3], *rResult[7:10])
+        elif rResult[4] is not None:
+            board = VGBoard.fromList(json.loads(rResult[4]), rResult[9])
         else:
-            return json.loads(rResult[0])
+            board = VGBoard.fromMoves(self._loadMoves(gameID) if arrMoves is None else arrMoves, *rResult[7:10])
+            bMoveLog = True
+        return VGCachedGame(gameID, rResult[0], rResult[1], rResult[2], board, rResult[5] or 0, bMoveLog, rResult[6])
 
-    def setGameBoard(self, gameID, arrBoard):
-        # stores current board for game gameID to database
+    def _getArchivedGame(self, gameID):
+        # finished game already moved to archive, cached like any other game
+        self.dbC.execute(self.sSQLLoadArchivedGame, (gameID,))
+        rResult = self.dbC.fetchone()
+        if rResult is None:
+            return None
+        board = VGBoard(*rResult[7:10])
+        if rResult[5] is not None:
+            board = VGBoard.fromMoves(unpackMoves(rResult[5], rResult[4], board.shape.iBitsPerMove), *rResult[7:10])
+        elif rResult[6] is not None:
+            board = VGBoard.fromBlob(rResult[6], *rResult[7:10])
+        return self.gameCache.put(VGCachedGame(gameID, rResult[0], rResult[1], rResult[2], board, rResult[3] or 0, rResult[5] is not None))
+
+    def _loadMoves(self, gameID):
+        # played columns (0 based) of game gameID from move log
+        self.dbC.execute(self.sSQLLoadMoves, (gameID,))
+        return [rResult[0] for rResult in self.dbC.fetchall()]
+
+    def preloadActiveGames(self, iMaxGames=None):
+        # loads running and waiting games (most recently changed first) into the cache,
+        # so first requests after a restart don't have to read them one by one
+        # two queries in total, games and their move logs; returns number of loaded games
+        if iMaxGames is None:
+            iMaxGames = self.gameCache.iMaxEntries
+        sActive = "SELECT game_id FROM games WHERE status IN ('PLAYER1', 'PLAYER2', 'WAITING') ORDER BY updated DESC LIMIT ?"
+        sSQL = """SELECT player1, player2, status, bitboard, board, version, updated, board_rows, board_columns, connect, game_id
+            FROM games WHERE game_id IN (""" + sActive + ") ORDER BY updated;"
+        self.dbC.execute(sSQL, (iMaxGames,))
+        arrRows = self.dbC.fetchall()
+        if not arrRows:
+            return 0
+        dictMoves = {}
+        self.dbC.execute("SELECT game_id, col FROM moves WHERE game_id IN (" + sActive + ") ORDER BY game_id, move_no;", (iMaxGames,))
+        for rResult in self.dbC.fetchall():
+            dictMoves.setdefault(rResult[0], []).append(rResult[1])
+        for rResult in arrRows:
+            # games already in cache (i.e. changed meanwhile) are kept
+            if self.gameCache.peek(rResult[10]) is None:
+                self.gameCache.put(self._gameFromRow(rResult[10], rResult, dictMoves.get(rResult[10], [])))
+        return len(arrRows)
+
+    def prepareStatements(self):
+        # compiles statements of request paths into the statement cache of the connection
+        # of the calling thread (i.e. the writer of the async controller) w/ keys matching nothing
+        for sStatement in self.arrPreparedStatements:
+            self.dbC.execute(getattr(self, sStatement), (-1,))
+            self.dbC.fetchall()
+        return len(self.arrPreparedStatements)
+
+    def isGameCached(self, gameID):
+        # True, if game gameID can be read without accessing the database
+        return self.gameCache.peek(gameID) is not None
+
+    def getGameBitboard(self, gameID):
+        # returns current board of game gameID as VGBoard
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return False
+        return game.board
+
+    def setGameBitboard(self, gameID, board):
+        # stores current board for game gameID, written to database with next flush
+        # a board not reached by the move log can't be derived from it anymore, so
+        # the game stores its bitboard from now on (like games of older versions)
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return
+        with self.gameCache.lock:
+            game = self.gameCache.put(game)
+            if game.bMoveLog and board.arrBitboards == game.board.arrBitboards:
+                return
+            game.board = board
+            game.bMoveLog = False
+            self.gameCache.markDirty(game, bFlush=False)
+        self.gameCache.flushIfNeeded(game)
 
-        jsonBoard = json.dumps(arrBoard)
-        sSQL = "UPDATE games set board=? WHERE game_id=?;"
-        self.dbC.execute(sSQL, (json.dumps(arrBoard), gameID))
-        self.dbSession.commit()
+    def getGameBoard(self, gameID):
+        # fetches current set board from database and returns it as an array
+        board = self.getGameBitboard(gameID)
+        if board is False:
+            return False
+        return board.toList()
+
+    def setGameBoard(self, gameID, arrBoard):
+        # stores current board for game gameID, written to database with next flush (see setGameBitboard)
+        board = self.getGameBitboard(gameID)
+        if board is False:
+            return
+        self.setGameBitboard(gameID, VGBoard.fromList(arrBoard, board.iConnect))
 
     def isItMyTurn(self, gameID, playerNo):
         sGameStatus = self.getGameStatus(gameID)
@@ -80,232 +361,539 @@ class GameDB():
             return False
         return True
 
-    def isGameFinished(self, gameID):
+    def isGameFinished(self, gameID, board=None, iLastColumn=None, playerNo=None):
         # check if a player connected 4 tiles
-        arrBoard = self.getGameBoard(gameID)
+        # board can be passed in by caller, if already loaded
+        # with iLastColumn/playerNo of the last move, only lines through the
+        # coin just dropped are checked, otherwise the whole board is scanned
+        if board is None:
+            board = self.getGameBitboard(gameID)
+
+        if iLastColumn is not None:
+            if board.isWinningDrop(iLastColumn, playerNo):
+                self.setGameStatus(gameID, str(playerNo) + "WON")
+                return True
+        else:
+            if board.hasWon(1):
+                self.setGameStatus(gameID, "1WON")
+                return True
+            if board.hasWon(2):
+                self.setGameStatus(gameID, "2WON")
+                return True
 
         # not wanted from anyone, but probably stalemate?
-        # as both players played same amount of moves, we simply can add them up and compare with max possible
-        iSum=0
-        iStaleMate = self.boardColumns*self.boardRows/2*3
-        for i in range(0, self.boardRows):
-            iSum = iSum + sum(arrBoard[i])
-        if iSum == iStaleMate:
+        if board.isFull():
             self.setGameStatus(gameID, "STALEMATE")
             return True
+        return False
 
-        # now check for 4 in a row
-        countPlayer1 = 0
-        countPlayer2 = 0
-        sStatus = ""
-        for iRow in range(0, self.boardRows):
-            for iColumn in range (0, self.boardColumns):
-                if arrBoard[iRow][iColumn] == 1:
-                    countPlayer1 += 1
-                    countPlayer2 = 0
-                elif arrBoard[iRow][iColumn] == 2:
-                    countPlayer1 = 0
-                    countPlayer2 += 1
-                else:
-                    countPlayer1 = countPlayer2 = 0
-                if countPlayer1 == 4:
-                    sStatus = "1WON"
-                if countPlayer2 == 4:
-                    sStatus = "2WON"
-            countPlayer1 = countPlayer2 = 0
-        if sStatus != "":
-            self.setGameStatus(gameID, sStatus)
-            return True
-
-        # did not find a winner yet, need to check for 4 in a column
-        for iColumn in range (0, self.boardColumns):
-            for iRow in range(0, self.boardRows):
-                if arrBoard[iRow][iColumn] == 1:
-                    countPlayer1 += 1
-                    countPlayer2 = 0
-                elif arrBoard[iRow][iColumn] == 2:
-                    countPlayer1 = 0
-                    countPlayer2 += 1
-                else:
-                    countPlayer1 = countPlayer2 = 0
-                if countPlayer1 == 4:
-                    sStatus = "1WON"
-                if countPlayer2 == 4:
-                    sStatus = "2WON"
-            countPlayer1 = countPlayer2 = 0
-        if sStatus != "":
-            self.setGameStatus(gameID, sStatus)
-            return True
-
-        # still no winner yet, have to check the diagonals :(
-        for iRow in range(0, self.boardRows - 3):
-            for iColumn in range(0, self.boardColumns - 3):
-                for iOffset in range(0, 4):
-                    if arrBoard[iRow + iOffset][iColumn + iOffset] == 1:
-                        countPlayer1 += 1
-                        countPlayer2 = 0
-                    elif arrBoard[iRow + iOffset][iColumn + iOffset] == 2:
-                        countPlayer1 = 0
-                        countPlayer2 += 1
-                    else:
-                        countPlayer1 = countPlayer2 = 0
-                    if countPlayer1 == 4:
-                        sStatus = "1WON"
-                    if countPlayer2 == 4:
-                        sStatus = "2WON"
-                countPlayer1 = countPlayer2 = 0
-        if sStatus != "":
-            self.setGameStatus(gameID, sStatus)
-            return True
+    def validateGame(self, gameID):
+        # validation/repair mode for games stored by older versions:
+        # full scan of the board, stores bitboard and move counter
+        # and fixes status, if game was already decided
+        board = self.getGameBitboard(gameID)
+        if board is False:
+            return { "status": "Unknown Game" }
+        self.setGameBitboard(gameID, board)
+        if self.getGameStatus(gameID) in ("PLAYER1", "PLAYER2"):
+            self.isGameFinished(gameID, board)
+        return { "status": self.getGameStatus(gameID), "moves": board.iMoves }
+
+    def _playMoves(self, game, arrColumns, playerNo=None):
+        # plays columns (1 based, as sent by clients) on a copy of the board of game,
+        # players alternate starting w/ playerNo (None: the player, whose turn it is)
+        # returns (error, None, None, None) or (None, board, new status, [(move number, column)])
+        sStatus = game.sStatus
+        if sStatus != "PLAYER1" and sStatus != "PLAYER2":
+            return ("Not an active Game", None, None, None)
+        if playerNo is not None and sStatus != "PLAYER" + str(playerNo):
+            return ("ITs. NOT. YOUR. TURN. ...\n\n DON'T PRESS BUTTONS", None, None, None)
+
+        board = game.board.copy()
+        arrMoves = []
+        for column in arrColumns:
+            if sStatus != "PLAYER1" and sStatus != "PLAYER2":
+                return ("Game finished after move " + str(len(arrMoves)), None, None, None)
+            # force typecast of column as it was a str
+            # number of columns depends on board of game
+            iColumn:int = int(column)
+            if iColumn not in range(1, board.boardColumns + 1):
+                return ("Selected column out of range", None, None, None)
+            # align selected column to be array index
+            iColumn -= 1
+            playerNo = 1 if sStatus == "PLAYER1" else 2
+            if board.dropCoin(iColumn, playerNo) < 0:
+                return ("Column is full, coin would fall onto your desktop...\n\nTry again", None, None, None)
+            arrMoves.append((board.iMoves, iColumn))
+
+            # check, if there is a winner (or stalemate), only lines through the new coin
+            if board.isWinningDrop(iColumn, playerNo):
+                sStatus = str(playerNo) + "WON"
+            elif board.isFull():
+                sStatus = "STALEMATE"
+            else:
+                sStatus = "PLAYER2" if playerNo == 1 else "PLAYER1"
+        return (None, board, sStatus, arrMoves)
+
+    def _applyMoves(self, gameID, arrColumns, playerNo=None, iExpectedVersion=None):
+        # turn check, moves and new status are one change of the cached game, done under
+        # the cache lock: two quick posts (or a post and the bot) can't both pass the turn
+        # check, and with iExpectedVersion moves are only applied, if the game is still
+        # in the version the client has seen; all or none of the moves are applied
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return { "status": "Not an active Game" }
+        with self.gameCache.lock:
+            # the instance held by the cache, in case game was evicted and loaded again meanwhile
+            game = self.gameCache.put(game)
+            if iExpectedVersion is not None and game.iVersion != iExpectedVersion:
+                return { "status": "Game changed meanwhile, please reload", "version": game.iVersion }
+            sError, board, sStatus, arrMoves = self._playMoves(game, arrColumns, playerNo)
+            if sError is not None:
+                return { "status": sError }
+            # only the moves are written, board is derived from move log
+            game.board = board
+            for iMoveNo, iColumn in arrMoves:
+                self.gameCache.logMove(game, iColumn, iMoveNo)
+            game.sStatus = sStatus
+            self.gameCache.markDirty(game, bFlush=False)
+            iVersion = game.iVersion
+        # written in one flush transaction (right now, if game is finished)
+        self.gameCache.flushIfNeeded(game)
+        self._notifyGameChanged(gameID, sStatus)
+        return { "status": "ok", "gamestatus": sStatus, "moves": len(arrMoves), "version": iVersion }
+
+    def dropCoin(self, gameID, playerNo, column, iExpectedVersion=None):
+        # player playerNo dropped his coin into column 
+        jResult = self._applyMoves(gameID, [column], playerNo, iExpectedVersion)
+        if jResult["status"] != "ok":
+            return jResult
+        return { "status": "ok", "version": jResult["version"] }
+
+    def dropCoins(self, gameID, arrColumns, iExpectedVersion=None):
+        # sequence of moves (replay, import, bot games), players alternate starting
+        # w/ the player, whose turn it is; one change, one version and one write
+        if not arrColumns:
+            return { "status": "No moves" }
+        return self._applyMoves(gameID, arrColumns, None, iExpectedVersion)
 
-        # and last but not least ... the diagonals backwards...
-        for iRow in range(0, self.boardRows - 3):
-            for iColumn in range(self.boardColumns - 1, 2, -1):
-                for iOffset in range(0, 4):
-                    if arrBoard[iRow + iOffset][iColumn - iOffset] == 1:
-                        countPlayer1 += 1
-                        countPlayer2 = 0
-                    elif arrBoard[iRow + iOffset][iColumn - iOffset] == 2:
-                        countPlayer1 = 0
-                        countPlayer2 += 1
-                    else:
-                        countPlayer1 = countPlayer2 = 0
-                    if countPlayer1 == 4:
-                        sStatus = "1WON"
-                    if countPlayer2 == 4:
-                        sStatus = "2WON"
-                countPlayer1 = countPlayer2 = 0
-        if sStatus != "":
-            self.setGameStatus(gameID, sStatus)
-            return True
-        return False        
+    def setGameStatus(self, gameID, sStatus):
+        # status is written to database with next flush, so it is validated here
+        # instead of relying on the constraint of the respective column
+        # changed under the cache lock like moves, so a move can't overwrite it
+        if sStatus not in self.arrGameStates:
+            raise ValueError("Invalid game status " + str(sStatus))
+        game = self._getCachedGame(gameID)
+        if game is not None:
+            with self.gameCache.lock:
+                game = self.gameCache.put(game)
+                self._setCachedStatus(game, sStatus)
+            self.gameCache.flushIfNeeded(game)
+            self._notifyGameChanged(gameID, sStatus)
+        # debug sw - return gameid new status
+        return { "status": "exit" }
 
-    def dropCoin(self, gameID, playerNo, column):
-        # player playerNo dropped his coin into column 
+    def _setCachedStatus(self, game, sStatus):
+        # caller holds the cache lock and calls flushIfNeeded afterwards
+        if game.sStatus == "WAITING":
+            # game will not be joined anymore
+            self.matchQueue.remove(game.gameID)
+        game.sStatus = sStatus
+        self.gameCache.markDirty(game, bFlush=False)
 
-        if not self.isGameActive(gameID):
-            return { "status": "Not an active Game" }
-        if not self.isItMyTurn(gameID, playerNo):
-            return { "status": "ITs. NOT. YOUR. TURN. ...\n\n DON'T PRESS BUTTONS" }
+    def getGameStatus(self, gameID):
+        # get status of game gameID
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return False
+        return game.sStatus
 
-        # force typecast of column as it was a str
-        iColumn:int = int(column)
-        if iColumn not in range(1, self.boardColumns + 1):
-            return { "status": "Selected column out of range" }
-        
-        arrBoard = self.getGameBoard(gameID)
+    def addGameListener(self, callback):
+        # callback(gameID, sStatus) is called on every change of a game
+        # i.e. a move, a player joining or quitting and the game being finished
+        self.arrGameListeners.append(callback)
 
-        # align selected column to be array index
-        iColumn -= 1
+    def _notifyGameChanged(self, gameID, sStatus):
+        for callback in self.arrGameListeners:
+            callback(gameID, sStatus)
 
-        for iRow in range((self.boardRows - 1), -1, -1):
-            if arrBoard[iRow][iColumn] == 0:
-                arrBoard[iRow][iColumn] = playerNo
-                playerNo = 0
+    def getGameVersion(self, gameID):
+        # version of game gameID, increased by every change of status, board or players
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return False
+        return game.iVersion
 
-        if playerNo > 0:
-            return { "status": "Column is full, coin would fall onto your desktop...\n\nTry again" }
-        
-        self.setGameBoard(gameID, arrBoard)
+    def getCacheStats(self):
+        # hit/miss counters of game cache
+        return self.gameCache.getStats()
 
-        # check, if there is a winner (or stalemate)
-        if self.isGameFinished(gameID):
-            return { "status": "ok" }
+    def isSessionRegistered(self, sSessionToken):
+        return self.getPlayerID(sSessionToken) is not False
 
-        sPlayer = "PLAYER1"
-        if sPlayer == self.getGameStatus(gameID):
-            sPlayer = "PLAYER2"
-        self.setGameStatus(gameID, sPlayer)
-        return { "status": "ok" }
+    def registerSession(self, sSessionToken):
+        # creates new record in DB for sSessionToken and returns ID of it
 
-    def setGameStatus(self, gameID, sStatus):
-        # sStatus is not validated, application would throw exception because of constraint on respective column
-        sSQL = "UPDATE games SET status = '" + sStatus + "' WHERE game_id = " + str(gameID) + ";"
-        self.dbC.execute(sSQL)
+        # don't hijack sessions: already registered token returns False
+        # unique index on token makes this one lookup and insert
+        sSQL = "INSERT OR IGNORE INTO players (player_token) values (?);"
+        self.dbC.execute(sSQL, (self._tokenToBlob(sSessionToken),))
         self.dbSession.commit()
-        # debug sw - return gameid new status
-        return { "status": "exit" }
-
-    def getGameStatus(self, gameID):
-        # get status of game gameID
-        sSQL = "SELECT status FROM games WHERE game_id = " + str(gameID) + ";"
-        self.dbC.execute(sSQL)
-        rResult = self.dbC.fetchone()
-        if rResult is None:
+        if self.dbC.rowcount == 0:
             return False
-        else:
-            return rResult[0]
+        return self.dbC.lastrowid
 
-    def isSessionRegistered(self, sSessionToken):
-        sSQL = "SELECT player_id from players where player_token='" + sSessionToken + "';"
-        self.dbC.execute(sSQL)
+    def getPlayerID(self, sSessionToken):
+        # returns ID of player registered with sSessionToken or False
+        self.dbC.execute(self.sSQLGetPlayer, (self._tokenToBlob(sSessionToken),))
         rResult = self.dbC.fetchone()
         if rResult is None:
             return False
-        else:
-            return True
-
-    def registerSession(self, sSessionToken):
-        # selects id for sSessionToken, creates new record in DB if not already in list
-        # and returns ID of it
+        return rResult[0]
+
+    def _joinGame(self, entry, playerID):
+        # join waiting game of matchmaking queue entry as player 2
+        # join is a check-and-set on player2, so a game can only be taken once,
+        # even if another process or thread tries to join it at the same time
+        # cached status is ahead of the database row (i.e. a game canceled since the last flush
+        # can't be joined), it is checked under the cache lock, the write is done w/o the lock,
+        # so cache readers don't wait for the database
+        gameID = entry[0]
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return False
+        with self.gameCache.lock:
+            game = self.gameCache.put(game)
+            if game.sStatus != "WAITING" or game.player2 != self.dummyPlayerID:
+                return False
+            iVersion = game.iVersion + 1
+        sSQL = "UPDATE games set player2=?, status='PLAYER1', version=?, updated=? WHERE game_id=? AND player2=? AND status='WAITING';"
+        self.dbC.execute(sSQL, (playerID, iVersion, int(time.time()), gameID, self.dummyPlayerID))
+        self.dbSession.commit()
+        if self.dbC.rowcount != 1:
+            return False
 
-        # don't hijack sessions
-        if self.isSessionRegistered(sSessionToken):
+        with self.gameCache.lock:
+            # game might have been evicted and loaded again (already joined) meanwhile
+            game = self.gameCache.put(game)
+            if game.player2 == playerID:
+                bJoined = True
+            elif game.sStatus != "WAITING" or game.player2 != self.dummyPlayerID:
+                # canceled meanwhile: cached state is written again over the joined row
+                self.gameCache.markDirty(game, bFlush=False)
+                bJoined = False
+            else:
+                # joining is written through, cached game follows
+                game.player2 = playerID
+                game.sStatus = "PLAYER1"
+                self.gameCache.markDirty(game, bFlush=False)
+                bJoined = True
+        if not bJoined:
+            self.gameCache.flushIfNeeded(game)
             return False
 
-        sSQL = "SELECT player_id from players where player_token='" + sSessionToken + "';"
-        self.dbC.execute(sSQL)
-        rResult = self.dbC.fetchone()
-        if rResult is None:
-            # create new record for session
-            sSQL = "INSERT INTO players (player_token) values ('" + sSessionToken + "');"
-            self.dbC.execute(sSQL)
-            return self.dbC.lastrowid
-        else:
-            return rResult[0]
+        self.matchQueue.paired(entry)
+        self._notifyGameChanged(gameID, "PLAYER1")
+        return True
 
-    def attachPlayerToFreeGameSlot(self, sSessionToken):
+    def attachPlayerToFreeGameSlot(self, sSessionToken, iRows=None, iColumns=None, iConnect=None):
         # assign player to next free game and 
         # return status of attached game
+        # board size and coins to win default to the classic game, players
+        # are only paired for games of the same size (ValueError for invalid sizes)
+        board = VGBoard(iRows, iColumns, iConnect)
+        tShape = board.getShape()
 
         # get player-id for given session token
-        playerID = self.registerSession(sSessionToken)
+        playerID = self.getPlayerID(sSessionToken) or self.registerSession(sSessionToken)
         gameID = 0
         playerNo = 0
         gameStatus = "WAITING"
 
-        # search for a game with second free slot
-        sSQL= """
-        SELECT games.game_id from games, players
-            WHERE games.player2 = players.player_id
-            AND players.player_token='dummy';
-        """
-        self.dbC.execute(sSQL)
-        rResult = self.dbC.fetchone()
-        if rResult is None:
+        # take oldest waiting games from matchmaking queue, until one can be joined
+        entry = self.matchQueue.pop(playerID, tShape)
+        while entry is not None and not self._joinGame(entry, playerID):
+            entry = self.matchQueue.pop(playerID, tShape)
+
+        if entry is None:
             # no open game left, therefore start new game with status WAITING for 2nd player
             playerNo = 1
-            arrBoard = [[0 for x in range(self.boardColumns)] for y in range(self.boardRows)]
-
-            sSQL="INSERT INTO games (player1, board) values (?, ?)"
-            self.dbC.execute(sSQL, (playerID, json.dumps(arrBoard)))
-            self.dbSession.commit()
-            gameID = self.dbC.lastrowid
+            gameID = self._createGame(playerID, board)
+            self.matchQueue.push(gameID, playerID, None, tShape)
         else:    
-            # assign player to already open game
-            # and set status to be players 1 turn
+            # player was assigned to already open game
+            # and status set to be players 1 turn
             playerNo = 2
             gameStatus = "PLAYER1"
-            gameID = rResult[0]
-            sSQL = "UPDATE games set player2=" + str(playerID) + ", status='PLAYER1' WHERE game_id=" + str(gameID) + ";"
-            self.dbC.execute(sSQL)
-            self.dbSession.commit()
-        return { "gameid": gameID, "playerno": playerNo, "status": gameStatus }
+            gameID = entry[0]
+        return { "gameid": gameID, "playerno": playerNo, "status": gameStatus,
+            "rows": tShape[0], "columns": tShape[1], "connect": tShape[2] }
+
+    def _createGame(self, playerID, board):
+        # inserts new game WAITING for a second player, returns its ID
+        # no bitboard: board of new games is replayed from move log
+        sSQL="INSERT INTO games (game_id, player1, player2, updated, board_rows, board_columns, connect) values (?, ?, ?, ?, ?, ?, ?)"
+        self.dbC.execute(sSQL, (self._nextGameID(), playerID, self.dummyPlayerID, int(time.time())) + board.getShape())
+        self.dbSession.commit()
+        gameID = self.dbC.lastrowid
+        self.gameCache.put(VGCachedGame(gameID, playerID, self.dummyPlayerID, "WAITING", board))
+        return gameID
+
+    def _nextGameID(self):
+        # None lets SQLite choose the ID, a shard only uses IDs w/ ID % iShardCount == iShardIndex
+        if self.iShardCount == 1:
+            return None
+        with self.shardLock:
+            if self.iLastGameID is None:
+                self.dbC.execute("""SELECT max(iMax) FROM (SELECT max(game_id) AS iMax FROM games
+                    UNION ALL SELECT max(game_id) FROM games_archive UNION ALL SELECT seq FROM sqlite_sequence WHERE name='games');""")
+                self.iLastGameID = self.dbC.fetchone()[0] or 0
+            gameID = self.iLastGameID + 1
+            gameID += (self.iShardIndex - gameID) % self.iShardCount
+            self.iLastGameID = gameID
+            return gameID
+
+    def createWaitingGame(self, sSessionToken, iRows=None, iColumns=None, iConnect=None):
+        # sharded mode: new game of shard, matchmaking is done by the router (see vgrouter)
+        board = VGBoard(iRows, iColumns, iConnect)
+        tShape = board.getShape()
+        playerID = self.getPlayerID(sSessionToken) or self.registerSession(sSessionToken)
+        gameID = self._createGame(playerID, board)
+        return { "gameid": gameID, "playerno": 1, "status": "WAITING",
+            "rows": tShape[0], "columns": tShape[1], "connect": tShape[2] }
+
+    def joinWaitingGame(self, gameID, sSessionToken):
+        # sharded mode: player of sSessionToken joins game gameID of this shard chosen by
+        # the router, returns status of game like attachPlayerToFreeGameSlot or False,
+        # if it was already taken or canceled meanwhile
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return False
+        playerID = self.getPlayerID(sSessionToken) or self.registerSession(sSessionToken)
+        if not self._joinGame((gameID, game.player1, time.monotonic(), game.board.getShape()), playerID):
+            return False
+        tShape = game.board.getShape()
+        return { "gameid": gameID, "playerno": 2, "status": "PLAYER1",
+            "rows": tShape[0], "columns": tShape[1], "connect": tShape[2] }
+
+    def getWaitingGames(self):
+        # (gameID, session token of player 1, board shape) of all games waiting for a second player
+        sSQL = """SELECT game_id, player_token, board_rows, board_columns, connect FROM games
+            JOIN players ON players.player_id=games.player1 WHERE status='WAITING' AND player2=? ORDER BY game_id;"""
+        self.dbC.execute(sSQL, (self.dummyPlayerID,))
+        return [(rResult[0], self._blobToToken(rResult[1]), tuple(rResult[2:5])) for rResult in self.dbC.fetchall()]
+
+    def attachBotToWaitingGames(self, botPlayerID, fTimeout):
+        # games waiting longer than fTimeout seconds for a second player get the bot
+        # bot only plays on the classic board, returns IDs of joined games
+        arrJoined = []
+        for entry in self.matchQueue.popWaitingLongerThan(fTimeout, (self.boardRows, self.boardColumns, self.iConnect)):
+            if self._joinGame(entry, botPlayerID):
+                arrJoined.append(entry[0])
+        return arrJoined
+
+    def getGamePlayers(self, gameID):
+        # player IDs (player1, player2) of game gameID
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return False
+        return (game.player1, game.player2)
+
+    def getActiveGamesOfPlayer(self, playerID, playerNo):
+        # (gameID, status) of all running games, in which playerID is player playerNo
+        sSQL = "SELECT game_id FROM games WHERE status IN ('PLAYER1', 'PLAYER2') AND player" + str(int(playerNo)) + "=?;"
+        self.dbC.execute(sSQL, (playerID,))
+        return [(rResult[0], self.getGameStatus(rResult[0])) for rResult in self.dbC.fetchall()]
+
+    def getGameMoves(self, gameID):
+        # played columns (0 based) of game gameID, running or archived, False if unknown
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return False
+        if not game.bMoveLog:
+            # game of older version, order of moves is unknown
+            return None
+        # moves still pending in cache are written first
+        self.gameCache.flush()
+        arrColumns = self._loadMoves(gameID)
+        if not arrColumns and game.board.iMoves:
+            self.dbC.execute("SELECT moves, movelog FROM games_archive WHERE game_id=?;", (gameID,))
+            rResult = self.dbC.fetchone()
+            if rResult is not None:
+                arrColumns = unpackMoves(rResult[1], rResult[0], game.board.shape.iBitsPerMove)
+        return arrColumns
+
+    def replayGame(self, gameID):
+        # yields (move number, player, column, board) for every move of game gameID
+        # board is the same VGBoard instance, updated in place from move to move
+        arrColumns = self.getGameMoves(gameID)
+        if arrColumns:
+            board = VGBoard(*self.getGameBitboard(gameID).getShape())
+        for iMove, iColumn in enumerate(arrColumns or []):
+            playerNo = playerOfMove(iMove + 1)
+            board.dropCoin(iColumn, playerNo)
+            yield iMove + 1, playerNo, iColumn, board
+
+    def archiveFinishedGames(self, iBatchSize=500):
+        # moves up to iBatchSize finished games from games/moves to games_archive
+        # (move log packed to 3 bits per move, 4 for more than 8 columns),
+        # returns number of archived games
+        # games with changes not yet flushed are taken with a later batch
+        self.gameCache.flush()
+        sSQL = "SELECT game_id, player1, player2, status, version, moves, bitboard, board, board_rows, board_columns, connect FROM games WHERE status IN (" + \
+            ",".join(["'" + sStatus + "'" for sStatus in self.gameCache.arrFinishedStates]) + ") LIMIT ?;"
+        self.dbC.execute(sSQL, (iBatchSize,))
+        arrRows = []
+        for rResult in self.dbC.fetchall():
+            game = self.gameCache.peek(rResult[0])
+            if game is not None and game.bDirty:
+                continue
+            if rResult[6] is None and rResult[7] is None:
+                arrColumns = self._loadMoves(rResult[0])
+                iBits = VGBoard(*rResult[8:11]).shape.iBitsPerMove
+                arrRows.append(rResult[:5] + (len(arrColumns), packMoves(arrColumns, iBits), None) + rResult[8:11])
+            else:
+                bitboard = rResult[6] if rResult[6] is not None else VGBoard.fromList(json.loads(rResult[7])).toBlob()
+                arrRows.append(rResult[:5] + (rResult[5], None, bitboard) + rResult[8:11])
+        if not arrRows:
+            return 0
 
-    def __init__(self,sFilename='/db/gameserver.sqlite'):
+        try:
+            sSQL = """INSERT OR REPLACE INTO games_archive (game_id, player1, player2, status, version, moves, movelog, bitboard,
+                board_rows, board_columns, connect) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""
+            self.dbC.executemany(sSQL, arrRows)
+            self.dbC.executemany("DELETE FROM moves WHERE game_id=?;", [(rRow[0],) for rRow in arrRows])
+            self.dbC.executemany("DELETE FROM games WHERE game_id=?;", [(rRow[0],) for rRow in arrRows])
+            self.dbSession.commit()
+        except sqlite3.Error:
+            self.dbSession.rollback()
+            raise
+        return len(arrRows)
+
+    def cancelInactiveGames(self, fTimeout, iBatchSize=500):
+        # cancels up to iBatchSize waiting or running games w/o any change for fTimeout seconds
+        # (i.e. client disappeared w/o quitting), returns number of canceled games
+        # the dummy game of the block player is never canceled
+        fLimit = time.time() - fTimeout
+        sSQL = "SELECT game_id FROM games WHERE status IN ('WAITING', 'PLAYER1', 'PLAYER2') AND updated<? AND player1<>? LIMIT ?;"
+        self.dbC.execute(sSQL, (int(fLimit), self.blockPlayerID, iBatchSize))
+        # games are loaded before, all statuses are changed under the cache lock and written w/ one flush
+        arrGames = [self._getCachedGame(rResult[0]) for rResult in self.dbC.fetchall()]
+        arrCanceled = []
+        with self.gameCache.lock:
+            for game in arrGames:
+                if game is None:
+                    continue
+                game = self.gameCache.put(game)
+                # cached game might have changed after last flush
+                if game.fUpdated >= fLimit or game.sStatus not in ("WAITING", "PLAYER1", "PLAYER2"):
+                    continue
+                self._setCachedStatus(game, "CANCELED")
+                arrCanceled.append(game.gameID)
+        if arrCanceled:
+            self.gameCache.flush()
+        for gameID in arrCanceled:
+            self._notifyGameChanged(gameID, "CANCELED")
+        return len(arrCanceled)
+
+    def incrementalVacuum(self, iPages=1000):
+        # gives up to iPages free pages back to the filesystem, returns number of freed pages
+        self.dbC.execute("PRAGMA freelist_count;")
+        iFree = self.dbC.fetchone()[0]
+        self.dbC.execute("PRAGMA incremental_vacuum(" + str(int(iPages)) + ");")
+        self.dbC.fetchall()
+        self.dbSession.commit()
+        self.dbC.execute("PRAGMA freelist_count;")
+        return iFree - self.dbC.fetchone()[0]
+
+    def exportGames(self, iAfterGameID=0, iBatchSize=1000):
+        # streams archived games with ID > iAfterGameID, ordered by ID, as dicts
+        # every batch is an own query, so the generator can be consumed by different threads
+        sSQL = "SELECT game_id, player1, player2, status, moves, movelog, board_rows, board_columns, connect FROM games_archive WHERE game_id>? ORDER BY game_id LIMIT ?;"
+        while True:
+            self.dbC.execute(sSQL, (iAfterGameID, iBatchSize))
+            arrRows = self.dbC.fetchall()
+            for rResult in arrRows:
+                iBits = VGBoard(*rResult[6:9]).shape.iBitsPerMove
+                yield { "gameid": rResult[0], "player1": rResult[1], "player2": rResult[2], "status": rResult[3],
+                    "rows": rResult[6], "columns": rResult[7], "connect": rResult[8],
+                    "moves": [iColumn + 1 for iColumn in unpackMoves(rResult[5], rResult[4], iBits)] if rResult[5] is not None else None }
+            if len(arrRows) < iBatchSize:
+                return
+            iAfterGameID = arrRows[-1][0]
+
+    def getStoredBoardChunks(self, iAfterGameID=0, iBatchSize=10000):
+        # streams all stored games (running and archived) with ID > iAfterGameID in chunks
+        # of up to iBatchSize rows (gameID, status, bitboard blob or None, columns or None, board shape)
+        # for analytics, boards are not replayed here (see vganalytics), cache is bypassed
+        self.gameCache.flush()
+        sSQL = """SELECT game_id, status, bitboard, board, NULL, NULL, board_rows, board_columns, connect FROM games WHERE game_id>?
+            UNION ALL SELECT game_id, status, bitboard, NULL, moves, movelog, board_rows, board_columns, connect FROM games_archive WHERE game_id>?
+            ORDER BY game_id LIMIT ?;"""
+        while True:
+            self.dbC.execute(sSQL, (iAfterGameID, iAfterGameID, iBatchSize))
+            arrRows = self.dbC.fetchall()
+            if not arrRows:
+                return
+            # move logs of running games in the chunk with one range query
+            dictMoves = {}
+            self.dbC.execute("SELECT game_id, col FROM moves WHERE game_id BETWEEN ? AND ? ORDER BY game_id, move_no;",
+                (arrRows[0][0], arrRows[-1][0]))
+            for rResult in self.dbC.fetchall():
+                dictMoves.setdefault(rResult[0], []).append(rResult[1])
+
+            arrChunk = []
+            for gameID, sStatus, bitboard, sBoard, iMoves, movelog, iRows, iColumns, iConnect in arrRows:
+                tShape = (iRows, iColumns, iConnect)
+                if movelog is not None:
+                    arrChunk.append((gameID, sStatus, None, unpackMoves(movelog, iMoves, VGBoard(*tShape).shape.iBitsPerMove), tShape))
+                elif bitboard is not None:
+                    arrChunk.append((gameID, sStatus, bitboard, None, tShape))
+                elif sBoard is not None:
+                    arrChunk.append((gameID, sStatus, VGBoard.fromList(json.loads(sBoard)).toBlob(), None, tShape))
+                else:
+                    arrChunk.append((gameID, sStatus, None, dictMoves.get(gameID, []), tShape))
+            yield arrChunk
+            if len(arrRows) < iBatchSize:
+                return
+            iAfterGameID = arrRows[-1][0]
+
+    def getMatchmakingStats(self):
+        # queue depth and wait times of games waiting for second player
+        return self.matchQueue.getStats()
+
+    def getGameCounts(self):
+        # number of stored games per status (archived games as "ARCHIVED") for monitoring,
+        # read w/o flushing the cache, so changes of the last flush interval may be missing
+        # the dummy game of the block player is not counted
+        self.dbC.execute("SELECT status, COUNT(*) FROM games WHERE player1<>? GROUP BY status;", (self.blockPlayerID,))
+        dictCounts = { rResult[0]: rResult[1] for rResult in self.dbC.fetchall() }
+        self.dbC.execute("SELECT COUNT(*) FROM games_archive;")
+        dictCounts["ARCHIVED"] = self.dbC.fetchone()[0]
+        return dictCounts
+
+    def _loadMatchQueue(self):
+        # fill matchmaking queue w/ games still waiting from last run (uses index on status)
+        self.dummyPlayerID = self.getPlayerID('dummy')
+        self.blockPlayerID = self.getPlayerID('block')
+        self.matchQueue = VGMatchQueue()
+        sSQL = "SELECT game_id, player1, board_rows, board_columns, connect FROM games WHERE status='WAITING' AND player2=? ORDER BY game_id;"
+        self.dbC.execute(sSQL, (self.dummyPlayerID,))
+        for rResult in self.dbC.fetchall():
+            self.matchQueue.push(rResult[0], rResult[1], None, tuple(rResult[2:5]))
+
+    def __init__(self,sFilename='/db/gameserver.sqlite', fFlushInterval=1.0, iCacheSize=10000, iShardIndex=0, iShardCount=1):
         # GAMEDB constructor:
         #   check, if path for db exists, if not, create it
         #   create database and add tables, when needed
+        #   fFlushInterval: seconds between writes of cached games, 0 writes through
+        #   iCacheSize: max. number of games held in memory
+        #   iShardIndex/iShardCount: database is shard iShardIndex of iShardCount, it
+        #   holds the games w/ game_id % iShardCount == iShardIndex (see vgrouter)
+        self.iShardIndex = iShardIndex
+        self.iShardCount = iShardCount
+        self.iLastGameID = None
+        self.shardLock = threading.Lock()
 
         # split path from filename
         sPath = os.path.split(sFilename)[0].replace('..','') # ensure, that path is inside current directory
@@ -321,23 +909,35 @@ class GameDB():
                 print('Failed to create directory for storing db', error)
             
         ## finaly open/create GameDB
+        # every thread (i.e. every worker of the API threadpool) uses its own connection
         try:
-            self.dbSession = sqlite3.connect('./' + sFilename, check_same_thread=False)
+            self.sDBFile = './' + sFilename
+            self.dbPool = VGConnectionPool(self.sDBFile)
         except sqlite3.Error as error:
             print('Failed to connect to SQLite3 db with error', error)
 
-        # check, if database was just created when starting the app
-        self.dbC = self.dbSession.cursor()
-        sSQL = """
-        SELECT name FROM sqlite_schema 
-        WHERE type='table';
-        """
-        self.dbC.execute(sSQL)
+        # create tables or bring them forward, when created by an older version
+        self._checkIncrementalVacuum()
+        self.migrateDB()
+
+        self.gameCache = VGGameCache(self.dbPool, fFlushInterval, iCacheSize)
+        self._loadMatchQueue()
+        self.arrGameListeners = []
+
+    @property
+    def dbSession(self):
+        # connection of current thread
+        return self.dbPool.connection()
 
-        if not next(self.dbC, [None])[0]:
-            # GameDB is empty, tables need to be created 
-            self.createDB()
+    @property
+    def dbC(self):
+        # cursor of current thread
+        return self.dbPool.cursor()
 
+    def close(self):
+        # write all cached changes before shutting down
+        self.gameCache.close()
+        self.dbPool.close()
 
     def __del(self):
         self.dbC.close()
@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+
+#
+# class VGConnectionPool
+#
+# implements one SQLite connection (and cursor) per thread
+#
+# connections are never shared between threads, WAL journaling lets readers
+# run concurrently with the (single) writer, busy_timeout makes writers wait
+# for each other instead of failing with "database is locked"
+# sqlite3 keeps prepared statements per connection, so every parameterized
+# statement is compiled once per thread and then reused
+
+
+class VGConnectionPool():
+    iBusyTimeout:int = 5000         # ms
+    iCacheSize:int = -16000         # negative: KiB per connection
+    iCachedStatements:int = 256
+    # replaced by an instrumented connection class, when metrics are enabled (see VGMetrics)
+    connectionFactory = sqlite3.Connection
+
+    def __init__(self, sFilename):
+        self.sFilename = sFilename
+        self.local = threading.local()
+        self.arrConnections = []
+        self.lock = threading.Lock()
+
+        # journal mode is persistent in database file, so it is set only once
+        dbSession = self.connection()
+        dbSession.execute("PRAGMA journal_mode=WAL;")
+
+    def _connect(self):
+        dbSession = sqlite3.connect(self.sFilename, timeout=self.iBusyTimeout / 1000,
+            check_same_thread=False, cached_statements=self.iCachedStatements, factory=self.connectionFactory)
+        dbSession.execute("PRAGMA busy_timeout=" + str(self.iBusyTimeout) + ";")
+        # with WAL, NORMAL is still safe against corruption, only last commits may be lost on power failure
+        dbSession.execute("PRAGMA synchronous=NORMAL;")
+        dbSession.execute("PRAGMA cache_size=" + str(self.iCacheSize) + ";")
+        dbSession.execute("PRAGMA temp_store=MEMORY;")
+        return dbSession
+
+    def connection(self):
+        # connection of current thread, opened on first use
+        dbSession = getattr(self.local, "dbSession", None)
+        if dbSession is None:
+            dbSession = self._connect()
+            self.local.dbSession = dbSession
+            self.local.dbC = dbSession.cursor()
+            with self.lock:
+                self.arrConnections.append(dbSession)
+        return dbSession
+
+    def cursor(self):
+        # cursor of current thread
+        if getattr(self.local, "dbSession", None) is None:
+            self.connection()
+        return self.local.dbC
+
+    def getTotalChanges(self):
+        # rows inserted, updated or deleted by all open connections
+        with self.lock:
+            return sum(dbSession.total_changes for dbSession in self.arrConnections)
+
+    def getConnectionCount(self):
+        with self.lock:
+            return len(self.arrConnections)
+
+    def close(self):
+        # close connections of all threads
+        with self.lock:
+            for dbSession in self.arrConnections:
+                try:
+                    dbSession.close()
+                except sqlite3.Error:
+                    pass
+            self.arrConnections = []
+        self.local = threading.local()
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import deque
+
+#
+# class VGMatchQueue
+#
+# implements FIFO of games waiting for a second player
+#
+# queue only decides which game a player should try to join, the join itself
+# is a check-and-set on the games table (see GameDB.attachPlayerToFreeGameSlot),
+# so a game taken by another process or canceled meanwhile is simply skipped
+# players are only paired for games of the same board shape (rows, columns, connect)
+
+
+class VGMatchQueue():
+    def __init__(self):
+        # entries: (gameID, player1, time of enqueueing, board shape)
+        self.queueGames = deque()
+        self.lock = threading.Lock()
+        self.iEnqueued = 0
+        self.iPaired = 0
+        self.fTotalWait = 0.0
+        self.fMaxWait = 0.0
+
+    def push(self, gameID, player1, fEnqueued=None, tShape=None):
+        with self.lock:
+            self.queueGames.append((gameID, player1, fEnqueued if fEnqueued is not None else time.monotonic(), tShape))
+            self.iEnqueued += 1
+
+    def pop(self, playerID, tShape=None):
+        # oldest waiting game of board shape tShape not opened by playerID himself,
+        # None if there is none
+        with self.lock:
+            for iIndex, entry in enumerate(self.queueGames):
+                if entry[1] != playerID and entry[3] == tShape:
+                    del self.queueGames[iIndex]
+                    return entry
+        return None
+
+    def popWaitingLongerThan(self, fSeconds, tShape=None):
+        # all entries waiting for more than fSeconds (i.e. to be joined by the bot),
+        # with tShape only those of that board shape
+        fLimit = time.monotonic() - fSeconds
+        arrEntries = []
+        arrOthers = []
+        with self.lock:
+            while self.queueGames and self.queueGames[0][2] <= fLimit:
+                entry = self.queueGames.popleft()
+                if tShape is None or entry[3] == tShape:
+                    arrEntries.append(entry)
+                else:
+                    arrOthers.append(entry)
+            # entries of other shapes keep their position
+            self.queueGames.extendleft(reversed(arrOthers))
+        return arrEntries
+
+    def paired(self, entry):
+        # game of entry got its second player
+        fWaited = time.monotonic() - entry[2]
+        with self.lock:
+            self.iPaired += 1
+            self.fTotalWait += fWaited
+            self.fMaxWait = max(self.fMaxWait, fWaited)
+        return fWaited
+
+    def remove(self, gameID):
+        # game left queue without second player, i.e. canceled
+        with self.lock:
+            for iIndex, entry in enumerate(self.queueGames):
+                if entry[0] == gameID:
+                    del self.queueGames[iIndex]
+                    return True
+        return False
+
+    def getStats(self):
+        with self.lock:
+            fNow = time.monotonic()
+            return {
+                "depth": len(self.queueGames),
+                "enqueued": self.iEnqueued,
+                "paired": self.iPaired,
+                "avgwait": self.fTotalWait / self.iPaired if self.iPaired else 0.0,
+                "maxwait": self.fMaxWait,
+                "oldestwaiting": fNow - self.queueGames[0][2] if self.queueGames else 0.0 }
@@ -0,0 +1,299 @@
+import bisect
+import functools
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+#
+# class VGMetrics
+#
+# implements instrumentation of the gameserver, exposed in Prometheus text format
+#
+# nothing is wrapped or timed, unless metrics are enabled (METRICS=1 for vgserver):
+# the timed methods are replaced on the instances only then, so a disabled
+# layer costs nothing on the hot paths
+#
+#   - histograms per endpoint (ASGI middleware) and per GameDB method
+#   - commits and statements of SQLite (connection/cursor factory of the pool)
+#   - SQLite does not report its busy waits, so write statements and commits
+#     taking longer than fLockWaitThreshold are counted as lock waits
+#   - VGSamplingProfiler samples stacks of all threads for a time window
+#
+#   python vgmetrics.py    (checks, that the writes of a cache flush are counted)
+
+
+class VGHistogram():
+    # upper bounds in seconds, +Inf is added
+    arrBuckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.arrCounts = [0] * (len(self.arrBuckets) + 1)
+        self.fSum = 0.0
+        self.iCount = 0
+
+    def observe(self, fValue):
+        self.arrCounts[bisect.bisect_left(self.arrBuckets, fValue)] += 1
+        self.fSum += fValue
+        self.iCount += 1
+
+
+class VGMetrics():
+    fLockWaitThreshold:float = 0.005
+    dictHelp = {
+        "vg_http_request_seconds": "Duration of HTTP requests by route",
+        "vg_gamedb_call_seconds": "Duration of game controller calls by method",
+        "vg_cache_flush_seconds": "Duration of writing dirty games of the cache",
+        "vg_sqlite_commit_seconds": "Duration of SQLite commits",
+        "vg_sqlite_statements_total": "Executed SQLite statements",
+        "vg_sqlite_lock_waits_total": "Writes and commits slower than the lock wait threshold",
+        "vg_sqlite_lock_wait_seconds_total": "Time spent in writes and commits slower than the lock wait threshold",
+        "vg_sqlite_lock_errors_total": "Statements failed w/ database locked/busy" }
+
+    def __init__(self, bEnabled=False):
+        self.bEnabled = bEnabled
+        self.lock = threading.Lock()
+        # (name, labels) -> VGHistogram / int, labels are tuples of (label, value)
+        self.dictHistograms = {}
+        self.dictCounters = {}
+
+    def observe(self, sName, tLabels, fSeconds):
+        with self.lock:
+            histogram = self.dictHistograms.get((sName, tLabels))
+            if histogram is None:
+                histogram = self.dictHistograms[(sName, tLabels)] = VGHistogram()
+            histogram.observe(fSeconds)
+
+    def inc(self, sName, tLabels=(), fValue=1):
+        with self.lock:
+            self.dictCounters[(sName, tLabels)] = self.dictCounters.get((sName, tLabels), 0) + fValue
+
+    def timeMethods(self, target, arrMethods, sName, sLabel="method"):
+        # replaces methods of target (instance) w/ timed versions, only if enabled
+        if not self.bEnabled:
+            return
+        for sMethod in arrMethods:
+            setattr(target, sMethod, self._timed(getattr(target, sMethod), sName, ((sLabel, sMethod),)))
+
+    def _timed(self, callback, sName, tLabels):
+        @functools.wraps(callback)
+        def timed(*args, **kwargs):
+            fStart = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                self.observe(sName, tLabels, time.perf_counter() - fStart)
+        return timed
+
+    def instrumentDatabase(self, poolClass):
+        # connections of poolClass opened from now on time commits and statements
+        if not self.bEnabled:
+            return
+        VGTimedConnection.metrics = self
+        poolClass.connectionFactory = VGTimedConnection
+
+    def _formatLabels(self, tLabels):
+        if not tLabels:
+            return ""
+        return "{" + ",".join(sLabel + '="' + str(sValue).replace("\\", "\\\\").replace('"', '\\"') + '"'
+            for sLabel, sValue in tLabels) + "}"
+
+    def render(self, arrGauges=(), arrCounters=()):
+        # Prometheus text format, arrGauges/arrCounters: (name, help, [(labels, value)]) read at scrape time,
+        # counters are totals only ever increasing (i.e. cache hits), gauges go up and down
+        arrLines = []
+        with self.lock:
+            arrHistograms = sorted(self.dictHistograms.items(), key=lambda item: (item[0][0], item[0][1]))
+            arrCounted = sorted(self.dictCounters.items(), key=lambda item: (item[0][0], item[0][1]))
+            arrHistograms = [(tKey, list(histogram.arrCounts), histogram.fSum, histogram.iCount) for tKey, histogram in arrHistograms]
+
+        sLastName = None
+        for (sName, tLabels), fValue in arrCounted:
+            if sName != sLastName:
+                sHelp = self.dictHelp.get(sName, sName)
+                arrLines.append("# HELP " + sName + " " + sHelp)
+                arrLines.append("# TYPE " + sName + " counter")
+                sLastName = sName
+            arrLines.append(sName + self._formatLabels(tLabels) + " " + repr(fValue))
+
+        for (sName, tLabels), arrCounts, fSum, iCount in arrHistograms:
+            if sName != sLastName:
+                sHelp = self.dictHelp.get(sName, sName)
+                arrLines.append("# HELP " + sName + " " + sHelp)
+                arrLines.append("# TYPE " + sName + " histogram")
+                sLastName = sName
+            iCumulated = 0
+            for fBound, iBucket in zip(VGHistogram.arrBuckets + ("+Inf",), arrCounts):
+                iCumulated += iBucket
+                arrLines.append(sName + "_bucket" + self._formatLabels(tLabels + (("le", fBound),)) + " " + str(iCumulated))
+            arrLines.append(sName + "_sum" + self._formatLabels(tLabels) + " " + repr(fSum))
+            arrLines.append(sName + "_count" + self._formatLabels(tLabels) + " " + str(iCount))
+
+        for sType, arrScraped in (("counter", arrCounters), ("gauge", arrGauges)):
+            for sName, sHelp, arrValues in arrScraped:
+                arrLines.append("# HELP " + sName + " " + sHelp)
+                arrLines.append("# TYPE " + sName + " " + sType)
+                for tLabels, fValue in arrValues:
+                    arrLines.append(sName + self._formatLabels(tLabels) + " " + repr(fValue))
+        return "\n".join(arrLines) + "\n"
+
+
+class VGTimedCursor(sqlite3.Cursor):
+    # write statements waiting longer than the threshold most likely waited for the write lock
+    def execute(self, sSQL, parameters=()):
+        return self._timed(super().execute, sSQL, parameters)
+
+    def executemany(self, sSQL, parameters):
+        return self._timed(super().executemany, sSQL, parameters)
+
+    def _timed(self, callback, sSQL, parameters):
+        metrics = VGTimedConnection.metrics
+        fStart = time.perf_counter()
+        try:
+            return callback(sSQL, parameters)
+        except sqlite3.OperationalError as error:
+            if "locked" in str(error) or "busy" in str(error):
+                metrics.inc("vg_sqlite_lock_errors_total")
+            raise
+        finally:
+            fTime = time.perf_counter() - fStart
+            sVerb = sSQL.lstrip()[:6].upper()
+            metrics.inc("vg_sqlite_statements_total")
+            if sVerb in ("INSERT", "UPDATE", "DELETE") and fTime > metrics.fLockWaitThreshold:
+                metrics.inc("vg_sqlite_lock_waits_total")
+                metrics.inc("vg_sqlite_lock_wait_seconds_total", (), fTime)
+
+
+class VGTimedConnection(sqlite3.Connection):
+    metrics = None
+
+    def cursor(self, factory=VGTimedCursor):
+        return super().cursor(factory)
+
+    # execute of the connection itself does not use cursor(), i.e. the writes of the cache flush
+    def execute(self, sSQL, parameters=()):
+        return self.cursor().execute(sSQL, parameters)
+
+    def executemany(self, sSQL, parameters):
+        return self.cursor().executemany(sSQL, parameters)
+
+    def commit(self):
+        fStart = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            fTime = time.perf_counter() - fStart
+            self.metrics.observe("vg_sqlite_commit_seconds", (), fTime)
+            if fTime > self.metrics.fLockWaitThreshold:
+                self.metrics.inc("vg_sqlite_lock_waits_total")
+                self.metrics.inc("vg_sqlite_lock_wait_seconds_total", (), fTime)
+
+
+class VGMetricsMiddleware():
+    # ASGI middleware timing every HTTP request by route (i.e. "/dropCoin/{gameid}")
+    # streamed responses (event streams) are timed until the stream ends
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        fStart = time.perf_counter()
+        arrStatus = [500]
+
+        async def sendWithStatus(message):
+            if message["type"] == "http.response.start":
+                arrStatus[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, sendWithStatus)
+        finally:
+            route = scope.get("route")
+            # older versions of starlette don't tell the route, first part of path keeps labels few
+            sEndpoint = route.path if route is not None else "/" + scope["path"].split("/")[1]
+            self.metrics.observe("vg_http_request_seconds", (("endpoint", sEndpoint), ("method", scope["method"]),
+                ("status", arrStatus[0])), time.perf_counter() - fStart)
+
+
+#
+# class VGSamplingProfiler
+#
+# implements sampling of stacks of all threads for a time window, returns the
+# hottest stacks in collapsed format ("file:function;file:function count"),
+# which can be fed into flame graph tools
+
+
+class VGSamplingProfiler():
+    def __init__(self, fInterval=0.005):
+        self.fInterval = fInterval
+        self.lock = threading.Lock()
+
+    def _collapse(self, frame):
+        arrFrames = []
+        while frame is not None:
+            arrFrames.append(frame.f_code.co_filename.rsplit("/", 1)[-1] + ":" + frame.f_code.co_name + ":" + str(frame.f_lineno))
+            frame = frame.f_back
+        return ";".join(reversed(arrFrames))
+
+    def profile(self, fSeconds, iTop=20, bIdle=False):
+        # blocks the calling thread for fSeconds, only one profile at a time
+        # idle threads (waiting in select, locks, queues) are left out unless bIdle
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("Profiler already running")
+        try:
+            iOwnThread = threading.get_ident()
+            counterStacks = Counter()
+            iSamples = 0
+            fDeadline = time.monotonic() + fSeconds
+            while time.monotonic() < fDeadline:
+                for iThread, frame in sys._current_frames().items():
+                    if iThread == iOwnThread:
+                        continue
+                    if not bIdle and frame.f_code.co_name in ("wait", "select", "_worker", "get", "poll", "accept", "run_forever", "_run_once"):
+                        continue
+                    counterStacks[self._collapse(frame)] += 1
+                iSamples += 1
+                time.sleep(self.fInterval)
+        finally:
+            self.lock.release()
+        arrLines = ["# " + str(iSamples) + " samples in " + str(fSeconds) + " s, every " + str(self.fInterval * 1000) + " ms"]
+        for sStack, iCount in counterStacks.most_common(iTop):
+            arrLines.append(sStack + " " + str(iCount))
+        return "\n".join(arrLines) + "\n"
+
+
+def checkFlushCounted():
+    # plays one move on a temporary database w/ metrics enabled and returns the counters
+    # added by the cache flush (statements of the flush have to be counted)
+    import os
+    import tempfile
+    from vgdatabase import GameDB
+    from vgdbpool import VGConnectionPool
+    os.chdir(tempfile.mkdtemp(prefix="vgmetrics"))
+    metrics = VGMetrics(True)
+    metrics.instrumentDatabase(VGConnectionPool)
+    gameDB = GameDB("db/check.sqlite", fFlushInterval=0)
+    try:
+        gameID = gameDB.attachPlayerToFreeGameSlot("check-1")["gameid"]
+        gameDB.attachPlayerToFreeGameSlot("check-2")
+        dictBefore = dict(metrics.dictCounters)
+        iCommits = metrics.dictHistograms[("vg_sqlite_commit_seconds", ())].iCount
+        gameDB.dropCoin(gameID, 1, "4")
+        return { "statements": metrics.dictCounters.get(("vg_sqlite_statements_total", ()), 0)
+                - dictBefore.get(("vg_sqlite_statements_total", ()), 0),
+            "commits": metrics.dictHistograms[("vg_sqlite_commit_seconds", ())].iCount - iCommits }
+    finally:
+        gameDB.close()
+        VGConnectionPool.connectionFactory = sqlite3.Connection
+
+
+if __name__ == "__main__":
+    # python vgmetrics.py: checks, that writes of the cache flush are counted
+    jCounted = checkFlushCounted()
+    print("flush of one move:", jCounted["statements"], "statements,", jCounted["commits"], "commits counted")
+    sys.exit(0 if jCounted["statements"] > 0 and jCounted["commits"] > 0 else 1)
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+#
+# class VGGameNotifier
+#
+# implements notification of subscribers (i.e. open event streams) on game changes
+#
+# games are changed by sync endpoints running in the threadpool, subscribers
+# wait in the event loop, therefore they are woken up thread safe via their loop
+# several changes before a subscriber is woken up are coalesced into one
+
+
+class VGGameNotifier():
+    def __init__(self):
+        # gameID -> set of (loop, event) of subscribers
+        self.dictSubscribers = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, gameID):
+        # must be called from within the event loop of the subscriber
+        subscription = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            self.dictSubscribers.setdefault(gameID, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, gameID, subscription):
+        with self.lock:
+            setSubscribers = self.dictSubscribers.get(gameID)
+            if setSubscribers is None:
+                return
+            setSubscribers.discard(subscription)
+            if not setSubscribers:
+                del self.dictSubscribers[gameID]
+
+    def publish(self, gameID, sStatus=None):
+        # wake up all subscribers of gameID, can be called from any thread
+        with self.lock:
+            arrSubscribers = list(self.dictSubscribers.get(gameID, ()))
+        for loop, event in arrSubscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # loop of subscriber already closed
+                pass
+
+    async def wait(self, subscription, fTimeout):
+        # wait for next change, returns False on timeout
+        event = subscription[1]
+        try:
+            await asyncio.wait_for(event.wait(), fTimeout)
+        except asyncio.TimeoutError:
+            return False
+        event.clear()
+        return True
+
+    def getSubscriberCount(self):
+        with self.lock:
+            return sum(len(setSubscribers) for setSubscribers in self.dictSubscribers.values())
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+#
+# class VGReaper
+#
+# implements background maintenance of the games table, every fInterval seconds:
+#   - cancels games w/o any change for fInactiveTimeout seconds (client disappeared)
+#   - moves finished games in batches to the archive (see GameDB.archiveFinishedGames)
+#   - gives free pages back to the filesystem (incremental vacuum)
+#
+# every batch is queued for the writer task of the async game controller like
+# a request, so requests are never blocked for longer than one batch
+
+
+class VGReaper():
+    def __init__(self, asyncController, fInterval=60.0, fInactiveTimeout=3600.0, iBatchSize=500, iVacuumPages=1000):
+        self.asyncController = asyncController
+        self.fInterval = fInterval
+        self.fInactiveTimeout = fInactiveTimeout
+        self.iBatchSize = iBatchSize
+        self.iVacuumPages = iVacuumPages
+        self.task = None
+
+        self.iRuns = 0
+        self.iCanceled = 0
+        self.iArchived = 0
+        self.iVacuumedPages = 0
+        self.iErrors = 0
+        self.fLastRun = 0.0
+        self.fLastDuration = 0.0
+
+    def start(self):
+        # must be called from within the running event loop (i.e. on startup)
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.fInterval)
+            try:
+                await self.run()
+            except Exception as error:
+                self.iErrors += 1
+                print('Maintenance of games failed', error)
+
+    async def run(self):
+        # one maintenance run, batches are repeated until less than a full batch was done
+        fStart = time.monotonic()
+        if self.fInactiveTimeout > 0:
+            iCount = self.iBatchSize
+            while iCount == self.iBatchSize:
+                iCount = await self.asyncController.cancelInactiveGames(self.fInactiveTimeout, self.iBatchSize)
+                self.iCanceled += iCount
+        iCount = self.iBatchSize
+        while iCount == self.iBatchSize:
+            iCount = await self.asyncController.archiveFinishedGames(self.iBatchSize)
+            self.iArchived += iCount
+        if self.iVacuumPages > 0:
+            self.iVacuumedPages += await self.asyncController.incrementalVacuum(self.iVacuumPages)
+        self.iRuns += 1
+        self.fLastRun = time.time()
+        self.fLastDuration = time.monotonic() - fStart
+
+    def getStats(self):
+        return {
+            "runs": self.iRuns,
+            "canceled": self.iCanceled,
+            "archived": self.iArchived,
+            "vacuumedpages": self.iVacuumedPages,
+            "errors": self.iErrors,
+            "lastrun": self.fLastRun,
+            "lastduration": self.fLastDuration }
@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+import zlib
+from typing import Optional
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from vgboard import VGBoard
+from vgbot import VGBotManager
+from vgdatabase import GameDB
+from vgmatchmaking import VGMatchQueue
+
+#
+# class VGShardRouter
+#
+# implements front process of the sharded deployment
+#
+#   python vgrouter.py --shards 4 --port 3033
+#
+# starts one gameserver process per shard (vgserver w/ SHARDINDEX/SHARDCOUNT and
+# its own database file) on the ports following --port and serves the client API:
+#   - game endpoints go to the shard owning the game: game_id % number of shards
+#   - /requestgame: matchmaking stays global, waiting games of all shards are in
+#     one queue here, the join itself is done (check-and-set) by the owning shard
+#   - /registersession: token is registered on its home shard (crc32 of token)
+# routers for already running shards: SHARDS=http://host:3034,http://host:3035 uvicorn vgrouter:vgrouter
+# (router and shards need the same SHARDSECRET then, shards only serve /shard/* to requests w/ it)
+
+
+class VGShardRouter():
+    # read timeout covers parked long-poll requests and keep-alives of event streams
+    fConnectTimeout:float = 5.0
+    fReadTimeout:float = 90.0
+
+    def __init__(self, arrShardUrls, fBotJoinTimeout=30.0, sShardSecret=""):
+        self.arrShardUrls = arrShardUrls
+        self.sShardSecret = sShardSecret
+        self.fBotJoinTimeout = fBotJoinTimeout
+        self.matchQueue = VGMatchQueue()
+        self.client = None
+        self.botTask = None
+        # new games are spread round robin over the shards
+        self.iNextShard = 0
+        self.arrRequests = [0] * len(arrShardUrls)
+        self.iShardErrors = 0
+
+    def setShards(self, arrShardUrls):
+        self.arrShardUrls = arrShardUrls
+        self.arrRequests = [0] * len(arrShardUrls)
+
+    async def start(self):
+        # must be called from within the running event loop (i.e. on startup)
+        limits = httpx.Limits(max_connections=1000, max_keepalive_connections=200)
+        self.client = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(self.fReadTimeout, connect=self.fConnectTimeout),
+            headers={ "X-Shard-Secret": self.sShardSecret })
+        # games still waiting for a second player on the shards
+        for iShard in range(len(self.arrShardUrls)):
+            response = await self.forward(iShard, "GET", "/shard/waiting")
+            for jGame in response.json():
+                self.matchQueue.push(jGame["gameid"], jGame["session"], None, tuple(jGame["shape"]))
+        if self.fBotJoinTimeout > 0:
+            self.botTask = asyncio.create_task(self._botLoop())
+
+    async def stop(self):
+        if self.botTask is not None:
+            self.botTask.cancel()
+            try:
+                await self.botTask
+            except asyncio.CancelledError:
+                pass
+            self.botTask = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def getShard(self, gameID):
+        # shard owning game gameID
+        return gameID % len(self.arrShardUrls)
+
+    def getHomeShard(self, sSessionToken):
+        return zlib.crc32(sSessionToken.encode()) % len(self.arrShardUrls)
+
+    async def forward(self, iShard, sMethod, sPath, params=None, headers=None, content=None):
+        # request to shard iShard, errors of shards are answered w/ 502
+        self.arrRequests[iShard] += 1
+        try:
+            return await self.client.request(sMethod, self.arrShardUrls[iShard] + sPath, params=params, headers=headers, content=content)
+        except httpx.HTTPError as error:
+            self.iShardErrors += 1
+            raise HTTPException(status_code=502, detail="Shard " + str(iShard) + " not available: " + str(error))
+
+    async def forwardStream(self, iShard, sPath, params=None):
+        # streamed request to shard iShard (event streams, export), closed when body is done
+        self.arrRequests[iShard] += 1
+        try:
+            response = await self.client.send(self.client.build_request("GET", self.arrShardUrls[iShard] + sPath, params=params), stream=True)
+        except httpx.HTTPError as error:
+            self.iShardErrors += 1
+            raise HTTPException(status_code=502, detail="Shard " + str(iShard) + " not available: " + str(error))
+        return response
+
+    async def registerSession(self, sSessionToken):
+        await self.forward(self.getHomeShard(sSessionToken), "GET", "/shard/registersession/" + sSessionToken)
+
+    async def isSessionRegistered(self, sSessionToken):
+        response = await self.forward(self.getHomeShard(sSessionToken), "GET", "/shard/session/" + sSessionToken)
+        return response.json()["registered"]
+
+    async def requestGame(self, sSessionToken, iRows=None, iColumns=None, iConnect=None):
+        # join oldest waiting game of same board shape on any shard or open a new one
+        # ValueError for invalid board sizes
+        tShape = VGBoard(iRows, iColumns, iConnect).getShape()
+        entry = self.matchQueue.pop(sSessionToken, tShape)
+        while entry is not None:
+            response = await self.forward(self.getShard(entry[0]), "POST", "/shard/join/" + str(entry[0]), { "session": sSessionToken })
+            jResult = response.json()
+            if jResult:
+                self.matchQueue.paired(entry)
+                return jResult
+            # taken or canceled meanwhile
+            entry = self.matchQueue.pop(sSessionToken, tShape)
+
+        iShard = self.iNextShard
+        self.iNextShard = (iShard + 1) % len(self.arrShardUrls)
+        response = await self.forward(iShard, "POST", "/shard/newgame/" + sSessionToken,
+            { "rows": tShape[0], "columns": tShape[1], "connect": tShape[2] })
+        jResult = response.json()
+        self.matchQueue.push(jResult["gameid"], sSessionToken, None, tShape)
+        return jResult
+
+    async def _botLoop(self):
+        # classic games waiting longer than fBotJoinTimeout get the bot of their shard
+        tShape = (VGBoard.boardRows, VGBoard.boardColumns, VGBoard.iConnect)
+        while True:
+            await asyncio.sleep(min(1.0, self.fBotJoinTimeout / 2))
+            for entry in self.matchQueue.popWaitingLongerThan(self.fBotJoinTimeout, tShape):
+                try:
+                    response = await self.forward(self.getShard(entry[0]), "POST", "/shard/join/" + str(entry[0]), { "session": VGBotManager.sBotToken })
+                    if response.json():
+                        self.matchQueue.paired(entry)
+                except HTTPException:
+                    pass
+
+    def getStats(self):
+        return {
+            "shards": len(self.arrShardUrls),
+            "requests": list(self.arrRequests),
+            "sharderrors": self.iShardErrors,
+            "matchmaking": self.matchQueue.getStats() }
+
+
+## START router
+# secret for the internal API of the shards, random for shards started by the router
+shardRouter = VGShardRouter([sUrl for sUrl in os.getenv("SHARDS", "").split(",") if sUrl],
+    float(os.getenv("BOTTIMEOUT", "30")), os.getenv("SHARDSECRET") or uuid.uuid4().hex)
+
+vgrouter = FastAPI()
+
+@vgrouter.on_event("startup")
+async def startup():
+    global shardRouter
+    await shardRouter.start()
+
+@vgrouter.on_event("shutdown")
+async def shutdown():
+    global shardRouter
+    await shardRouter.stop()
+
+def proxyResponse(response):
+    # answer of shard w/o hop-by-hop headers
+    dictHeaders = { sHeader: response.headers[sHeader] for sHeader in ("etag", "cache-control", "vary") if sHeader in response.headers }
+    return Response(content=response.content, status_code=response.status_code, headers=dictHeaders,
+        media_type=response.headers.get("content-type"))
+
+@vgrouter.get("/registersession")
+async def get_registersession():
+    global shardRouter
+    sSessionToken = str(uuid.uuid1())
+    await shardRouter.registerSession(sSessionToken)
+    return {"token": sSessionToken }
+
+@vgrouter.get("/requestgame/{session}")
+async def get_requestgame(session: str, rows: Optional[int] = None, columns: Optional[int] = None, connect: Optional[int] = None):
+    global shardRouter
+    try:
+        VGBoard(rows, columns, connect)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid board size")
+    if session in GameDB.arrReservedTokens:
+        raise HTTPException(status_code=403, detail="Reserved session")
+    if not await shardRouter.isSessionRegistered(session):
+        return False
+    return await shardRouter.requestGame(session, rows, columns, connect)
+
+@vgrouter.get("/gamestatus/{gameid}")
+async def get_gamestatus(gameid: int, request: Request):
+    global shardRouter
+    # conditional request and negotiated format (JSON or binary frame) are passed on
+    dictHeaders = { sHeader: request.headers[sHeader] for sHeader in ("if-none-match", "accept") if sHeader in request.headers }
+    return proxyResponse(await shardRouter.forward(shardRouter.getShard(gameid), "GET", "/gamestatus/" + str(gameid),
+        request.query_params, dictHeaders))
+
+@vgrouter.get("/gameevents/{gameid}")
+async def get_gameevents(gameid: int, request: Request):
+    global shardRouter
+    response = await shardRouter.forwardStream(shardRouter.getShard(gameid), "/gameevents/" + str(gameid), request.query_params)
+
+    async def eventStream():
+        try:
+            async for bChunk in response.aiter_raw():
+                yield bChunk
+        finally:
+            await response.aclose()
+
+    return StreamingResponse(eventStream(), status_code=response.status_code, media_type=response.headers.get("content-type"),
+        headers={ "Cache-Control": "no-cache", "X-Accel-Buffering": "no" })
+
+@vgrouter.get("/spectate/{gameid}")
+async def get_spectate(gameid: int):
+    global shardRouter
+    return proxyResponse(await shardRouter.forward(shardRouter.getShard(gameid), "GET", "/spectate/" + str(gameid)))
+
+@vgrouter.get("/spectate/{gameid}/events")
+async def get_spectate_events(gameid: int):
+    # fan-out is done by the shard, the router passes on one stream per spectator
+    global shardRouter
+    response = await shardRouter.forwardStream(shardRouter.getShard(gameid), "/spectate/" + str(gameid) + "/events")
+
+    async def eventStream():
+        try:
+            async for bChunk in response.aiter_raw():
+                yield bChunk
+        finally:
+            await response.aclose()
+
+    return StreamingResponse(eventStream(), status_code=response.status_code, media_type=response.headers.get("content-type"),
+        headers={ "Cache-Control": "no-cache", "X-Accel-Buffering": "no" })
+
+@vgrouter.post("/dropCoin/{gameid}")
+async def post_setcolumn(gameid: int, request: Request):
+    global shardRouter
+    return proxyResponse(await shardRouter.forward(shardRouter.getShard(gameid), "POST", "/dropCoin/" + str(gameid), request.query_params))
+
+@vgrouter.post("/moves/{gameid}")
+async def post_moves(gameid: int, request: Request):
+    global shardRouter
+    return proxyResponse(await shardRouter.forward(shardRouter.getShard(gameid), "POST", "/moves/" + str(gameid), None,
+        { "Content-Type": request.headers.get("content-type", "application/json") }, await request.body()))
+
+@vgrouter.post("/quitgame/{gameid}")
+async def post_quitgame(gameid: int):
+    global shardRouter
+    return proxyResponse(await shardRouter.forward(shardRouter.getShard(gameid), "POST", "/quitgame/" + str(gameid)))
+
+@vgrouter.get("/replay/{gameid}")
+async def get_replay(gameid: int):
+    global shardRouter
+    return proxyResponse(await shardRouter.forward(shardRouter.getShard(gameid), "GET", "/replay/" + str(gameid)))
+
+@vgrouter.get("/export")
+async def get_export(after: int = 0):
+    # archives of all shards one after another
+    global shardRouter
+
+    async def exportStream():
+        for iShard in range(len(shardRouter.arrShardUrls)):
+            response = await shardRouter.forwardStream(iShard, "/export", { "after": after })
+            try:
+                async for bChunk in response.aiter_raw():
+                    yield bChunk
+            finally:
+                await response.aclose()
+
+    return StreamingResponse(exportStream(), media_type="application/x-ndjson")
+
+@vgrouter.get("/stats")
+async def get_stats():
+    global shardRouter
+    arrResponses = await asyncio.gather(*[shardRouter.forward(iShard, "GET", "/stats") for iShard in range(len(shardRouter.arrShardUrls))])
+    return { "router": shardRouter.getStats(), "shards": [response.json() for response in arrResponses] }
+
+
+def startShards(iShards, sHost, iFirstPort):
+    # one gameserver process per shard, returns processes and URLs
+    arrProcesses = []
+    arrUrls = []
+    for iShard in range(iShards):
+        dictEnv = dict(os.environ, SHARDINDEX=str(iShard), SHARDCOUNT=str(iShards), SHARDSECRET=shardRouter.sShardSecret)
+        arrProcesses.append(subprocess.Popen([sys.executable, "-m", "uvicorn", "vgserver:vgserver",
+            "--host", sHost, "--port", str(iFirstPort + iShard), "--log-level", "warning",
+            "--app-dir", os.path.dirname(os.path.abspath(__file__))], env=dictEnv))
+        arrUrls.append("http://" + sHost + ":" + str(iFirstPort + iShard))
+
+    # wait until all shards answer
+    fDeadline = time.monotonic() + 30
+    for sUrl, process in zip(arrUrls, arrProcesses):
+        while True:
+            try:
+                httpx.get(sUrl + "/stats", timeout=1.0)
+                break
+            except httpx.HTTPError:
+                if process.poll() is not None or time.monotonic() > fDeadline:
+                    raise RuntimeError("Shard " + sUrl + " did not start")
+                time.sleep(0.2)
+    return arrProcesses, arrUrls
+
+
+def main(arrArgs=None):
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Sharded Connect 4 gameserver: router and one server process per shard")
+    parser.add_argument("--shards", type=int, default=os.cpu_count(), help="number of shards (server processes)")
+    parser.add_argument("--host", default="0.0.0.0", help="interface of router")
+    parser.add_argument("--port", type=int, default=3033, help="port of router, shards use the following ports")
+    args = parser.parse_args(arrArgs)
+
+    # shard files are relative to the current directory like the database of a single server
+    arrProcesses, arrUrls = startShards(args.shards, "127.0.0.1", args.port + 1)
+    try:
+        shardRouter.setShards(arrUrls)
+        uvicorn.run(vgrouter, host=args.host, port=args.port, log_level="info")
+    finally:
+        for process in arrProcesses:
+            process.terminate()
+        for process in arrProcesses:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from vgboard import VGBoard
+from vgbot import VGBotSolver
+
+#
+# vgselfplay
+#
+# plays games between bot strategies on all CPU cores, w/o HTTP and SQLite
+# the rules are the ones of GameDB (VGBoard: drop, win through last coin, stalemate)
+#
+#   python vgselfplay.py --strategies random greedy depth4 --games 1000 --output results.csv
+#
+# strategies:
+#   random  - random legal column
+#   greedy  - wins, if possible, blocks a winning cell of opponent, else random
+#   depthN  - alpha-beta search N plies deep (see VGBotSolver)
+#
+# results file has one line per game: strategy1,strategy2,winner,moves,columns
+# (winner 0 = stalemate, columns = sequence of played columns 1-7)
+
+
+class VGStrategy():
+    def __init__(self, sName, rng):
+        self.sName = sName
+        self.rng = rng
+        self.iDepth = 0
+        self.solver = None
+        if sName.startswith("depth"):
+            self.iDepth = int(sName[5:])
+            self.solver = VGBotSolver(sBookFile="", iTableSize=1 << 16)
+        elif sName not in ("random", "greedy"):
+            raise ValueError("Unknown strategy " + sName)
+
+    def move(self, board, playerNo):
+        if self.sName == "random":
+            return self.rng.choice(board.legalMoves())
+        if self.solver is not None:
+            return self.solver.bestMove(board, playerNo, float("inf"), self.iDepth)
+
+        # greedy
+        iMask = board.arrBitboards[0] | board.arrBitboards[1]
+        iPossible = (iMask + VGBotSolver.iBottomMask) & VGBotSolver.iBoardMask
+        arrLegal = board.legalMoves()
+        for iBitboard in (board.arrBitboards[playerNo - 1], board.arrBitboards[2 - playerNo]):
+            iWinning = VGBotSolver.winningCells(iBitboard, iMask) & iPossible
+            for iColumn in arrLegal:
+                if iWinning & VGBotSolver.arrColumnMasks[iColumn]:
+                    return iColumn
+        return self.rng.choice(arrLegal)
+
+
+def playGame(strategy1, strategy2, rng, iRandomPlies):
+    # returns winner (0 = stalemate) and played columns (0 based)
+    board = VGBoard()
+    arrStrategies = (None, strategy1, strategy2)
+    arrColumns = []
+    playerNo = 1
+    while not board.isFull():
+        if board.iMoves < iRandomPlies:
+            iColumn = rng.choice(board.legalMoves())
+        else:
+            iColumn = arrStrategies[playerNo].move(board, playerNo)
+        board.dropCoin(iColumn, playerNo)
+        arrColumns.append(iColumn)
+        if board.isWinningDrop(iColumn, playerNo):
+            return playerNo, arrColumns
+        playerNo = 3 - playerNo
+    return 0, arrColumns
+
+
+def playBatch(sStrategy1, sStrategy2, iGames, iSeed, iRandomPlies):
+    # runs in worker process, returns compact result lines
+    rng = random.Random(iSeed)
+    strategy1 = VGStrategy(sStrategy1, rng)
+    strategy2 = VGStrategy(sStrategy2, rng)
+    arrLines = []
+    for iGame in range(iGames):
+        iWinner, arrColumns = playGame(strategy1, strategy2, rng, iRandomPlies)
+        arrLines.append(sStrategy1 + "," + sStrategy2 + "," + str(iWinner) + "," + str(len(arrColumns)) + ","
+            + "".join([str(iColumn + 1) for iColumn in arrColumns]))
+    return arrLines
+
+
+def runTournament(arrStrategies, iGames, iBatchSize, iWorkers, iSeed, iRandomPlies, fOutput):
+    # every pair of strategies plays iGames games in both colors
+    dictStats = {}
+    arrJobs = []
+    for sStrategy1, sStrategy2 in itertools.permutations(arrStrategies, 2) if len(arrStrategies) > 1 else [(arrStrategies[0], arrStrategies[0])]:
+        dictStats[(sStrategy1, sStrategy2)] = [0, 0, 0, 0]    # stalemates, wins 1, wins 2, moves
+        for iStart in range(0, iGames, iBatchSize):
+            arrJobs.append((sStrategy1, sStrategy2, min(iBatchSize, iGames - iStart), iSeed + len(arrJobs), iRandomPlies))
+
+    fStart = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=iWorkers) as executor:
+        arrFutures = [executor.submit(playBatch, *job) for job in arrJobs]
+        for future in as_completed(arrFutures):
+            arrLines = future.result()
+            if fOutput is not None:
+                fOutput.write("\n".join(arrLines) + "\n")
+            for sLine in arrLines:
+                sStrategy1, sStrategy2, sWinner, sMoves, sColumns = sLine.split(",")
+                arrStats = dictStats[(sStrategy1, sStrategy2)]
+                arrStats[int(sWinner)] += 1
+                arrStats[3] += int(sMoves)
+    fDuration = time.perf_counter() - fStart
+
+    iTotal = sum(arrStats[0] + arrStats[1] + arrStats[2] for arrStats in dictStats.values())
+    jSummary = { "games": iTotal, "seconds": round(fDuration, 3),
+        "games_per_second": round(iTotal / fDuration, 1) if fDuration else 0.0, "pairings": [] }
+    for (sStrategy1, sStrategy2), arrStats in dictStats.items():
+        iPlayed = arrStats[0] + arrStats[1] + arrStats[2]
+        jSummary["pairings"].append({ "player1": sStrategy1, "player2": sStrategy2, "games": iPlayed,
+            "win1": round(arrStats[1] / iPlayed, 4), "win2": round(arrStats[2] / iPlayed, 4),
+            "stalemate": round(arrStats[0] / iPlayed, 4), "avg_moves": round(arrStats[3] / iPlayed, 2) })
+    return jSummary
+
+
+def main(arrArgs=None):
+    parser = argparse.ArgumentParser(description="Self-play tournament of Connect 4 bot strategies")
+    parser.add_argument("--strategies", nargs="+", default=["random", "greedy"], help="random, greedy or depthN")
+    parser.add_argument("--games", type=int, default=1000, help="games per pairing (and color)")
+    parser.add_argument("--batch", type=int, default=500, help="games per job of a worker process")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--seed", type=int, default=4, help="random seed")
+    parser.add_argument("--random-plies", type=int, default=2, help="first moves played randomly, so games differ")
+    parser.add_argument("--output", default=None, help="results file, one line per game")
+    args = parser.parse_args(arrArgs)
+
+    for sStrategy in args.strategies:
+        VGStrategy(sStrategy, None)
+
+    fOutput = open(args.output, "w") if args.output else None
+    try:
+        jSummary = runTournament(args.strategies, args.games, args.batch, args.workers, args.seed, args.random_plies, fOutput)
+    finally:
+        if fOutput is not None:
+            fOutput.close()
+
+    print("{:<10} {:<10} {:>8} {:>7} {:>7} {:>7} {:>7}".format("player1", "player2", "games", "win1", "win2", "draw", "moves"))
+    for jPairing in jSummary["pairings"]:
+        print("{:<10} {:<10} {:>8} {:>7.1%} {:>7.1%} {:>7.1%} {:>7.2f}".format(jPairing["player1"], jPairing["player2"],
+            jPairing["games"], jPairing["win1"], jPairing["win2"], jPairing["stalemate"], jPairing["avg_moves"]))
+    print(jSummary["games"], "games in", jSummary["seconds"], "s,", jSummary["games_per_second"], "games/s")
+    return jSummary
+
+
+if __name__ == "__main__":
+    main()
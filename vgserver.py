@@ -1,14 +1,33 @@
-from sqlite3 import Row
-from fastapi import FastAPI, HTTPException
+import time
+# phases of startup are timed from here on (python vgserver.py --check-startup)
+fStartupBegin:float = time.perf_counter()
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 import uuid
+import hmac
+import threading
+from collections import OrderedDict
+import asyncio
 import json
-import sys
+import os
 import vgdatabase
+from vgnotify import VGGameNotifier
+from vgbroadcast import VGGameBroadcaster
+from vgasync import VGAsyncGameController
+from vgboard import VGBoard, VGBoardShape
+from vgdbpool import VGConnectionPool
+from vgmetrics import VGMetrics
+import vgwire
+# bot, reaper, metrics middleware and profiler are imported below, only when enabled
 
 # start server for api w/ 
 #   uvicorn --reload --port 3033 vgserver:vgserver
+#
+# endpoints are async and use the async game controller, scripts can still
+# use the sync API of VGGameController / GameDB directly
 
 #
 # class VGGameController
@@ -17,102 +36,561 @@ import vgdatabase
 # implements inferface for API endpoints to game logic
 
 class VGGameController(vgdatabase.GameDB):
+    # static parts of the pitch, built once
+    # centered layout should have fixed size in columns and rows to avoid "jumping pitch"
+    sInfoPadding:str = " " * 80
+    # footer w/ column numbers per number of columns, classic board: "   ---...---\n      1   2 ...   7"
+    dictBoardFooters = {}
+    arrCellSymbols = (" ", "X", "O")
+    dictStatusInfo = {
+        "MYTURN": "It's your turn, please select your column\n\n\n\n",
+        "OTHERTURN": "Please wait, it's others players turn...\n\n\n\n",
+        "WAITING": "Waiting for second player to join\n\n\n\n",
+        "CANCELED": "Your opponent was scared? - He quit\n\nPress 's' to start a new game\n\n",
+        "STALEMATE": "Did not know that this could even happen... ;) - STALEMATE\n\nPress 's' for next try...\n\n",
+        "WON": "YIPEEE - You WON :)\n\nPress 's' because it feels good...\n\n",
+        "LOST": "YIP... mpffff - seems, you lost. Need a hankie?\n\nPress 's' to try better...\n\n" }
+    # information for spectators, same for all of them
+    dictSpectatorInfo = {
+        "WAITING": "Waiting for second player to join",
+        "PLAYER1": "Player 1 (X) is on turn",
+        "PLAYER2": "Player 2 (O) is on turn",
+        "1WON": "Player 1 (X) won",
+        "2WON": "Player 2 (O) won",
+        "STALEMATE": "STALEMATE",
+        "CANCELED": "Game was canceled" }
+    # max. number of rendered pitches kept, one per game and player
+    iPitchCacheSize:int = 20000
+
+    def _renderStatusInfo(self, sStatus, playerNo):
+        # information on current game, depending on status and player
+        if sStatus == "PLAYER1" or sStatus == "PLAYER2":
+            if sStatus == "PLAYER" + str(playerNo):
+                return self.dictStatusInfo["MYTURN"]
+            return self.dictStatusInfo["OTHERTURN"]
+        if sStatus in self.dictStatusInfo:
+            return self.dictStatusInfo[sStatus]
+        if sStatus == str(playerNo) + "WON":
+            return self.dictStatusInfo["WON"]
+        return self.dictStatusInfo["LOST"]
+
+    def _getBoardFooter(self, iColumns):
+        sFooter = self.dictBoardFooters.get(iColumns)
+        if sFooter is None:
+            sFooter = ("   " + "-" * (iColumns * 4 + 2) + "\n"
+                + "   " + "".join("   " + str(iColumn + 1) for iColumn in range(iColumns)))
+            self.dictBoardFooters[iColumns] = sFooter
+        return sFooter
+
+    def _renderBoard(self, gameBoard):
+        # one line per row: "    | X | O |   ... |", size of board depends on game
+        arrLines = []
+        for iRow in range(gameBoard.boardRows):
+            arrLines.append("    | " + " | ".join([self.arrCellSymbols[gameBoard.getCell(iRow, iColumn)]
+                for iColumn in range(gameBoard.boardColumns)]) + " |\n")
+        arrLines.append(self._getBoardFooter(gameBoard.boardColumns))
+        return "".join(arrLines)
+
     def renderPitch(self, gameID, playerNo):
         # render screen w/ board, additional information and instructions
+        # pitches are cached per game and player and only rendered again,
+        # when version of game changed
+        iVersion = self.getGameVersion(gameID)
+        tKey = (gameID, playerNo)
+        with self.pitchLock:
+            cached = self.dictPitchCache.get(tKey)
+            if cached is not None and cached[0] == iVersion:
+                self.dictPitchCache.move_to_end(tKey)
+                self.iPitchHits += 1
+                return cached[1]
+            self.iPitchMisses += 1
+
+        sPitch = "".join((
+            self.sInfoPadding,
+            "\nHi Player #", str(playerNo), ", rou're playing game: ", str(gameID), "\n\n",
+            self._renderStatusInfo(self.getGameStatus(gameID), playerNo),
+            self._renderBoard(self.getGameBitboard(gameID))))
+
+        with self.pitchLock:
+            self.dictPitchCache[tKey] = (iVersion, sPitch)
+            self.dictPitchCache.move_to_end(tKey)
+            if len(self.dictPitchCache) > self.iPitchCacheSize:
+                self.dictPitchCache.popitem(last=False)
+        return sPitch
+
+    def getBoardData(self, gameID):
+        # structured board for clients rendering the pitch themselves:
+        # board as list of rows (row 0 on top, 0 = empty, 1/2 = player) and
+        # the bitboards of both players (see VGBoard for the bit layout)
+        gameBoard = self.getGameBitboard(gameID)
+        return { "board": gameBoard.toList(), "bitboards": list(gameBoard.arrBitboards),
+            "rows": gameBoard.boardRows, "columns": gameBoard.boardColumns, "connect": gameBoard.iConnect }
 
-        # information on current game
-        sInfo = ""
-        # centered layout should have fixed size in columns and rows to avoid "jumping pitch"
-        for i in range(80):
-            sInfo = sInfo + " "
-
-        sInfo = sInfo + "\nHi Player #" + str(playerNo) + ", rou're playing game: " + str(gameID) + "\n\n"
-        if self.isGameActive(gameID):
-            if self.isItMyTurn(gameID, playerNo):
-                sInfo = sInfo + "It's your turn, please select your column\n\n\n\n"
-            else:
-                sInfo = sInfo + "Please wait, it's others players turn...\n\n\n\n"
+    def getPitchCacheStats(self):
+        with self.pitchLock:
+            return { "hits": self.iPitchHits, "misses": self.iPitchMisses, "entries": len(self.dictPitchCache) }
+
+    def getGameStatusData(self, gameID, playerNo, sFormat="pitch"):
+        # game status as returned to clients by /gamestatus and /gameevents
+        # sFormat "pitch": rendered pitch, "board": structured board only
+        # version is read first, so it never is newer than the rendered pitch
+        iVersion = self.getGameVersion(gameID)
+        jData = { "gameid": gameID, "version": iVersion, "status": self.getGameStatus(gameID) }
+        if sFormat == "board":
+            jData.update(self.getBoardData(gameID))
         else:
-            if self.getGameStatus(gameID) == "WAITING":
-                sInfo = sInfo + "Waiting for second player to join\n\n\n\n"
-            elif self.getGameStatus(gameID) == "CANCELED":
-                sInfo = sInfo + "Your opponent was scared? - He quit\n\nPress 's' to start a new game\n\n"
-            elif self.getGameStatus(gameID) == "STALEMATE":
-                sInfo = sInfo + "Did not know that this could even happen... ;) - STALEMATE\n\nPress 's' for next try...\n\n"
-            else:
-                if self.didIWin(gameID, playerNo):
-                    sInfo = sInfo + "YIPEEE - You WON :)\n\nPress 's' because it feels good...\n\n"
-                else:
-                    sInfo = sInfo + "YIP... mpffff - seems, you lost. Need a hankie?\n\nPress 's' to try better...\n\n"
-
-        # render board
-        arrBoard = self.getGameBoard(gameID)
-        board = ""
-        prepend = "   "
-        for x in range(self.boardRows):
-            for y in range(self.boardColumns):
-                sField = " "
-                if arrBoard[x][y] == 1:
-                    sField = "X"
-                if arrBoard[x][y] == 2:
-                    sField = "O"
-                board += prepend  + " | " + sField
-                prepend = ""
-            board += " |\n"
-            prepend = "   "
-        board += prepend + "------------------------------\n"
-        board += prepend + "   1   2   3   4   5   6   7"
-        
-        return sInfo + board
-        
-    def __init__(self):
-        super().__init__()
+            jData["pitch"] = self.renderPitch(gameID, playerNo)
+        return jData
+
+    def getGameFrame(self, gameID):
+        # compact binary game status (see vgwire), packed straight from the cached game
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return None
+        with self.gameCache.lock:
+            return vgwire.packFrame(game.gameID, game.iVersion, game.sStatus, game.board)
+
+    def getSpectatorData(self, gameID):
+        # game status for spectators w/ board and pitch, the same for all of them,
+        # so it is rendered only once per version (see VGGameBroadcaster)
+        game = self._getCachedGame(gameID)
+        if game is None:
+            return None
+        # board is replaced (not changed) by moves, so it fits to version and status
+        with self.gameCache.lock:
+            iVersion, sStatus, board = game.iVersion, game.sStatus, game.board
+        sPitch = "".join((
+            self.sInfoPadding,
+            "\nSpectating game: ", str(gameID), "\n\n",
+            self.dictSpectatorInfo[sStatus], "\n\n\n\n",
+            self._renderBoard(board)))
+        return { "gameid": gameID, "version": iVersion, "status": sStatus, "pitch": sPitch, "board": board.toList(),
+            "rows": board.boardRows, "columns": board.boardColumns, "connect": board.iConnect }
+
+    def getGameETag(self, gameID, playerNo, iVersion, sFormat="pitch"):
+        # pitch differs for both players, so player is part of the ETag
+        # versions are only stored w/ a flush, after a crash a version can come back w/ another
+        # board, so the epoch of the process makes ETags of an earlier run never match
+        return ('"' + self.sEpoch + "-" + str(gameID) + "-" + str(playerNo) + "-" + str(iVersion)
+            + ("-" + sFormat if sFormat != "pitch" else "") + '"')
+
+    def isCurrentEpoch(self, sETag):
+        # True, if ETag was handed out by this process (versions in it can be compared)
+        return sETag is not None and sETag.startswith('"' + self.sEpoch + "-")
+
+    def __init__(self, sFilename='/db/gameserver.sqlite', iShardIndex=0, iShardCount=1):
+        super().__init__(sFilename, iShardIndex=iShardIndex, iShardCount=iShardCount)
+        self.dictPitchCache = OrderedDict()
+        self.pitchLock = threading.Lock()
+        self.iPitchHits = 0
+        self.iPitchMisses = 0
+        # changes w/ every start of the server, see getGameETag
+        self.sEpoch = uuid.uuid4().hex[:8]
 
 ## START Gameserver
-gameController = VGGameController()
+# seconds per phase of startup
+dictStartupTimes = {}
+fPhaseEnd:float = fStartupBegin
+
+def markStartup(sPhase):
+    # phase sPhase ended now
+    global fPhaseEnd
+    fNow = time.perf_counter()
+    dictStartupTimes[sPhase] = fNow - fPhaseEnd
+    fPhaseEnd = fNow
+
+markStartup("imports")
+
+# METRICS=1 times endpoints, game controller methods and SQLite commits (/metrics),
+# disabled nothing is wrapped; PROFILER=1 enables the sampling profiler (/debug/profile)
+metrics = VGMetrics(os.getenv("METRICS", "0") == "1")
+metrics.instrumentDatabase(VGConnectionPool)
+profiler = None
+if os.getenv("PROFILER", "0") == "1":
+    from vgmetrics import VGSamplingProfiler
+    profiler = VGSamplingProfiler()
+
+# sharded deployment (see vgrouter): server is shard SHARDINDEX of SHARDCOUNT w/ its own database file,
+# holding the games w/ game_id % SHARDCOUNT == SHARDINDEX, matchmaking is done by the router
+iShardIndex:int = int(os.getenv("SHARDINDEX", "0"))
+iShardCount:int = int(os.getenv("SHARDCOUNT", "1"))
+if iShardCount > 1:
+    gameController = VGGameController('/db/gameserver-' + str(iShardIndex) + '.sqlite', iShardIndex, iShardCount)
+else:
+    gameController = VGGameController()
+# methods called by the endpoints (through the async controller), renderPitch by getGameStatusData
+metrics.timeMethods(gameController, ("dropCoin", "dropCoins", "setGameStatus", "attachPlayerToFreeGameSlot",
+    "getGameStatusData", "getGameFrame", "getSpectatorData", "renderPitch"), "vg_gamedb_call_seconds")
+metrics.timeMethods(gameController.gameCache, ("flush",), "vg_cache_flush_seconds")
+# clients subscribed to /gameevents are woken up on every change of their game
+gameNotifier = VGGameNotifier()
+gameController.addGameListener(gameNotifier.publish)
+# async API used by endpoints, database access is done by a single writer task
+asyncController = VGAsyncGameController(gameController)
+# spectators of a game share one rendering per version and one pump task (/spectate)
+broadcaster = VGGameBroadcaster(asyncController, gameNotifier)
+markStartup("database")
+# up to PRELOADGAMES running and waiting games are loaded into the cache on startup
+iPreloadGames:int = int(os.getenv("PRELOADGAMES", "1000"))
+
+# games waiting longer than BOTTIMEOUT seconds for a second player get a computer opponent
+# (0 disables the bot), sharded the router decides, when the bot joins
+fBotJoinTimeout:float = float(os.getenv("BOTTIMEOUT", "30"))
+botManager = None
+if fBotJoinTimeout > 0:
+    from vgbot import VGBotManager
+    botManager = VGBotManager(gameController, fBotJoinTimeout if iShardCount == 1 else 0)
+
+# seconds between keep-alive comments on idle event streams
+iEventKeepAlive:int = 15
+# max. seconds a long-poll request on /gamestatus is parked
+iMaxLongPoll:int = 60
+
+# every REAPINTERVAL seconds (0 disables it) games w/o change for INACTIVETIMEOUT seconds
+# are canceled, finished games archived and free pages of the database file released
+fReapInterval:float = float(os.getenv("REAPINTERVAL", "60"))
+fInactiveTimeout:float = float(os.getenv("INACTIVETIMEOUT", "3600"))
+reaper = None
+if fReapInterval > 0:
+    from vgreaper import VGReaper
+    reaper = VGReaper(asyncController, fReapInterval, fInactiveTimeout)
 
 ### GameServer API
 vgserver = FastAPI()
+if metrics.bEnabled:
+    from vgmetrics import VGMetricsMiddleware
+    vgserver.add_middleware(VGMetricsMiddleware, metrics=metrics)
+
+@vgserver.on_event("startup")
+async def startup():
+    global asyncController, reaper
+    await asyncController.start()
+    if iPreloadGames > 0:
+        await asyncController.preloadActiveGames(iPreloadGames)
+    if reaper is not None:
+        reaper.start()
+
+@vgserver.on_event("shutdown")
+async def shutdown():
+    # finish queued requests and write cached game states before server stops
+    global asyncController, botManager, reaper
+    if reaper is not None:
+        await reaper.stop()
+    if botManager is not None:
+        botManager.stop()
+    await asyncController.stop()
 
 @vgserver.get("/registersession")
-def get_registersession():
+async def get_registersession():
     # client requests for a new session token
-    global gameController
+    global asyncController
     sSessionToken = str(uuid.uuid1())
-    gameController.registerSession(sSessionToken)
+    await asyncController.registerSession(sSessionToken)
     return {"token": sSessionToken }
 
 @vgserver.get("/requestgame/{session}")
-def get_requestgame(session: str):
+async def get_requestgame(session: str, rows: Optional[int] = None, columns: Optional[int] = None, connect: Optional[int] = None):
     # already registered client requests for a new game
     # checks, if session is valid (already registered)
-    global gameController
-    if not gameController.isSessionRegistered(session):
+    # rows/columns/connect request a board variant, default is the classic 7x6 connect 4
+    global asyncController
+    if not VGBoardShape.isValid(rows or VGBoard.boardRows, columns or VGBoard.boardColumns, connect or VGBoard.iConnect):
+        raise HTTPException(status_code=422, detail="Invalid board size")
+    if session in vgdatabase.GameDB.arrReservedTokens:
+        raise HTTPException(status_code=403, detail="Reserved session")
+    if not await asyncController.isSessionRegistered(session):
         return False
     else:
-        # returns { "gameid": gameID, "playerno": playerNo, "status": gameStatus }
-        return gameController.attachPlayerToFreeGameSlot(session)
+        # returns { "gameid": gameID, "playerno": playerNo, "status": gameStatus, "rows": .., "columns": .., "connect": .. }
+        return await asyncController.attachPlayerToFreeGameSlot(session, rows, columns, connect)
 
 @vgserver.get("/gamestatus/{gameid}")
-def get_gamestatus(gameid: int, playerno: int):
-    global gameController
-    status = gameController.getGameStatus(gameid)
-    pitch = gameController.renderPitch(gameid, playerno)
+async def get_gamestatus(gameid: int, playerno: int, request: Request, since: Optional[int] = None, wait: float = 0,
+        format: Literal["pitch", "board", "frame"] = "pitch"):
+    # returns 304, if client already has current version (If-None-Match)
+    # with since/wait request is parked until version is newer than since or wait seconds passed
+    # format=board returns structured board instead of rendered pitch, other formats are refused (422),
+    # as format is part of the ETag; format=frame or
+    # "Accept: application/x-vg-frame" returns compact binary frame instead of JSON (see vgwire)
+    global gameController, asyncController, gameNotifier
+    if vgwire.acceptsFrame(request.headers.get("accept")):
+        format = "frame"
+    if since is not None and request.headers.get("if-none-match") is not None and not gameController.isCurrentEpoch(request.headers.get("if-none-match")):
+        # version of an earlier run of the server, not comparable -> answer right away
+        since = None
+    if since is not None and wait > 0:
+        # subscribe before reading version, so no change can be missed
+        subscription = gameNotifier.subscribe(gameid)
+        try:
+            loop = asyncio.get_running_loop()
+            fDeadline = loop.time() + min(wait, iMaxLongPoll)
+            iVersion = await asyncController.getGameVersion(gameid)
+            while iVersion is not False and iVersion <= since:
+                fRemaining = fDeadline - loop.time()
+                if fRemaining <= 0 or not await gameNotifier.wait(subscription, fRemaining):
+                    break
+                iVersion = await asyncController.getGameVersion(gameid)
+        finally:
+            gameNotifier.unsubscribe(gameid, subscription)
+    else:
+        iVersion = await asyncController.getGameVersion(gameid)
 
-    return { "gameid": gameid, "status": status, "pitch": pitch }
+    if iVersion is False:
+        raise HTTPException(status_code=404, detail="Unknown game")
+    if request.headers.get("if-none-match") == gameController.getGameETag(gameid, playerno, iVersion, format):
+        return Response(status_code=304, headers={ "ETag": gameController.getGameETag(gameid, playerno, iVersion, format), "Vary": "Accept" })
 
-@vgserver.post("/dropCoin/{gameid}")
-def post_setcolumn(gameid: int, playerno: int, key: str):
+    if format == "frame":
+        # version in ETag is taken from the frame, as game might have changed meanwhile
+        bFrame = await asyncController.getGameFrame(gameid)
+        iVersion = vgwire.structHeader.unpack_from(bFrame)[6]
+        return Response(content=bFrame, media_type=vgwire.sMediaType,
+            headers={ "ETag": gameController.getGameETag(gameid, playerno, iVersion, format), "Vary": "Accept" })
+    jData = await asyncController.getGameStatusData(gameid, playerno, format)
+    return JSONResponse(jData, headers={ "ETag": gameController.getGameETag(gameid, playerno, jData["version"], format), "Vary": "Accept" })
+
+@vgserver.get("/gameevents/{gameid}")
+async def get_gameevents(gameid: int, playerno: int, request: Request, format: Literal["pitch", "board"] = "pitch"):
+    # server-sent events: pushes game status (same as /gamestatus) once on
+    # subscription and again on every change of the game, until it is finished
+    global asyncController, gameNotifier
+    if await asyncController.getGameVersion(gameid) is False:
+        raise HTTPException(status_code=404, detail="Unknown game")
+    # status is sent after subscribing, so no change can be missed
+    subscription = gameNotifier.subscribe(gameid)
+
+    async def eventStream():
+        try:
+            bChanged = True
+            while not await request.is_disconnected():
+                if bChanged:
+                    jData = await asyncController.getGameStatusData(gameid, playerno, format)
+                    yield "data: " + json.dumps(jData) + "\n\n"
+                    if jData["status"] not in ("WAITING", "PLAYER1", "PLAYER2"):
+                        break
+                else:
+                    # keep connection open through proxies
+                    yield ": keep-alive\n\n"
+                bChanged = await gameNotifier.wait(subscription, iEventKeepAlive)
+        finally:
+            gameNotifier.unsubscribe(gameid, subscription)
+
+    return StreamingResponse(eventStream(), media_type="text/event-stream",
+        headers={ "Cache-Control": "no-cache", "X-Accel-Buffering": "no" })
+
+@vgserver.get("/spectate/{gameid}")
+async def get_spectate(gameid: int):
+    # read-only game status for spectators, shared by all of them (see /spectate/{gameid}/events)
+    global broadcaster
+    rendered = await broadcaster.getMessage(gameid)
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Unknown game")
+    return Response(content=rendered[2], media_type="application/json")
+
+@vgserver.get("/spectate/{gameid}/events")
+async def get_spectate_events(gameid: int):
+    # server-sent events for spectators: status of game (as /spectate) on subscription and
+    # on every change until game is finished; spectators not reading fast enough are dropped
+    global broadcaster
+    if await broadcaster.getMessage(gameid) is None:
+        raise HTTPException(status_code=404, detail="Unknown game")
+    return StreamingResponse(broadcaster.stream(gameid), media_type="text/event-stream",
+        headers={ "Cache-Control": "no-cache", "X-Accel-Buffering": "no" })
+
+@vgserver.get("/stats")
+async def get_stats():
+    # counters of caches, matchmaking, spectators, bot and maintenance
+    global gameController, asyncController, broadcaster, botManager, reaper
+    return { "cache": gameController.getCacheStats(), "pitchcache": gameController.getPitchCacheStats(),
+        "matchmaking": gameController.getMatchmakingStats(), "writerqueue": asyncController.getQueueDepth(),
+        "spectators": broadcaster.getStats(),
+        "bot": botManager.getStats() if botManager is not None else None,
+        "maintenance": reaper.getStats() if reaper is not None else None }
+
+@vgserver.get("/metrics")
+async def get_metrics():
+    # Prometheus text format, gauges are read at scrape time
+    global gameController, asyncController, metrics
+    if not metrics.bEnabled:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    dictCounts = await run_in_threadpool(gameController.getGameCounts)
+    jCache = gameController.getCacheStats()
+    jMatchmaking = gameController.getMatchmakingStats()
+    arrGauges = [
+        ("vg_games", "Stored games per status", [((("status", sStatus),), iCount) for sStatus, iCount in sorted(dictCounts.items())]),
+        ("vg_games_active", "Running games (PLAYER1/PLAYER2)", [((), dictCounts.get("PLAYER1", 0) + dictCounts.get("PLAYER2", 0))]),
+        ("vg_games_waiting", "Games waiting for a second player", [((), jMatchmaking["depth"])]),
+        ("vg_games_finished", "Finished games, not yet archived", [((), sum(iCount for sStatus, iCount in dictCounts.items()
+            if sStatus not in ("WAITING", "PLAYER1", "PLAYER2", "ARCHIVED")))]),
+        ("vg_matchmaking_oldest_waiting_seconds", "Wait time of oldest waiting game", [((), jMatchmaking["oldestwaiting"])]),
+        ("vg_writer_queue_depth", "Requests queued for the writer task", [((), asyncController.getQueueDepth())]),
+        ("vg_cache_entries", "Games in cache", [((), jCache["entries"])]),
+        ("vg_cache_dirty", "Cached games not yet written", [((), jCache["dirty"])]) ]
+    arrCounters = [
+        ("vg_cache_hits_total", "Hits of game cache since start", [((), jCache["hits"])]),
+        ("vg_cache_misses_total", "Misses of game cache since start", [((), jCache["misses"])]) ]
+    return PlainTextResponse(metrics.render(arrGauges, arrCounters), media_type="text/plain; version=0.0.4")
+
+@vgserver.get("/debug/profile")
+async def get_debug_profile(seconds: float = 5.0, top: int = 20, idle: bool = False):
+    # hottest stacks of all threads sampled for seconds (max. 60), collapsed format
+    global profiler
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiler disabled")
+    try:
+        return PlainTextResponse(await run_in_threadpool(profiler.profile, min(max(seconds, 0.1), 60.0), top, idle))
+    except RuntimeError as error:
+        raise HTTPException(status_code=409, detail=str(error))
+
+### internal API of a shard, used by vgrouter
+# only served by shards (SHARDCOUNT > 1) and only to requests w/ the secret shared w/ the router
+# (SHARDSECRET, set by vgrouter for the shards it starts), clients have no access to it
+sShardSecret:str = os.getenv("SHARDSECRET", "")
+if iShardCount > 1 and not sShardSecret:
+    raise RuntimeError("SHARDSECRET must be set for shards (SHARDCOUNT > 1)")
+
+def checkShardSecret(request: Request):
+    if not hmac.compare_digest(request.headers.get("x-shard-secret", ""), sShardSecret):
+        raise HTTPException(status_code=403, detail="Shard API only for router")
+
+def checkShardSession(session, bBotAllowed=False):
+    # tokens of internal players are refused, only the bot may join games (router decides, when)
+    if session in vgdatabase.GameDB.arrReservedTokens and not (bBotAllowed and session == vgdatabase.GameDB.sBotToken):
+        raise HTTPException(status_code=403, detail="Reserved session")
+
+shardAPI = APIRouter(prefix="/shard", dependencies=[Depends(checkShardSecret)])
+
+@shardAPI.get("/registersession/{session}")
+async def get_shard_registersession(session: str):
+    global asyncController
+    checkShardSession(session)
+    await asyncController.registerSession(session)
+    return { "token": session }
+
+@shardAPI.get("/session/{session}")
+async def get_shard_session(session: str):
+    global asyncController
+    return { "registered": await asyncController.isSessionRegistered(session) }
+
+@shardAPI.post("/newgame/{session}")
+async def post_shard_newgame(session: str, rows: Optional[int] = None, columns: Optional[int] = None, connect: Optional[int] = None):
+    global asyncController
+    checkShardSession(session)
+    try:
+        return await asyncController.createWaitingGame(session, rows, columns, connect)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid board size")
+
+@shardAPI.post("/join/{gameid}")
+async def post_shard_join(gameid: int, session: str):
+    # False, if game was taken or canceled meanwhile
+    global asyncController, botManager
+    checkShardSession(session, bBotAllowed=True)
+    jResult = await asyncController.joinWaitingGame(gameid, session)
+    if jResult and botManager is not None and session == botManager.sBotToken:
+        botManager.adoptGame(gameid)
+    return jResult
+
+@shardAPI.get("/waiting")
+async def get_shard_waiting():
+    global asyncController
+    return [{ "gameid": gameID, "session": sSessionToken, "shape": list(tShape) }
+        for gameID, sSessionToken, tShape in await asyncController.getWaitingGames()]
+
+if iShardCount > 1:
+    vgserver.include_router(shardAPI)
+
+@vgserver.get("/replay/{gameid}")
+async def get_replay(gameid: int):
+    # move sequence of running or archived game, columns 1-7, player 1 starts
+    global asyncController
+    arrColumns = await asyncController.getGameMoves(gameid)
+    if arrColumns is False:
+        raise HTTPException(status_code=404, detail="Unknown game")
+    if arrColumns is None:
+        raise HTTPException(status_code=409, detail="Game has no move log")
+    return { "gameid": gameid, "status": await asyncController.getGameStatus(gameid),
+        "moves": [iColumn + 1 for iColumn in arrColumns] }
+
+@vgserver.get("/export")
+def get_export(after: int = 0):
+    # archived games with ID > after as newline delimited JSON, one game per line
+    # streamed in batches straight from the archive table (read only, so w/o writer task)
     global gameController
+    return StreamingResponse((json.dumps(jGame) + "\n" for jGame in gameController.exportGames(after)),
+        media_type="application/x-ndjson")
+
+@vgserver.post("/dropCoin/{gameid}")
+async def post_setcolumn(gameid: int, playerno: int, key: str, version: Optional[int] = None):
+    global asyncController
     # returns { "status": Statustext }
-    return gameController.dropCoin(gameid, playerno, key)
+    # with version the move is only done, if the game is still in this version
+    return await asyncController.dropCoin(gameid, playerno, key, version)
+
+class MovesRequest(BaseModel):
+    # columns 1 based, players alternate starting w/ the player, whose turn it is
+    moves: List[int]
+    version: Optional[int] = None
+
+@vgserver.post("/moves/{gameid}")
+async def post_moves(gameid: int, request: MovesRequest):
+    # applies all moves at once (or none, if one is not possible)
+    # returns { "status": "ok", "gamestatus": .., "moves": .., "version": .. } or { "status": Statustext }
+    global asyncController
+    return await asyncController.dropCoins(gameid, request.moves, request.version)
 
 @vgserver.post("/quitgame/{gameid}")
-def post_quitgame(gameid: int):
+async def post_quitgame(gameid: int):
+    global asyncController
+    return await asyncController.setGameStatus(gameid, "CANCELED")
+
+markStartup("routes")
+
+
+async def checkStartup():
+    # runs startup of the server (writer, statements, preload) and a first request w/o
+    # opening a port, returns seconds of all phases
+    import httpx
     global gameController
-    return gameController.setGameStatus(gameid, "CANCELED")
+    fStart = time.perf_counter()
+    await startup()
+    dictStartupTimes["startup"] = time.perf_counter() - fStart
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=vgserver), base_url="http://check") as client:
+            fStart = time.perf_counter()
+            (await client.get("/stats")).raise_for_status()
+            dictStartupTimes["first request"] = time.perf_counter() - fStart
+    finally:
+        await shutdown()
+    return dictStartupTimes
 
-if __name__ == "__main__":
+
+def main(arrArgs=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Connect 4 gameserver")
+    parser.add_argument("--host", default="0.0.0.0", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=3033, help="port to listen on")
+    parser.add_argument("--check-startup", action="store_true", help="time startup phases and first request, then exit")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+        help="switch existing database to incremental vacuum (full VACUUM, blocks and needs free disk space), then exit")
+    args = parser.parse_args(arrArgs)
+
+    if args.enable_incremental_vacuum:
+        print("incremental vacuum", "enabled" if gameController.enableIncrementalVacuum() else "already enabled")
+        gameController.close()
+        return
+
+    if args.check_startup:
+        dictTimes = asyncio.run(checkStartup())
+        for sPhase, fSeconds in dictTimes.items():
+            print("%-14s %8.1f ms" % (sPhase, fSeconds * 1000))
+        print("%-14s %8.1f ms" % ("total", sum(dictTimes.values()) * 1000))
+        print("%-14s %8d" % ("cached games", gameController.getCacheStats()["entries"]))
+        return
     import uvicorn
-    uvicorn.run(vgserver, host="0.0.0.0", port=3033, log_level="info")
+    uvicorn.run(vgserver, host=args.host, port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
 
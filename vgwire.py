@@ -0,0 +1,46 @@
+import struct
+
+from vgboard import VGBoard
+
+#
+# vgwire
+#
+# implements compact binary game status for /gamestatus, sent instead of JSON,
+# when the client asks for it w/ "Accept: application/x-vg-frame"
+#
+# frame (little endian), 34 bytes for the classic board instead of ~700 bytes JSON:
+#   B  frame format (1)
+#   B  status code (index in arrStatusCodes)
+#   B  rows, B columns, B coins to win, 1 byte padding
+#   Q  game ID
+#   I  version of game
+#   both bitboards, same bytes as VGBoard.toBlob (half of the rest each)
+# the pitch is not sent, clients render the board themselves
+
+
+sMediaType:str = "application/x-vg-frame"
+iFrameFormat:int = 1
+# order is part of the format, new states have to be appended
+arrStatusCodes = ("WAITING", "PLAYER1", "PLAYER2", "1WON", "2WON", "STALEMATE", "CANCELED")
+dictStatusCodes = { sStatus: iCode for iCode, sStatus in enumerate(arrStatusCodes) }
+structHeader = struct.Struct("<BBBBBxQI")
+
+
+def acceptsFrame(sAccept):
+    # True, if Accept header of request asks for binary frames
+    return sAccept is not None and sMediaType in sAccept
+
+
+def packFrame(gameID, iVersion, sStatus, board):
+    return structHeader.pack(iFrameFormat, dictStatusCodes[sStatus], board.boardRows, board.boardColumns,
+        board.iConnect, gameID, iVersion) + board.toBlob()
+
+
+def unpackFrame(bFrame):
+    # frame -> { "gameid", "version", "status", "rows", "columns", "connect", "board" (VGBoard) }
+    iFormat, iStatus, iRows, iColumns, iConnect, gameID, iVersion = structHeader.unpack_from(bFrame)
+    if iFormat != iFrameFormat:
+        raise ValueError("Unknown frame format " + str(iFormat))
+    return { "gameid": gameID, "version": iVersion, "status": arrStatusCodes[iStatus],
+        "rows": iRows, "columns": iColumns, "connect": iConnect,
+        "board": VGBoard.fromBlob(bytes(bFrame[structHeader.size:]), iRows, iColumns, iConnect) }